@@ -0,0 +1,187 @@
+import asyncio
+import json
+import os
+import re
+import sys
+import tempfile
+from typing import Dict, List, Tuple
+
+from telegram import Update
+from telegram.request import BaseRequest, RequestData
+
+import config
+
+# Бот-заглушка, от имени которого приходят сообщения с кнопками
+BOT_USER = {'id': 1, 'is_bot': True, 'first_name': 'Sleepy', 'username': 'sleepy_stub_bot'}
+
+
+class StubRequest(BaseRequest):
+    """Bot API без сети: вызовы записываются, ответы - правдоподобные заглушки.
+
+    send*/edit* возвращают сообщение в тот же чат, остальные методы - True.
+    """
+
+    def __init__(self):
+        self.calls: List[Tuple[str, Dict]] = []
+        self._message_id = 10000
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    @property
+    def read_timeout(self):
+        return None
+
+    async def do_request(
+        self,
+        url: str,
+        method: str,
+        request_data: RequestData = None,
+        read_timeout=BaseRequest.DEFAULT_NONE,
+        write_timeout=BaseRequest.DEFAULT_NONE,
+        connect_timeout=BaseRequest.DEFAULT_NONE,
+        pool_timeout=BaseRequest.DEFAULT_NONE,
+    ) -> Tuple[int, bytes]:
+        name = url.rsplit('/', 1)[-1]
+        parameters = request_data.parameters if request_data else {}
+        if name == 'getMe':
+            return 200, json.dumps({'ok': True, 'result': BOT_USER}).encode()
+
+        self.calls.append((name, parameters))
+        if name.startswith(('send', 'edit')):
+            self._message_id += 1
+            result = {
+                'message_id': parameters.get('message_id', self._message_id),
+                'date': 0,
+                'chat': {'id': parameters.get('chat_id', 0), 'type': 'private'},
+                'from': BOT_USER,
+                'text': parameters.get('text', ''),
+            }
+        else:
+            result = True
+        return 200, json.dumps({'ok': True, 'result': result}).encode()
+
+
+def message_update(update_id: int, user_id: int, text: str) -> Dict:
+    """Текстовое сообщение (или команда) пользователя"""
+    message = {
+        'message_id': update_id, 'date': 0, 'text': text,
+        'chat': {'id': user_id, 'type': 'private'},
+        'from': {'id': user_id, 'is_bot': False, 'first_name': 'User'},
+    }
+    if text.startswith('/'):
+        message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+    return {'update_id': update_id, 'message': message}
+
+
+def callback_update(update_id: int, user_id: int, data: str, message_id: int = 500, text: str = "") -> Dict:
+    """Нажатие инлайн-кнопки под сообщением бота"""
+    return {'update_id': update_id, 'callback_query': {
+        'id': str(update_id), 'chat_instance': str(user_id), 'data': data,
+        'from': {'id': user_id, 'is_bot': False, 'first_name': 'User'},
+        'message': {
+            'message_id': message_id, 'date': 0, 'text': text,
+            'chat': {'id': user_id, 'type': 'private'}, 'from': BOT_USER,
+        },
+    }}
+
+
+def count_queries(storage) -> List[int]:
+    """Счетчик запросов хранилища SQLite.
+
+    Управление транзакциями не считается. Программы триггеров сообщают о себе
+    комментарием или повтором текста вызвавшего их оператора - повтор подряд
+    считается одним запросом.
+    """
+    counter = [0]
+    last = [None]
+    get_connection = storage.get_connection
+
+    def trace(sql: str):
+        if sql.lstrip().startswith('--') or sql == last[0]:
+            return
+        last[0] = sql
+        if not re.match(r'\s*(BEGIN|COMMIT|ROLLBACK)\b', sql, re.IGNORECASE):
+            counter[0] += 1
+
+    def traced_connection():
+        conn = get_connection()
+        conn.set_trace_callback(trace)
+        return conn
+
+    storage.get_connection = traced_connection
+    return counter
+
+
+async def run_actions(user_id: int = 1) -> List[Tuple[str, int, int, List[str]]]:
+    """Запись засыпания и пробуждения через меню и в быстром режиме: (действие, вызовы API, запросы, методы)"""
+    import bot
+    from query_plans import populate
+    from startup import startup_report
+
+    # Отчет о запуске здесь не нужен
+    startup_report.first_update_handled = True
+
+    stub = StubRequest()
+    bot.outbound.set_transport(stub)
+    storage = bot.default_instance.storage.get()
+    populate(storage, users=20, days=60)
+    queries = count_queries(storage)
+
+    application = bot.build_application(schedule_jobs=False)
+    await application.initialize()
+    next_id = iter(range(1, 1000000))
+
+    async def measure(name: str, updates: List[Dict]):
+        calls, executed = len(stub.calls), queries[0]
+        for data in updates:
+            await application.process_update(Update.de_json(data, application.bot))
+        results.append((name, len(stub.calls) - calls, queries[0] - executed,
+                        [method for method, _ in stub.calls[calls:]]))
+
+    results = []
+    try:
+        await measure("Уснул: меню и подтверждение", [
+            callback_update(next(next_id), user_id, data) for data in ("sleep", "sleep_now", "sleep_confirm")
+        ])
+        await measure("Проснулся: меню и подтверждение", [
+            callback_update(next(next_id), user_id, data) for data in ("wake", "wake_now", "wake_confirm")
+        ])
+        await measure("Уснул: быстрый режим", [message_update(next(next_id), user_id, bot.FAST_SLEEP_TEXT)])
+        await measure("Проснулся: быстрый режим", [message_update(next(next_id), user_id, bot.FAST_WAKE_TEXT)])
+        undo_id = application.user_data[user_id]['fast_undo']['id']
+        await measure("Отмена: быстрый режим", [
+            callback_update(next(next_id), user_id, f"fast_undo_{undo_id}", text="🌅 Проснулся")
+        ])
+    finally:
+        await application.shutdown()
+        await application.post_shutdown(application)
+    return results
+
+
+def main():
+    """Вызовы Bot API и запросы к базе на одно действие пользователя (база - синтетическая, API - заглушка)"""
+    with tempfile.TemporaryDirectory() as directory:
+        config.DATABASE_BACKEND = "sqlite"
+        config.DATABASE_NAME = os.path.join(directory, "costs.db")
+        config.ARCHIVE_DATABASE_NAME = os.path.join(directory, "costs_archive.db")
+        config.PERSISTENCE_FILE = None
+        config.HANDOFF_FILE = os.path.join(directory, "handoff.json")
+
+        results = asyncio.run(run_actions())
+        print(f"{'Действие':<34} {'Bot API':>8} {'Запросы к БД':>13}")
+        for name, calls, executed, methods in results:
+            print(f"{name:<34} {calls:>8} {executed:>13}   {', '.join(methods)}")
+
+    if '--check' in sys.argv:
+        # Быстрый режим: один ответ и не больше одной записи дня с журналом
+        fast = [row for row in results if 'быстрый' in row[0] and not row[0].startswith('Отмена')]
+        if any(calls > 1 or executed > 4 for _, calls, executed, _ in fast):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
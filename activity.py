@@ -0,0 +1,72 @@
+import asyncio
+import logging
+import time
+from datetime import datetime
+from typing import Dict
+
+from telegram.ext import Application, ContextTypes
+
+import config
+
+logger = logging.getLogger(__name__)
+
+
+class ActivityTracker:
+    """Время последней активности пользователей: копится в памяти и пишется в базу пачкой"""
+
+    def __init__(self, storage):
+        self.storage = storage
+        self._pending: Dict[int, datetime] = {}
+        self.metrics = {'touches': 0, 'flushes': 0, 'flushed_users': 0, 'failed_flushes': 0, 'flush_seconds': 0.0}
+
+    def touch(self, user_id: int):
+        """Отметка активности пользователя (без обращения к базе)"""
+        self._pending[user_id] = datetime.now()
+        self.metrics['touches'] += 1
+
+    async def flush(self) -> int:
+        """Запись накопленных отметок одним пакетным обновлением"""
+        if not self._pending:
+            return 0
+
+        # Подменяем словарь в потоке событий, новые отметки копятся уже в новом
+        pending, self._pending = self._pending, {}
+        started = time.perf_counter()
+        if not await asyncio.to_thread(self.storage.touch_users, pending):
+            # Не потеряли отметки: вернем их, если пользователь с тех пор не отметился снова
+            for user_id, seen_at in pending.items():
+                self._pending.setdefault(user_id, seen_at)
+            self.metrics['failed_flushes'] += 1
+            return 0
+
+        self.metrics['flushes'] += 1
+        self.metrics['flushed_users'] += len(pending)
+        self.metrics['flush_seconds'] += time.perf_counter() - started
+        return len(pending)
+
+    def stats(self) -> Dict:
+        """Метрики записи активности"""
+        return {**self.metrics, 'pending': len(self._pending)}
+
+
+async def flush_activity_job(context: ContextTypes.DEFAULT_TYPE):
+    """Периодическая запись активности из job queue"""
+    try:
+        await context.job.data.flush()
+    except Exception as e:
+        logger.error(f"Error flushing user activity: {e}")
+
+
+def schedule_activity_flush(application: Application, tracker: ActivityTracker):
+    """Регистрация периодической записи активности в job queue"""
+    if application.job_queue is None:
+        logger.warning("Job queue is not available, activity is written only on shutdown")
+        return
+
+    application.job_queue.run_repeating(
+        flush_activity_job,
+        interval=config.ACTIVITY_FLUSH_INTERVAL,
+        first=config.ACTIVITY_FLUSH_INTERVAL,
+        data=tracker,
+        name="activity_flush"
+    )
@@ -0,0 +1,68 @@
+import asyncio
+import logging
+import sys
+import time
+from datetime import date, timedelta
+
+from telegram.ext import Application, ContextTypes
+
+import config
+
+logger = logging.getLogger(__name__)
+
+
+async def archive_job(context: ContextTypes.DEFAULT_TYPE):
+    """Ночной перенос старых дней в архив, очистка журнала изменений и уплотнение базы"""
+    storage = context.job.data
+    cutoff = date.today() - timedelta(days=config.ARCHIVE_RETENTION_DAYS)
+    started = time.perf_counter()
+    archived = 0
+
+    # Небольшими транзакциями в отдельном потоке, чтобы не блокировать обработчики
+    while True:
+        moved = await asyncio.to_thread(storage.archive_days_before, cutoff, config.ARCHIVE_BATCH_SIZE)
+        archived += moved
+        if moved < config.ARCHIVE_BATCH_SIZE:
+            break
+
+    pruned = 0
+    if config.CHANGE_LOG_RETENTION_DAYS is not None:
+        pruned = await asyncio.to_thread(storage.prune_changes, config.CHANGE_LOG_RETENTION_DAYS)
+
+    if archived or pruned:
+        await asyncio.to_thread(storage.compact, config.ARCHIVE_VACUUM_PAGES)
+
+    logger.info(
+        f"Archived {archived} days before {cutoff}, pruned {pruned} change log entries "
+        f"in {time.perf_counter() - started:.2f}s"
+    )
+
+
+def schedule_archive_job(application: Application, storage):
+    """Регистрация ежедневной архивации в job queue"""
+    if config.ARCHIVE_RETENTION_DAYS is None:
+        return
+    if application.job_queue is None:
+        logger.warning("Job queue is not available, archiving is disabled")
+        return
+
+    application.job_queue.run_daily(archive_job, time=config.ARCHIVE_JOB_TIME, data=storage, name="archive")
+
+
+def main():
+    """Обслуживание архива: python archive.py vacuum - включение incremental auto_vacuum"""
+    if sys.argv[1:] != ['vacuum']:
+        print("Использование: python archive.py vacuum")
+        sys.exit(2)
+
+    from database import Database
+
+    started = time.perf_counter()
+    if Database(config.DATABASE_NAME).enable_incremental_vacuum():
+        print(f"Incremental auto_vacuum включен за {time.perf_counter() - started:.1f} с")
+    else:
+        print("Incremental auto_vacuum уже включен (или ошибка - см. лог)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,300 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import struct
+import sys
+import tempfile
+import time
+import zlib
+from datetime import datetime
+from typing import Dict, List, Optional
+
+import config
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_NAME = "manifest.json"
+DELTA_MAGIC = b"SLPYDLT1"
+
+
+def read_change_counter(db_path: str) -> int:
+    """Счетчик изменений из заголовка файла SQLite (растет при каждой записи)"""
+    with open(db_path, 'rb') as f:
+        f.seek(24)
+        return int.from_bytes(f.read(4), 'big')
+
+
+def file_sha256(path: str) -> str:
+    """Контрольная сумма файла"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def load_manifest(backup_dir: str) -> List[Dict]:
+    """Список снимков в порядке создания"""
+    path = os.path.join(backup_dir, MANIFEST_NAME)
+    if not os.path.exists(path):
+        return []
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_manifest(backup_dir: str, snapshots: List[Dict]):
+    """Атомарная запись списка снимков"""
+    path = os.path.join(backup_dir, MANIFEST_NAME)
+    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(snapshots, f, ensure_ascii=False, indent=2)
+    os.replace(path + '.tmp', path)
+
+
+def write_delta(base_path: str, new_path: str, delta_path: str, page_size: int) -> int:
+    """Запись страниц new_path, отличающихся от base_path; возвращает число страниц"""
+    changed = 0
+    compressor = zlib.compressobj()
+    page_count = os.path.getsize(new_path) // page_size
+
+    with open(base_path, 'rb') as base, open(new_path, 'rb') as new, open(delta_path, 'wb') as out:
+        out.write(DELTA_MAGIC)
+        out.write(compressor.compress(struct.pack('>II', page_size, page_count)))
+        for page_no in range(page_count):
+            page = new.read(page_size)
+            if base.read(page_size) != page:
+                out.write(compressor.compress(struct.pack('>I', page_no) + page))
+                changed += 1
+        out.write(compressor.flush())
+
+    return changed
+
+
+def apply_delta(delta_path: str, target_path: str):
+    """Наложение измененных страниц на копию полного снимка"""
+    with open(delta_path, 'rb') as f:
+        if f.read(len(DELTA_MAGIC)) != DELTA_MAGIC:
+            raise ValueError(f"{delta_path} is not a snapshot delta")
+        data = zlib.decompress(f.read())
+
+    page_size, page_count = struct.unpack_from('>II', data, 0)
+    offset = 8
+    with open(target_path, 'r+b') as target:
+        while offset < len(data):
+            (page_no,) = struct.unpack_from('>I', data, offset)
+            offset += 4
+            target.seek(page_no * page_size)
+            target.write(data[offset:offset + page_size])
+            offset += page_size
+        target.truncate(page_count * page_size)
+
+
+def namespace_backup_dir(namespace: str = None) -> str:
+    """Каталог снимков: у каждого бота общего процесса свой подкаталог BACKUP_DIR"""
+    return os.path.join(config.BACKUP_DIR, namespace) if namespace else config.BACKUP_DIR
+
+
+def take_snapshot(storage, backup_dir: str = None) -> Optional[Dict]:
+    """Снимок базы: полный или только измененные страницы относительно последнего полного.
+
+    Если база не менялась с прошлого снимка, снимок не создается.
+    """
+    backup_dir = backup_dir or namespace_backup_dir(storage.namespace)
+    os.makedirs(backup_dir, exist_ok=True)
+    snapshots = load_manifest(backup_dir)
+
+    change_counter = read_change_counter(storage.db_name)
+    if snapshots and snapshots[-1]['change_counter'] == change_counter:
+        logger.info("Database unchanged since last snapshot, skipping")
+        return None
+
+    fulls = [snapshot for snapshot in snapshots if snapshot['kind'] == 'full']
+    since_full = len(snapshots) - snapshots.index(fulls[-1]) if fulls else 0
+    incremental = bool(fulls) and since_full < config.BACKUP_FULL_EVERY
+
+    name = datetime.now().strftime('snapshot-%Y%m%d-%H%M%S-%f')
+    started = time.perf_counter()
+
+    if incremental:
+        base = fulls[-1]
+        with tempfile.TemporaryDirectory(dir=backup_dir) as tmp:
+            copy_path = os.path.join(tmp, 'copy.db')
+            stats = storage.backup(copy_path, pages=config.BACKUP_PAGES_PER_STEP)
+            sha256 = file_sha256(copy_path)
+            changed = write_delta(
+                os.path.join(backup_dir, base['file']), copy_path,
+                os.path.join(backup_dir, name + '.delta'), stats['page_size']
+            )
+        entry = {'name': name, 'kind': 'incremental', 'base': base['name'],
+                 'file': name + '.delta', 'changed_pages': changed}
+    else:
+        stats = storage.backup(os.path.join(backup_dir, name + '.db'), pages=config.BACKUP_PAGES_PER_STEP)
+        sha256 = file_sha256(os.path.join(backup_dir, name + '.db'))
+        entry = {'name': name, 'kind': 'full', 'file': name + '.db'}
+
+    entry.update({
+        'created_at': datetime.now().isoformat(),
+        'change_counter': change_counter,
+        'sha256': sha256,
+        'pages': stats['pages'],
+        'bytes': stats['bytes'],
+        'stored_bytes': os.path.getsize(os.path.join(backup_dir, entry['file'])),
+        'backup_seconds': stats['seconds'],
+        'mb_per_sec': stats['mb_per_sec'],
+        'seconds': time.perf_counter() - started
+    })
+
+    snapshots.append(entry)
+    save_manifest(backup_dir, prune_snapshots(backup_dir, snapshots))
+    return entry
+
+
+def prune_snapshots(backup_dir: str, snapshots: List[Dict]) -> List[Dict]:
+    """Удаление старых полных снимков вместе с их инкрементами"""
+    fulls = [snapshot['name'] for snapshot in snapshots if snapshot['kind'] == 'full']
+    keep = set(fulls[-config.BACKUP_KEEP_FULL:])
+    kept = []
+    for snapshot in snapshots:
+        if snapshot['name'] in keep or snapshot.get('base') in keep:
+            kept.append(snapshot)
+        else:
+            os.remove(os.path.join(backup_dir, snapshot['file']))
+    return kept
+
+
+def find_snapshot(snapshots: List[Dict], name: str = None) -> Dict:
+    """Поиск снимка по имени (по умолчанию - последний)"""
+    if not snapshots:
+        raise ValueError("No snapshots found")
+    if name is None:
+        return snapshots[-1]
+    for snapshot in snapshots:
+        if snapshot['name'] == name:
+            return snapshot
+    raise ValueError(f"Snapshot {name} not found")
+
+
+def materialize_snapshot(backup_dir: str, snapshot: Dict, target_path: str):
+    """Восстановление файла базы из снимка (для инкрементального - база + страницы)"""
+    if snapshot['kind'] == 'full':
+        shutil.copyfile(os.path.join(backup_dir, snapshot['file']), target_path)
+    else:
+        base = find_snapshot(load_manifest(backup_dir), snapshot['base'])
+        shutil.copyfile(os.path.join(backup_dir, base['file']), target_path)
+        apply_delta(os.path.join(backup_dir, snapshot['file']), target_path)
+
+
+def verify_snapshot(name: str = None, backup_dir: str = None) -> Dict:
+    """Проверка снимка: контрольная сумма и PRAGMA integrity_check"""
+    backup_dir = backup_dir or config.BACKUP_DIR
+    snapshot = find_snapshot(load_manifest(backup_dir), name)
+    started = time.perf_counter()
+
+    with tempfile.TemporaryDirectory(dir=backup_dir) as tmp:
+        path = os.path.join(tmp, 'verify.db')
+        materialize_snapshot(backup_dir, snapshot, path)
+        checksum_ok = file_sha256(path) == snapshot['sha256']
+
+        conn = sqlite3.connect(path)
+        try:
+            integrity = conn.execute('PRAGMA integrity_check').fetchone()[0]
+            days = conn.execute('SELECT COUNT(*) FROM days').fetchone()[0]
+        except sqlite3.DatabaseError as e:
+            integrity, days = str(e), 0
+        finally:
+            conn.close()
+
+    return {
+        'name': snapshot['name'],
+        'ok': checksum_ok and integrity == 'ok',
+        'checksum_ok': checksum_ok,
+        'integrity': integrity,
+        'days': days,
+        'seconds': time.perf_counter() - started
+    }
+
+
+def restore_snapshot(name: str, db_path: str = None, backup_dir: str = None) -> Dict:
+    """Восстановление базы из снимка через backup API (работает и при запущенном боте)"""
+    backup_dir = backup_dir or config.BACKUP_DIR
+    db_path = db_path or config.DATABASE_NAME
+    snapshot = find_snapshot(load_manifest(backup_dir), name)
+    started = time.perf_counter()
+
+    with tempfile.TemporaryDirectory(dir=backup_dir) as tmp:
+        path = os.path.join(tmp, 'restore.db')
+        materialize_snapshot(backup_dir, snapshot, path)
+        if file_sha256(path) != snapshot['sha256']:
+            raise ValueError(f"Snapshot {snapshot['name']} failed checksum verification")
+
+        source = sqlite3.connect(path)
+        target = sqlite3.connect(db_path)
+        try:
+            source.backup(target, pages=config.BACKUP_PAGES_PER_STEP)
+        finally:
+            target.close()
+            source.close()
+
+    return {'name': snapshot['name'], 'seconds': time.perf_counter() - started}
+
+
+def format_snapshot(entry: Dict) -> str:
+    """Краткое описание снимка для сообщений и консоли"""
+    kind = "полный" if entry['kind'] == 'full' else f"инкрементальный ({entry['changed_pages']} стр.)"
+    return (
+        f"{entry['name']}: {kind}, {entry['bytes'] / 1024:.0f} КБ "
+        f"(на диске {entry['stored_bytes'] / 1024:.0f} КБ), "
+        f"{entry['seconds']:.2f} с, {entry['mb_per_sec']:.1f} МБ/с"
+    )
+
+
+async def backup_job(context):
+    """Периодический снимок базы из job queue"""
+    try:
+        entry = await asyncio.to_thread(take_snapshot, context.job.data)
+        if entry:
+            logger.info(f"Snapshot created: {format_snapshot(entry)}")
+    except Exception as e:
+        logger.error(f"Error creating snapshot: {e}")
+
+
+def schedule_backup_job(application, storage):
+    """Регистрация периодических снимков в job queue"""
+    if not config.BACKUP_INTERVAL_HOURS or config.DATABASE_BACKEND != "sqlite":
+        return
+    if application.job_queue is None:
+        logger.warning("Job queue is not available, scheduled backups are disabled")
+        return
+
+    interval = config.BACKUP_INTERVAL_HOURS * 3600
+    application.job_queue.run_repeating(backup_job, interval=interval, first=interval, data=storage, name="backup")
+
+
+def main():
+    """Консольные команды: snapshot | list | verify [имя] | restore <имя>"""
+    command = sys.argv[1] if len(sys.argv) > 1 else 'list'
+    name = sys.argv[2] if len(sys.argv) > 2 else None
+
+    if command == 'snapshot':
+        from database import Database
+        entry = take_snapshot(Database(config.DATABASE_NAME))
+        print(format_snapshot(entry) if entry else "База не менялась, снимок не нужен")
+    elif command == 'list':
+        for entry in load_manifest(config.BACKUP_DIR):
+            print(format_snapshot(entry))
+    elif command == 'verify':
+        result = verify_snapshot(name)
+        print(f"{result['name']}: {'OK' if result['ok'] else 'ОШИБКА'} "
+              f"(integrity: {result['integrity']}, дней: {result['days']}, {result['seconds']:.2f} с)")
+    elif command == 'restore' and name:
+        result = restore_snapshot(name)
+        print(f"База восстановлена из {result['name']} за {result['seconds']:.2f} с")
+    else:
+        print("Использование: python backup.py snapshot | list | verify [имя] | restore <имя>")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,9 +1,23 @@
+import asyncio
 import logging
 from datetime import datetime, date, timedelta
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
-from telegram.ext import Application, CommandHandler, CallbackQueryHandler, MessageHandler, filters, ContextTypes
-from database import Database
-import config
+from startup import startup_report
+
+# Импорты замеряются для отчета о времени запуска
+with startup_report.measure("импорт telegram"):
+    from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, ReplyKeyboardMarkup, ReplyKeyboardRemove
+with startup_report.measure("импорт telegram.ext"):
+    from telegram.ext import Application, CommandHandler, CallbackQueryHandler, MessageHandler, TypeHandler, filters, ContextTypes, PicklePersistence, PersistenceInput
+with startup_report.measure("импорт модулей бота"):
+    from charts import ChartService, CHART_RANGES
+    from reports import ReportQueue
+    from activity import schedule_activity_flush
+    from outbound import PriorityRequest
+    from coalesce import CallbackCoalescer
+    from ratelimit import RateLimiter
+    from profiler import SamplingProfiler
+    from instances import BotInstance, CurrentInstance, load_instances, run_instances
+    import config
 
 # Настройка логирования с уменьшением спама
 logging.basicConfig(
@@ -16,8 +30,45 @@ logging.getLogger('httpcore').setLevel(logging.WARNING)
 
 logger = logging.getLogger(__name__)
 
-# Инициализация базы данных
-db = Database(config.DATABASE_NAME)
+# Бот с BOT_TOKEN; в режиме BOT_INSTANCES у каждого бота процесса свой экземпляр
+default_instance = BotInstance(None, config.BOT_TOKEN)
+
+# База данных бота, чье обновление обрабатывается; открывается при первом обращении, а не при импорте
+db = CurrentInstance('storage', default_instance)
+
+# Графики рисуются в пуле процессов, пул создается при первом запросе
+charts = ChartService()
+
+# PDF-отчеты собираются в отдельных процессах через ограниченную очередь
+reports = ReportQueue()
+
+# Исходящие запросы: общий пул соединений, ответы пользователям раньше отчетов и рассылок
+outbound = PriorityRequest()
+
+# Плавная остановка: дренаж обновлений, handoff следующему процессу, отсев повторов
+lifecycle = CurrentInstance('lifecycle', default_instance)
+
+# Слишком частые обновления одного пользователя не доходят до обработчиков и базы
+rate_limiter = RateLimiter()
+
+# Повторные нажатия кнопок отбрасываются до основных обработчиков
+coalescer = CallbackCoalescer()
+
+# Профиль работающего процесса по /profile или SIGUSR1
+profiler = SamplingProfiler()
+
+# Последняя активность пишется в базу пачками, а не на каждое обновление
+activity = CurrentInstance('activity', default_instance)
+
+# Утренние сводки: собираются ночью пакетно, утром только рассылаются
+digests = CurrentInstance('digests', default_instance)
+
+# Запущенные Application: общие пулы запускаются с первым и закрываются с последним
+running_applications = 0
+
+# Кнопки постоянной клавиатуры быстрого режима
+FAST_SLEEP_TEXT = "💤 Уснул"
+FAST_WAKE_TEXT = "🌅 Проснулся"
 
 # Русские названия месяцев
 MONTH_NAMES = {
@@ -44,6 +95,10 @@ def get_day_name(target_date: date) -> str:
     else:
         return format_date_russian(target_date)
 
+def is_admin(user_id: int) -> bool:
+    """Проверка прав администратора"""
+    return user_id in config.ADMIN_IDS
+
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик команды /start"""
     try:
@@ -65,6 +120,8 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
 • Не спал - отметить день, как без сна
 • История - просмотр всех записей
 • Последние дни - быстрый доступ к недавним записям
+• /digest - утренняя сводка о сне (включить/выключить)
+• /fast - быстрый режим: Уснул и Проснулся одной кнопкой, без подтверждения
 
 Начните с записи времени засыпания или пробуждения!
         """
@@ -78,6 +135,276 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
         logger.error(f"Error in start command: {e}")
         await update.message.reply_text("❌ Произошла ошибка при запуске бота")
 
+async def backup_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработчик команды /backup (только для администраторов)"""
+    if not is_admin(update.effective_user.id):
+        return
+    
+    from backup import take_snapshot, format_snapshot
+    try:
+        entry = await asyncio.to_thread(take_snapshot, db)
+        if entry:
+            await update.message.reply_text(f"💾 Снимок создан:\n{format_snapshot(entry)}")
+        else:
+            await update.message.reply_text("💾 База не менялась с прошлого снимка")
+    except Exception as e:
+        logger.error(f"Error in backup command: {e}")
+        await update.message.reply_text("❌ Ошибка при создании снимка")
+
+async def verify_backup_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработчик команды /verify_backup [имя] (только для администраторов)"""
+    if not is_admin(update.effective_user.id):
+        return
+    
+    from backup import verify_snapshot, namespace_backup_dir
+    try:
+        name = context.args[0] if context.args else None
+        result = await asyncio.to_thread(verify_snapshot, name, namespace_backup_dir(db.namespace))
+        status = "✅ Снимок в порядке" if result['ok'] else "❌ Снимок поврежден"
+        await update.message.reply_text(
+            f"{status}: {result['name']}\n"
+            f"integrity_check: {result['integrity']}, дней: {result['days']}, проверка {result['seconds']:.2f} с"
+        )
+    except Exception as e:
+        logger.error(f"Error in verify_backup command: {e}")
+        await update.message.reply_text(f"❌ Ошибка при проверке снимка: {e}")
+
+async def profile_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработчик команды /profile [секунды] (только для администраторов)"""
+    if not is_admin(update.effective_user.id):
+        return
+    
+    try:
+        seconds = float(context.args[0]) if context.args else config.PROFILE_SECONDS
+    except ValueError:
+        await update.message.reply_text("Использование: /profile [секунды]")
+        return
+    seconds = min(max(seconds, 1), config.PROFILE_MAX_SECONDS)
+    if profiler.running:
+        await update.message.reply_text("⏱ Профиль уже снимается")
+        return
+    
+    await update.message.reply_text(f"⏱ Профилирование процесса {seconds:.0f} с...")
+    # Обновления обрабатываются по очереди: профиль снимается в фоне, а не в обработчике
+    context.application.create_task(send_profile(update.message, seconds))
+
+async def send_profile(message, seconds: float):
+    """Сводка профиля сообщением и свернутые стеки файлом"""
+    try:
+        result = await profiler.profile(seconds)
+        if result is None:
+            await message.reply_text("⏱ Профиль уже снимается")
+            return
+        await message.reply_text(result['summary'][:4000])
+        with open(result['collapsed'], 'rb') as file:
+            await message.reply_document(file, caption="Свернутые стеки для flamegraph.pl или speedscope")
+    except Exception as e:
+        logger.error(f"Error in profile command: {e}")
+        await message.reply_text("❌ Ошибка при профилировании")
+
+def format_outbound_stats(stats):
+    """Очереди и задержки исходящих запросов для /stats"""
+    lines = ["📤 Исходящие запросы:"]
+    for lane, lane_stats in stats.items():
+        lines.append(
+            f"{lane}: очередь {lane_stats['queued']}, в работе {lane_stats['in_flight']}, "
+            f"отправлено {lane_stats['sent']} (ошибок {lane_stats['failed']}), "
+            f"ожидание {lane_stats['avg_wait_ms']:.0f} мс, отправка {lane_stats['avg_send_ms']:.0f} мс "
+            f"(макс. {lane_stats['max_send_ms']:.0f} мс)"
+        )
+    return "\n".join(lines)
+
+async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработчик команды /stats (только для администраторов)"""
+    if not is_admin(update.effective_user.id):
+        return
+    
+    try:
+        await activity.flush()
+        counts = await asyncio.to_thread(db.get_activity_counts)
+        activity_stats = activity.stats()
+        coalescer_stats = coalescer.stats()
+        limiter_stats = rate_limiter.stats()
+        lifecycle_stats = lifecycle.stats()
+        digest_stats = digests.stats()
+        report_stats = reports.stats()
+        await update.message.reply_text(
+            f"👥 Активные пользователи:\n"
+            f"За сутки (DAU): {counts['dau']}\n"
+            f"За неделю (WAU): {counts['wau']}\n"
+            f"За 30 дней (MAU): {counts['mau']}\n\n"
+            f"Записей активности: {activity_stats['flushes']} "
+            f"({activity_stats['flushed_users']} польз., {activity_stats['touches']} отметок)\n"
+            f"Повторных нажатий отброшено: {coalescer_stats['coalesced']} из {coalescer_stats['callbacks']}\n"
+            f"Ограничено по частоте: {limiter_stats['limited']} из "
+            f"{limiter_stats['allowed'] + limiter_stats['limited']} (корзин: {limiter_stats['tracked']})\n"
+            f"Повторных обновлений пропущено: {lifecycle_stats['duplicates']}, "
+            f"принято от прошлого процесса: {lifecycle_stats['restored']}\n"
+            f"Утренних сводок собрано: {digest_stats['built']}, отправлено: {digest_stats['sent']} "
+            f"(ошибок {digest_stats['failed']}, отписано {digest_stats['unsubscribed']})\n"
+            f"PDF-отчетов: {report_stats['completed']} из {report_stats['submitted']} "
+            f"(ошибок {report_stats['failed']}, отклонено {report_stats['rejected_full']}, "
+            f"повторов {report_stats['deduplicated']}), в очереди {report_stats['queued']}, "
+            f"собираются {report_stats['in_flight']}; ожидание {report_stats['avg_wait_seconds']:.1f} с, "
+            f"сборка {report_stats['avg_build_seconds']:.1f} с, отправка {report_stats['avg_send_seconds']:.1f} с\n\n"
+            + format_outbound_stats(outbound.stats())
+        )
+    except Exception as e:
+        logger.error(f"Error in stats command: {e}")
+        await update.message.reply_text("❌ Ошибка при получении статистики")
+
+async def digest_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработчик команды /digest: включение и выключение утренней сводки"""
+    try:
+        user_id = update.effective_user.id
+        if config.DIGEST_SEND_TIME is None:
+            await update.message.reply_text("☀️ Утренние сводки отключены")
+            return
+        
+        enabled = not await asyncio.to_thread(db.is_digest_subscribed, user_id)
+        if not await asyncio.to_thread(db.set_digest_subscription, user_id, enabled):
+            await update.message.reply_text("❌ Ошибка при изменении подписки")
+            return
+        
+        if enabled:
+            await update.message.reply_text(
+                f"☀️ Утренняя сводка включена: каждый день в {config.DIGEST_SEND_TIME.strftime('%H:%M')} - "
+                f"сон за прошлые сутки, среднее за неделю и недавние симптомы.\n"
+                f"Отключить: /digest"
+            )
+        else:
+            await update.message.reply_text("☀️ Утренняя сводка выключена. Включить снова: /digest")
+    except Exception as e:
+        logger.error(f"Error in digest command: {e}")
+        await update.message.reply_text("❌ Ошибка при изменении подписки")
+
+def fast_keyboard():
+    """Постоянная клавиатура быстрого режима"""
+    return ReplyKeyboardMarkup([[FAST_SLEEP_TEXT, FAST_WAKE_TEXT]], resize_keyboard=True, is_persistent=True)
+
+async def fast_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработчик команды /fast: включение и выключение быстрого режима"""
+    try:
+        enabled = not context.user_data.get('fast_mode', False)
+        context.user_data['fast_mode'] = enabled
+        
+        if enabled:
+            await update.message.reply_text(
+                f"⚡ Быстрый режим включен: кнопки «{FAST_SLEEP_TEXT}» и «{FAST_WAKE_TEXT}» внизу "
+                f"сразу записывают текущее время, ошибочную запись можно отменить.\n"
+                f"Отключить: /fast",
+                reply_markup=fast_keyboard()
+            )
+        else:
+            context.user_data.pop('fast_undo', None)
+            await update.message.reply_text(
+                "⚡ Быстрый режим выключен. Включить снова: /fast",
+                reply_markup=ReplyKeyboardRemove()
+            )
+    except Exception as e:
+        logger.error(f"Error in fast command: {e}")
+        await update.message.reply_text("❌ Ошибка при переключении быстрого режима")
+
+async def handle_fast_log(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Быстрый режим: текущее время записывается сразу, вместо подтверждения - кнопка отмены"""
+    try:
+        user_id = update.effective_user.id
+        activity.touch(user_id)
+        kind = 'sleep' if update.message.text == FAST_SLEEP_TEXT else 'wake'
+        
+        # Нажатая кнопка заменяет начатый ввод времени, симптома или даты
+        for key in ('awaiting_symptom', 'awaiting_sleep_time', 'awaiting_wake_time', 'editing_date', 'action',
+                    'existing_data', 'target_date', 'pending_time', 'sleep_time', 'adding_sleep_for'):
+            context.user_data.pop(key, None)
+        
+        now = datetime.now()
+        result = await asyncio.to_thread(db.log_sleep_event, user_id, kind, now, now.date())
+        if result is None:
+            await update.message.reply_text("❌ Ошибка при записи, попробуйте еще раз")
+            return
+        previous, state = result
+        
+        if kind == 'sleep':
+            message_text = f"💤 Уснул в {now.strftime('%H:%M')}"
+            replaced = previous[0] if previous else None
+        else:
+            message_text = f"🌅 Проснулся в {now.strftime('%H:%M')}"
+            replaced = previous[1] if previous else None
+            if state[0] and state[2]:
+                message_text += f"\n⏱️ Сон: {state[2] // 60}ч {state[2] % 60}м"
+        if replaced:
+            message_text += f"\n(заменено прежнее время {datetime.fromisoformat(replaced).strftime('%H:%M')})"
+        
+        # Отменить можно только последнюю запись: ее номер - в callback_data
+        undo_id = context.user_data.get('fast_undo', {}).get('id', 0) + 1
+        context.user_data['fast_undo'] = {'id': undo_id, 'date': now.date(), 'written': state, 'previous': previous}
+        
+        await update.message.reply_text(
+            message_text,
+            reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("↩️ Отменить", callback_data=f"fast_undo_{undo_id}")]])
+        )
+    except Exception as e:
+        logger.error(f"Error in fast log: {e}")
+        await update.message.reply_text("❌ Ошибка при записи, попробуйте еще раз")
+
+async def handle_fast_undo(query, user_id, context, data):
+    """Отмена последней записи быстрого режима"""
+    undo = context.user_data.get('fast_undo')
+    if not undo or data != f"fast_undo_{undo['id']}":
+        await query.edit_message_text(f"{query.message.text}\n\n↩️ Отменить можно только последнюю запись")
+        return
+    
+    success = await asyncio.to_thread(db.undo_sleep_event, user_id, undo['date'], undo['written'], undo['previous'])
+    context.user_data.pop('fast_undo', None)
+    
+    if success:
+        await query.edit_message_text(f"↩️ Отменено: {query.message.text.splitlines()[0]}")
+    else:
+        await query.edit_message_text(f"{query.message.text}\n\n↩️ День уже изменен, отменить нельзя")
+
+async def search_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработчик команды /search <текст>"""
+    try:
+        user_id = update.effective_user.id
+        search_text = " ".join(context.args).strip()
+        if not search_text:
+            await update.message.reply_text("🔍 Использование: /search головная боль")
+            return
+        
+        # Текст запроса не помещается в callback_data, поэтому хранится в user_data
+        context.user_data['search_text'] = search_text
+        text, markup = await build_search_results(user_id, search_text, 0)
+        await update.message.reply_text(text, reply_markup=markup)
+    except Exception as e:
+        logger.error(f"Error in search command: {e}")
+        await update.message.reply_text("❌ Ошибка при поиске")
+
+async def chart_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработчик команды /chart"""
+    await update.message.reply_text(
+        "📈 Выберите период для графика:",
+        reply_markup=chart_ranges_keyboard()
+    )
+
+async def report_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработчик команды /report"""
+    try:
+        user_id = update.effective_user.id
+        status_message = await update.message.reply_text("📄 Отчет поставлен в очередь...")
+        result = reports.submit(user_id, update.effective_chat.id, status_message, context.bot, db.namespace)
+        
+        if result == 'duplicate':
+            await status_message.edit_text("📄 Отчет уже готовится, дождитесь его отправки")
+        elif result == 'full':
+            await status_message.edit_text("⏳ Сейчас готовится слишком много отчетов, попробуйте позже")
+        else:
+            position = reports.queue_position()
+            if position > 1:
+                await status_message.edit_text(f"📄 Отчет поставлен в очередь (позиция {position})")
+    except Exception as e:
+        logger.error(f"Error in report command: {e}")
+        await update.message.reply_text("❌ Ошибка при создании отчета")
+
 async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик нажатий на инлайн кнопки"""
     try:
@@ -86,6 +413,7 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         
         user_id = query.from_user.id
         data = query.data
+        activity.touch(user_id)
         
         if data == "sleep":
             await handle_sleep_time_request(query, context)
@@ -113,6 +441,18 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await handle_no_sleep_request(query, context)
         elif data == "history":
             await show_history(query, user_id)
+        elif data == "chart":
+            await query.edit_message_text("📈 Выберите период для графика:", reply_markup=chart_ranges_keyboard())
+        elif data.startswith("chart_"):
+            await handle_chart(query, user_id, data)
+        elif data.startswith("pick_symptom_"):
+            await handle_symptom_pick(query, user_id, context, data)
+        elif data.startswith("search_"):
+            await show_search_page(query, user_id, context, data)
+        elif data.startswith("archived_day_"):
+            await handle_archived_day(query, user_id, data)
+        elif data.startswith("archive_"):
+            await show_archive(query, user_id, data)
         elif data.startswith("recent_"):
             await handle_recent_day(query, user_id, data)
         elif data.startswith("day_"):
@@ -125,6 +465,8 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await handle_add_sleep_request(query, context, data)
         elif data.startswith("edit_date_"):
             await handle_edit_date_request(query, context, data)
+        elif data.startswith("fast_undo_"):
+            await handle_fast_undo(query, user_id, context, data)
         elif data == "back_to_main":
             await show_main_menu(query, user_id)
         elif data == "back_to_history":
@@ -429,10 +771,36 @@ async def handle_cancel(query, user_id, action_name):
 async def handle_symptom_request(query, context):
     """Запрос симптома"""
     context.user_data['awaiting_symptom'] = True
-    await query.edit_message_text(
-        "Опишите симптом или самочувствие:",
-        reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("↩️ Назад", callback_data="back_to_main")]])
-    )
+    
+    # Частые симптомы пользователя - из счетчиков каталога, без просмотра истории
+    top_symptoms = await asyncio.to_thread(db.get_top_symptoms, query.from_user.id, config.SYMPTOM_QUICK_PICKS)
+    keyboard = [
+        [InlineKeyboardButton(text[:40], callback_data=f"pick_symptom_{catalog_id}")]
+        for catalog_id, text in top_symptoms
+    ]
+    keyboard.append([InlineKeyboardButton("↩️ Назад", callback_data="back_to_main")])
+    
+    text = "Опишите симптом или самочувствие:"
+    if top_symptoms:
+        text = "Выберите частый симптом или опишите новый:"
+    await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard))
+
+async def handle_symptom_pick(query, user_id, context, data):
+    """Запись симптома из списка частых одним нажатием"""
+    catalog_id = int(data[13:])  # format: pick_symptom_42
+    context.user_data['awaiting_symptom'] = False
+    
+    symptom_text = await asyncio.to_thread(db.get_catalog_symptom, catalog_id)
+    if symptom_text and await asyncio.to_thread(db.add_symptom, user_id, symptom_text):
+        await query.edit_message_text(
+            f"✅ Симптом записан: {symptom_text}",
+            reply_markup=main_menu_keyboard(user_id)
+        )
+    else:
+        await query.edit_message_text(
+            "❌ Ошибка при записи симптома",
+            reply_markup=main_menu_keyboard(user_id)
+        )
 
 async def handle_recent_day(query, user_id, data):
     """Обработка просмотра recent дня"""
@@ -534,6 +902,7 @@ async def show_history(query, user_id):
             [InlineKeyboardButton("🌅 Добавить пробуждение за сегодня", callback_data="wake")],
             [InlineKeyboardButton("🚫 Отметить 'не спал' за сегодня", callback_data="no_sleep")],
             [InlineKeyboardButton("✏️ Добавить запись за другую дату", callback_data="edit_date_")],
+            [InlineKeyboardButton("📦 Архив", callback_data="archive_0")],
             [InlineKeyboardButton("↩️ Главное меню", callback_data="back_to_main")]
         ])
         
@@ -558,6 +927,7 @@ async def show_history(query, user_id):
         [InlineKeyboardButton("💤 Добавить сон за сегодня", callback_data="sleep")],
         [InlineKeyboardButton("🌅 Добавить пробуждение за сегодня", callback_data="wake")],
         [InlineKeyboardButton("✏️ Добавить запись за другую дату", callback_data="edit_date_")],
+        [InlineKeyboardButton("📦 Архив", callback_data="archive_0")],
         [InlineKeyboardButton("↩️ Главное меню", callback_data="back_to_main")]
     ])
     
@@ -566,58 +936,158 @@ async def show_history(query, user_id):
         reply_markup=InlineKeyboardMarkup(keyboard)
     )
 
-async def show_day_summary(query, user_id, target_date, summary):
+ARCHIVE_PAGE_SIZE = 30
+
+async def show_archive(query, user_id, data):
+    """Показать архивные дни (загружаются только по запросу)"""
+    offset = int(data[8:])  # format: archive_30
+    days = db.get_archived_days(user_id, limit=ARCHIVE_PAGE_SIZE + 1, offset=offset)
+    
+    keyboard = []
+    for day_date, has_data in days[:ARCHIVE_PAGE_SIZE]:
+        if has_data:
+            button_text = f"{format_date_russian(day_date)} {day_date.year}"
+        else:
+            button_text = f"{format_date_russian(day_date)} {day_date.year} - Нет данных"
+        keyboard.append([InlineKeyboardButton(button_text, callback_data=f"archived_day_{day_date.strftime('%Y-%m-%d')}")])
+    
+    navigation = []
+    if offset > 0:
+        navigation.append(InlineKeyboardButton("⬅️ Новее", callback_data=f"archive_{max(offset - ARCHIVE_PAGE_SIZE, 0)}"))
+    if len(days) > ARCHIVE_PAGE_SIZE:
+        navigation.append(InlineKeyboardButton("Старее ➡️", callback_data=f"archive_{offset + ARCHIVE_PAGE_SIZE}"))
+    if navigation:
+        keyboard.append(navigation)
+    
+    keyboard.extend([
+        [InlineKeyboardButton("📊 История", callback_data="back_to_history")],
+        [InlineKeyboardButton("↩️ Главное меню", callback_data="back_to_main")]
+    ])
+    
+    text = "📦 Архив записей:\n\nВыберите день для просмотра деталей:" if days else "📦 Архив пуст"
+    await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard))
+
+SEARCH_PAGE_SIZE = 10
+
+async def build_search_results(user_id, search_text, offset):
+    """Текст и клавиатура страницы результатов поиска по симптомам"""
+    days = await asyncio.to_thread(db.search_symptoms, user_id, search_text, SEARCH_PAGE_SIZE + 1, offset)
+    
+    if not days:
+        text = f"🔍 По запросу «{search_text}» ничего не найдено"
+        return text, InlineKeyboardMarkup([[InlineKeyboardButton("↩️ Главное меню", callback_data="back_to_main")]])
+    
+    text = f"🔍 Результаты по запросу «{search_text}»:\n"
+    keyboard = []
+    for day_date, symptoms in days[:SEARCH_PAGE_SIZE]:
+        text += f"\n📅 {format_date_russian(day_date)} {day_date.year}:\n"
+        text += "\n".join(f"  • {symptom[:100]}" for symptom in symptoms) + "\n"
+        keyboard.append([InlineKeyboardButton(
+            f"{format_date_russian(day_date)} {day_date.year}",
+            callback_data=f"day_{day_date.strftime('%Y-%m-%d')}"
+        )])
+    
+    navigation = []
+    if offset > 0:
+        navigation.append(InlineKeyboardButton("⬅️ Назад", callback_data=f"search_{max(offset - SEARCH_PAGE_SIZE, 0)}"))
+    if len(days) > SEARCH_PAGE_SIZE:
+        navigation.append(InlineKeyboardButton("Дальше ➡️", callback_data=f"search_{offset + SEARCH_PAGE_SIZE}"))
+    if navigation:
+        keyboard.append(navigation)
+    keyboard.append([InlineKeyboardButton("↩️ Главное меню", callback_data="back_to_main")])
+    
+    return text, InlineKeyboardMarkup(keyboard)
+
+async def show_search_page(query, user_id, context, data):
+    """Другая страница результатов поиска"""
+    offset = int(data[7:])  # format: search_10
+    search_text = context.user_data.get('search_text')
+    if not search_text:
+        await query.edit_message_text(
+            "🔍 Поиск устарел, повторите /search <текст>",
+            reply_markup=main_menu_keyboard(user_id)
+        )
+        return
+    
+    text, markup = await build_search_results(user_id, search_text, offset)
+    await query.edit_message_text(text, reply_markup=markup)
+
+async def handle_archived_day(query, user_id, data):
+    """Обработка просмотра архивного дня"""
+    day_str = data[13:]  # format: archived_day_YYYY-MM-DD
+    try:
+        target_date = datetime.strptime(day_str, '%Y-%m-%d').date()
+        summary = db.get_archived_day_summary(user_id, target_date)
+        
+        if summary is None:
+            await query.edit_message_text(
+                "❌ Нет данных за этот день",
+                reply_markup=main_menu_keyboard(user_id)
+            )
+            return
+        
+        await show_day_summary(query, user_id, target_date, summary, archived=True)
+    except ValueError:
+        await query.edit_message_text(
+            "❌ Ошибка формата даты",
+            reply_markup=main_menu_keyboard(user_id)
+        )
+
+async def show_day_summary(query, user_id, target_date, summary, archived=False):
     """Отобразить сводку дня"""
     date_str = format_date_russian(target_date)
     
     text = f"🌙 **Сводка за {date_str}**\n\n"
     
     # Информация о сне
-    if summary['no_sleep']:
+    if summary.no_sleep:
         text += "🚫 **Не спал**\n"
         text += "⏱️ **Время сна:** 0ч 0м\n"
     else:
-        if summary['sleep_time']:
-            sleep_time = datetime.fromisoformat(summary['sleep_time'])
-            text += f"💤 **Засыпание:** {sleep_time.strftime('%H:%M')}\n"
+        if summary.sleep_time:
+            text += f"💤 **Засыпание:** {summary.sleep_time.strftime('%H:%M')}\n"
         else:
             text += f"💤 **Засыпание:** Нет данных\n"
         
-        if summary['wake_time']:
-            wake_time = datetime.fromisoformat(summary['wake_time'])
-            text += f"🌅 **Пробуждение:** {wake_time.strftime('%H:%M')}\n"
+        if summary.wake_time:
+            text += f"🌅 **Пробуждение:** {summary.wake_time.strftime('%H:%M')}\n"
         else:
             text += f"🌅 **Пробуждение:** Нет данных\n"
         
         # Показываем общее время сна (основной + дополнительные сны)
-        if summary['total_sleep_all_minutes'] > 0:
-            total_hours = summary['total_sleep_all_minutes'] // 60
-            total_minutes = summary['total_sleep_all_minutes'] % 60
+        if summary.total_sleep_all_minutes > 0:
+            total_hours = summary.total_sleep_all_minutes // 60
+            total_minutes = summary.total_sleep_all_minutes % 60
             text += f"⏱️ **Общее время сна:** {total_hours}ч {total_minutes}м\n"
             
             # Если есть основной сон, показываем его отдельно
-            if summary['total_sleep_minutes']:
-                main_hours = summary['total_sleep_minutes'] // 60
-                main_minutes = summary['total_sleep_minutes'] % 60
+            if summary.total_sleep_minutes:
+                main_hours = summary.total_sleep_minutes // 60
+                main_minutes = summary.total_sleep_minutes % 60
                 text += f"🌙 **Основной сон:** {main_hours}ч {main_minutes}м\n"
-        elif summary['total_sleep_minutes']:
-            hours = summary['total_sleep_minutes'] // 60
-            minutes = summary['total_sleep_minutes'] % 60
+            
+            # Пересекающиеся сны входят в общее время один раз
+            overlap_minutes = summary.sleep_intervals().overlap_minutes
+            if overlap_minutes:
+                text += f"↔️ **Пересечения снов:** {overlap_minutes // 60}ч {overlap_minutes % 60}м (учтены один раз)\n"
+        elif summary.total_sleep_minutes:
+            hours = summary.total_sleep_minutes // 60
+            minutes = summary.total_sleep_minutes % 60
             text += f"⏱️ **Время сна:** {hours}ч {minutes}м\n"
         else:
             text += f"⏱️ **Время сна:** Нет данных\n"
     
     # Дополнительные сны
-    if summary['additional_sleeps']:
+    if summary.additional_sleeps:
         text += f"\n😴 **Дополнительные сны:**\n"
         total_additional = 0
-        for i, sleep in enumerate(summary['additional_sleeps'], 1):
-            sleep_time = datetime.fromisoformat(sleep['sleep_time']).strftime('%H:%M')
-            wake_time = datetime.fromisoformat(sleep['wake_time']).strftime('%H:%M')
-            hours = sleep['sleep_minutes'] // 60
-            minutes = sleep['sleep_minutes'] % 60
+        for i, sleep in enumerate(summary.additional_sleeps, 1):
+            sleep_time = sleep.sleep_time.strftime('%H:%M')
+            wake_time = sleep.wake_time.strftime('%H:%M')
+            hours = sleep.sleep_minutes // 60
+            minutes = sleep.sleep_minutes % 60
             text += f"{i}. {sleep_time} - {wake_time} ({hours}ч {minutes}м)\n"
-            total_additional += sleep['sleep_minutes']
+            total_additional += sleep.sleep_minutes
         
         if total_additional > 0:
             total_hours = total_additional // 60
@@ -625,19 +1095,26 @@ async def show_day_summary(query, user_id, target_date, summary):
             text += f"**Всего доп. сон:** {total_hours}ч {total_minutes}м\n"
     
     # Информация о симптомах
-    if summary['symptoms']:
+    if summary.symptoms:
         text += f"\n🤒 **Симптомы:**\n"
-        for i, symptom in enumerate(summary['symptoms'], 1):
-            text += f"{i}. {symptom['text']}\n"
+        for i, symptom in enumerate(summary.symptoms, 1):
+            text += f"{i}. {symptom.text}\n"
     else:
         text += f"\n🤒 **Симптомы:** Нет записей\n"
     
-    keyboard = [
-        [InlineKeyboardButton("😴 Добавить сон", callback_data=f"add_sleep_{target_date}")],
-        [InlineKeyboardButton("🗑️ Удалить день", callback_data=f"delete_day_{target_date}")],
-        [InlineKeyboardButton("📊 История", callback_data="back_to_history")],
-        [InlineKeyboardButton("↩️ Главное меню", callback_data="back_to_main")]
-    ]
+    if archived:
+        # Архивные дни доступны только для просмотра
+        keyboard = [
+            [InlineKeyboardButton("📦 Архив", callback_data="archive_0")],
+            [InlineKeyboardButton("↩️ Главное меню", callback_data="back_to_main")]
+        ]
+    else:
+        keyboard = [
+            [InlineKeyboardButton("😴 Добавить сон", callback_data=f"add_sleep_{target_date}")],
+            [InlineKeyboardButton("🗑️ Удалить день", callback_data=f"delete_day_{target_date}")],
+            [InlineKeyboardButton("📊 История", callback_data="back_to_history")],
+            [InlineKeyboardButton("↩️ Главное меню", callback_data="back_to_main")]
+        ]
     
     await query.edit_message_text(
         text,
@@ -645,6 +1122,37 @@ async def show_day_summary(query, user_id, target_date, summary):
         parse_mode='Markdown'
     )
 
+def chart_ranges_keyboard():
+    """Клавиатура выбора периода графика"""
+    return InlineKeyboardMarkup([
+        [InlineKeyboardButton(label, callback_data=f"chart_{days}") for days, label in CHART_RANGES.items()],
+        [InlineKeyboardButton("↩️ Главное меню", callback_data="back_to_main")]
+    ])
+
+async def handle_chart(query, user_id, data):
+    """Отправка графика сна за выбранный период"""
+    days = int(data[6:])  # format: chart_30
+    if days not in CHART_RANGES:
+        return
+    
+    chart = await charts.get_chart(db, user_id, days)
+    if chart is None:
+        await query.edit_message_text(
+            f"📈 Нет данных о сне за {CHART_RANGES[days]}",
+            reply_markup=chart_ranges_keyboard()
+        )
+        return
+    
+    key, file_id, path = chart
+    caption = f"📈 Сон за {CHART_RANGES[days]}"
+    if file_id:
+        await query.message.reply_photo(photo=file_id, caption=caption)
+    else:
+        with open(path, 'rb') as f:
+            message = await query.message.reply_photo(photo=f, caption=caption)
+        # Повторно тот же график отправляется по file_id без загрузки
+        charts.remember_file_id(key, message.photo[-1].file_id)
+
 async def show_main_menu(query, user_id):
     """Показать главное меню"""
     await query.edit_message_text(
@@ -670,7 +1178,10 @@ def main_menu_keyboard(user_id):
             recent_buttons.append(InlineKeyboardButton(day_names[i], callback_data=f"recent_{i}"))
     
     keyboard = [
-        [InlineKeyboardButton("📊 История", callback_data="history")],
+        [
+            InlineKeyboardButton("📊 История", callback_data="history"),
+            InlineKeyboardButton("📈 Графики", callback_data="chart")
+        ],
         recent_buttons,
         [
             InlineKeyboardButton("💤 Уснул", callback_data="sleep"),
@@ -688,6 +1199,7 @@ def get_main_menu_text():
 
 Выберите действие:
 • 📊 История - просмотр всех записей
+• 📈 Графики - сон и время засыпания за 7, 30 или 365 дней
 • Последние дни - быстрый доступ к недавним записям  
 • 💤 Уснул - записать время засыпания
 • 🌅 Проснулся - записать время пробуждения
@@ -700,6 +1212,7 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     try:
         user_id = update.effective_user.id
         message_text = update.message.text.strip()
+        activity.touch(user_id)
         
         if context.user_data.get('awaiting_symptom'):
             # Обработка симптома
@@ -810,7 +1323,7 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 target_date = datetime.strptime(date_str, '%d.%m.%Y').date()
                 summary = db.get_day_summary(user_id, target_date)
                 
-                if any([summary['sleep_time'], summary['wake_time'], summary['no_sleep'], summary['symptoms'], summary['additional_sleeps']]):
+                if summary.has_data():
                     await update.message.reply_text(
                         f"📊 Найдены записи за {format_date_russian(target_date)}:",
                         reply_markup=InlineKeyboardMarkup([
@@ -938,23 +1451,155 @@ async def handle_wake_manual(update, user_id, wake_time, context):
             parse_mode='Markdown'
         )
 
+async def post_init(application: Application):
+    """Прогрев базы в фоне, пока бот уже принимает обновления"""
+    global running_applications
+    instance = application.bot_data['instance']
+    startup_report.mark("бот готов к приему обновлений")
+    asyncio.get_running_loop().run_in_executor(None, instance.storage.get)
+    running_applications += 1
+    if running_applications == 1:
+        await reports.start(application.bot)
+        profiler.install_signal_handler()
+
+async def post_shutdown(application: Application):
+    """Освобождение ресурсов при остановке"""
+    global running_applications
+    instance = application.bot_data['instance']
+    running_applications -= 1
+    if not running_applications:
+        charts.shutdown()
+        await reports.stop()
+    await instance.activity.flush()
+    instance.storage.close()
+    if instance.recorder:
+        instance.recorder.close()
+
+async def mark_update_handled(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Отметка о первом обработанном обновлении для отчета о запуске"""
+    startup_report.mark_first_update()
+
+def build_application(with_updater: bool = True, schedule_jobs: bool = True, persistence_file: str = None,
+                      instance: BotInstance = None) -> Application:
+    """Создание Application со всеми обработчиками (по умолчанию - для бота с BOT_TOKEN)"""
+    instance = instance or default_instance
+    builder = (
+        Application.builder()
+        .token(instance.token)
+        .base_url(config.BOT_API_BASE_URL)
+        .request(outbound)
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+    )
+    if not with_updater:
+        # Обновления приходят от супервизора, а не из Bot API
+        builder = builder.updater(None)
+    persistence_file = persistence_file or instance.persistence_file
+    if persistence_file:
+        # Сохраняется только user_data: в нем состояние незавершенных диалогов
+        builder = builder.persistence(PicklePersistence(
+            persistence_file,
+            store_data=PersistenceInput(bot_data=False, chat_data=False, callback_data=False),
+            update_interval=config.PERSISTENCE_INTERVAL
+        ))
+    application = builder.build()
+    
+    # Запись обезличенных обновлений для replay.py (группа -5); воркерам супервизора не нужна
+    if config.UPDATE_RECORD_FILE and with_updater:
+        from replay import UpdateRecorder
+        from storage import namespace_path
+        instance.recorder = UpdateRecorder(
+            namespace_path(config.UPDATE_RECORD_FILE, instance.name),
+            keep_texts=(FAST_SLEEP_TEXT, FAST_WAKE_TEXT)
+        )
+        instance.recorder.register(application)
+    
+    # Обновление обрабатывается с хранилищем и состоянием своего бота (группа -4)
+    instance.register(application)
+    
+    # Отсев уже обработанных обновлений (группа -3)
+    instance.lifecycle.register(application)
+    
+    # Ограничение частоты - раньше всех обработчиков (группа -2)
+    rate_limiter.register(application)
+    
+    # Обработчики команд
+    application.add_handler(CommandHandler("start", start))
+    application.add_handler(CommandHandler("chart", chart_command))
+    application.add_handler(CommandHandler("report", report_command))
+    application.add_handler(CommandHandler("search", search_command))
+    application.add_handler(CommandHandler("digest", digest_command))
+    application.add_handler(CommandHandler("fast", fast_command))
+    application.add_handler(CommandHandler("backup", backup_command))
+    application.add_handler(CommandHandler("verify_backup", verify_backup_command))
+    application.add_handler(CommandHandler("stats", stats_command))
+    application.add_handler(CommandHandler("profile", profile_command))
+    
+    # Обработчики кнопок
+    application.add_handler(CallbackQueryHandler(button_handler))
+    coalescer.register(application)
+    
+    # Кнопки быстрого режима - раньше общего обработчика текста
+    application.add_handler(MessageHandler(filters.Text([FAST_SLEEP_TEXT, FAST_WAKE_TEXT]), handle_fast_log))
+    
+    # Обработчик текстовых сообщений
+    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
+    
+    # Выполняется после основных обработчиков (группа 0)
+    application.add_handler(TypeHandler(Update, mark_update_handled), group=100)
+    
+    # Активность копится в каждом процессе, поэтому запись нужна во всех воркерах
+    schedule_activity_flush(application, instance.activity)
+    
+    # Фоновые задачи (в режиме супервизора - только в одном воркере)
+    if schedule_jobs:
+        from archive import schedule_archive_job
+        from backup import schedule_backup_job
+        from digest import schedule_digest_jobs
+        schedule_archive_job(application, instance.storage)
+        schedule_backup_job(application, instance.storage)
+        schedule_digest_jobs(application, instance.digests)
+    
+    return application
+
 def main():
     """Запуск бота"""
     try:
-        application = Application.builder().token(config.BOT_TOKEN).build()
+        if config.WORKER_PROCESSES > 0:
+            # Супервизор принимает обновления и раздает их рабочим процессам
+            from supervisor import run_supervisor
+            if config.BOT_INSTANCES:
+                logger.warning("BOT_INSTANCES is ignored in supervisor mode, serving BOT_TOKEN only")
+            print(f"Бот запущен в режиме супервизора ({config.WORKER_PROCESSES} воркеров)...")
+            run_supervisor(config.WORKER_PROCESSES)
+            return
         
-        # Обработчики команд
-        application.add_handler(CommandHandler("start", start))
+        if config.BOT_INSTANCES:
+            # Несколько ботов в одном процессе: общие пулы, у каждого свое пространство имен
+            instances = load_instances()
+            for instance in instances:
+                build_application(instance=instance)
+            if config.WEBHOOK_URL:
+                logger.warning("Webhook is not supported with BOT_INSTANCES, using polling")
+            print(f"Запущено ботов: {len(instances)} ({', '.join(instance.name for instance in instances)})...")
+            asyncio.run(run_instances(instances))
+            return
         
-        # Обработчики кнопок
-        application.add_handler(CallbackQueryHandler(button_handler))
+        application = build_application()
         
-        # Обработчик текстовых сообщений
-        application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
+        def start_updater():
+            if config.WEBHOOK_URL:
+                return application.updater.start_webhook(
+                    listen=config.WEBHOOK_LISTEN,
+                    port=config.WEBHOOK_PORT,
+                    url_path=config.WEBHOOK_PATH,
+                    webhook_url=config.WEBHOOK_URL
+                )
+            return application.updater.start_polling()
         
-        # Запуск бота
+        # Запуск бота; SIGTERM/SIGINT останавливают его плавно
         print("Бот запущен...")
-        application.run_polling()
+        asyncio.run(default_instance.lifecycle.run(application, start_updater))
         
     except Exception as e:
         logger.error(f"Error starting bot: {e}")
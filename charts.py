@@ -0,0 +1,138 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, datetime, timedelta
+from typing import List, Optional, Tuple
+
+import config
+
+logger = logging.getLogger(__name__)
+
+CHART_RANGES = {7: "7 дней", 30: "30 дней", 365: "год"}
+
+
+def render_chart(series: List[Tuple[date, Optional[str], int]], start_date: date, end_date: date, path: str):
+    """Отрисовка PNG с продолжительностью сна и временем засыпания (выполняется в отдельном процессе)"""
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    from matplotlib.ticker import FuncFormatter
+
+    dates = [day for day, _, _ in series]
+    hours = [minutes / 60 for _, _, minutes in series]
+
+    bedtime_dates = []
+    bedtimes = []
+    for day, sleep_time, _ in series:
+        if sleep_time:
+            moment = datetime.fromisoformat(sleep_time)
+            value = moment.hour + moment.minute / 60
+            # Засыпание после полуночи рисуем ниже вечернего, а не в начале суток
+            bedtime_dates.append(day)
+            bedtimes.append(value + 24 if value < 12 else value)
+
+    figure, (duration_ax, bedtime_ax) = plt.subplots(2, 1, figsize=(8, 6), sharex=True)
+
+    duration_ax.bar(dates, hours, color="#5b7bd5", width=0.8 if len(series) < 60 else 1.0)
+    duration_ax.set_ylabel("Сон, ч")
+    duration_ax.set_title(f"Сон с {start_date.strftime('%d.%m.%Y')} по {end_date.strftime('%d.%m.%Y')}")
+    duration_ax.grid(axis="y", alpha=0.3)
+
+    bedtime_ax.plot(bedtime_dates, bedtimes, marker="o", markersize=3, color="#d58b5b")
+    bedtime_ax.set_ylabel("Засыпание")
+    bedtime_ax.invert_yaxis()
+    bedtime_ax.yaxis.set_major_formatter(FuncFormatter(lambda value, _: f"{int(value) % 24:02d}:{int(value % 1 * 60):02d}"))
+    bedtime_ax.grid(alpha=0.3)
+    bedtime_ax.set_xlim(start_date - timedelta(days=1), end_date + timedelta(days=1))
+
+    figure.autofmt_xdate()
+    figure.tight_layout()
+
+    # Пишем во временный файл, чтобы кэш никогда не отдал недорисованный PNG
+    tmp_path = path + ".tmp"
+    figure.savefig(tmp_path, format="png", dpi=100)
+    plt.close(figure)
+    os.replace(tmp_path, path)
+
+
+class ChartService:
+    """Графики сна: отрисовка в пуле процессов, LRU-кэш PNG на диске и file_id Telegram"""
+
+    def __init__(self, cache_dir: str = None, max_files: int = None, workers: int = None):
+        self.cache_dir = cache_dir or config.CHART_CACHE_DIR
+        self.max_files = max_files or config.CHART_CACHE_MAX_FILES
+        self.workers = workers or config.CHART_WORKERS
+        self._executor = None
+        # file_id уже загруженных графиков: повторная отправка без загрузки файла
+        self._file_ids = OrderedDict()
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        """Пул процессов создается при первом графике"""
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        return self._executor
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.png")
+
+    def _evict(self):
+        """Удаление давно не использованных графиков сверх лимита"""
+        files = [os.path.join(self.cache_dir, name) for name in os.listdir(self.cache_dir) if name.endswith(".png")]
+        if len(files) <= self.max_files:
+            return
+        files.sort(key=os.path.getmtime)
+        for path in files[:len(files) - self.max_files]:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    async def get_chart(self, storage, user_id: int, days: int) -> Optional[Tuple[str, Optional[str], Optional[str]]]:
+        """Ключ графика, file_id (если уже загружен в Telegram) и путь к PNG"""
+        end_date = date.today()
+        start_date = end_date - timedelta(days=days - 1)
+
+        # Ревизия проверяется одним запросом по ключу, данные читаются только при промахе кэша;
+        # запросы к хранилищу - в потоке, чтобы не блокировать event loop
+        revision = await asyncio.to_thread(storage.get_revision, user_id)
+        key = f"{user_id}_{days}_{end_date.isoformat()}_{revision}"
+        if storage.namespace:
+            # Кэш общий для ботов процесса, а file_id у каждого бота свои
+            key = f"{storage.namespace}_{key}"
+
+        file_id = self._file_ids.get(key)
+        if file_id:
+            self._file_ids.move_to_end(key)
+            return key, file_id, None
+
+        path = self._path(key)
+        if os.path.exists(path):
+            os.utime(path)
+        else:
+            series = await asyncio.to_thread(storage.get_sleep_series, user_id, start_date, end_date)
+            if not series:
+                return None
+            os.makedirs(self.cache_dir, exist_ok=True)
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(self._get_executor(), render_chart, series, start_date, end_date, path)
+            self._evict()
+
+        return key, None, path
+
+    def remember_file_id(self, key: str, file_id: str):
+        """Сохранение file_id загруженного графика"""
+        self._file_ids[key] = file_id
+        self._file_ids.move_to_end(key)
+        while len(self._file_ids) > self.max_files:
+            self._file_ids.popitem(last=False)
+
+    def shutdown(self):
+        """Остановка пула процессов"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,83 @@
+import logging
+import time
+from collections import OrderedDict
+from typing import Dict
+
+from telegram import Update
+from telegram.ext import Application, ApplicationHandlerStop, CallbackQueryHandler, ContextTypes
+
+import config
+
+logger = logging.getLogger(__name__)
+
+# Нажатие, обработка которого не завершилась за это время, больше не считается активным
+STALE_SECONDS = 30
+
+
+class CallbackCoalescer:
+    """Отбрасывание повторных нажатий одной кнопки до того, как они дойдут до обработчиков.
+
+    Ключ - (бот, пользователь, сообщение, callback_data). Повтор отбрасывается, пока
+    первое нажатие обрабатывается и еще window секунд после его завершения.
+    """
+
+    def __init__(self, window: float = None):
+        self.window = window if window is not None else config.CALLBACK_COALESCE_WINDOW
+        # ключ -> [начало обработки, конец обработки или None]
+        self._taps: OrderedDict = OrderedDict()
+        self.metrics = {'callbacks': 0, 'coalesced': 0}
+
+    @staticmethod
+    def _key(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        query = update.callback_query
+        message_id = query.message.message_id if query.message else query.inline_message_id
+        # Номера сообщений у разных ботов одного процесса могут совпадать
+        return context.bot.id, query.from_user.id, message_id, query.data
+
+    def _evict(self, now: float):
+        """Удаление старых нажатий (ключи упорядочены по времени последнего нажатия)"""
+        while self._taps:
+            started, finished = next(iter(self._taps.values()))
+            if finished is not None and now - finished < self.window:
+                break
+            if finished is None and now - started < STALE_SECONDS:
+                break
+            self._taps.popitem(last=False)
+
+    async def before(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Группа -1: повтор подтверждается без обработки, остальные группы пропускаются"""
+        now = time.monotonic()
+        self._evict(now)
+        self.metrics['callbacks'] += 1
+
+        key = self._key(update, context)
+        tap = self._taps.get(key)
+        if tap is not None:
+            started, finished = tap
+            active = finished is None and now - started < STALE_SECONDS
+            if active or (finished is not None and now - finished < self.window):
+                self.metrics['coalesced'] += 1
+                try:
+                    # Убираем часики на кнопке, не повторяя работу обработчика
+                    await update.callback_query.answer()
+                except Exception as e:
+                    logger.debug(f"Could not answer coalesced callback: {e}")
+                raise ApplicationHandlerStop
+
+        self._taps[key] = [now, None]
+        self._taps.move_to_end(key)
+
+    async def after(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Группа 1: отметка о завершении обработки нажатия"""
+        tap = self._taps.get(self._key(update, context))
+        if tap is not None:
+            tap[1] = time.monotonic()
+
+    def register(self, application: Application):
+        """Подключение до и после основных обработчиков"""
+        application.add_handler(CallbackQueryHandler(self.before), group=-1)
+        application.add_handler(CallbackQueryHandler(self.after), group=1)
+
+    def stats(self) -> Dict:
+        """Сколько нажатий отброшено как повторы"""
+        return {**self.metrics, 'tracked': len(self._taps)}
@@ -1,13 +1,38 @@
 import sqlite3
 import logging
+import json
+import re
+import time
+import zlib
 from datetime import datetime, date, timedelta
-from typing import List, Dict, Optional, Tuple
+from typing import List, Dict, Iterator, Optional, Tuple
+import config
+from intervals import merge_rows, parse_time
+from models import DaySummary, DigestData, SleepSession
+from storage import DayState, Storage, apply_sleep_event, normalize_symptom
 
 logger = logging.getLogger(__name__)
 
-class Database:
-    def __init__(self, db_name: str):
+# Версия схемы хранится в PRAGMA user_version; при совпадении проверки схемы пропускаются
+SCHEMA_VERSION = 9
+
+# Формат времени в sleep_sessions: одинаковый для всех строк, чтобы диапазоны сравнивались как текст
+SESSION_TIME_FORMAT = '%Y-%m-%dT%H:%M:%S'
+
+def build_fts_query(text: str) -> Optional[str]:
+    """Запрос FTS5: симптомы каталога, где есть все слова (по префиксу)"""
+    words = re.findall(r'\w+', text.lower())
+    if not words:
+        return None
+    # Слова в кавычках, чтобы пользовательский ввод не разбирался как синтаксис FTS5
+    return ' AND '.join(f'"{word}"*' for word in words)
+
+class Database(Storage):
+    """Хранилище на SQLite (используется по умолчанию)"""
+
+    def __init__(self, db_name: str, archive_name: str = None):
         self.db_name = db_name
+        self.archive_name = archive_name
         self.init_db()
 
     def get_connection(self):
@@ -20,6 +45,14 @@ class Database:
             with self.get_connection() as conn:
                 cursor = conn.cursor()
                 
+                cursor.execute('PRAGMA user_version')
+                version = cursor.fetchone()[0]
+                if version == SCHEMA_VERSION:
+                    return
+                
+                # Для новых баз - постраничное освобождение места после архивации
+                cursor.execute('PRAGMA auto_vacuum = INCREMENTAL')
+                
                 # Таблица пользователей
                 cursor.execute('''
                     CREATE TABLE IF NOT EXISTS users (
@@ -74,19 +107,528 @@ class Database:
                     )
                 ''')
                 
+                # Журнал изменений для инкрементальных потребителей (seq только растет)
+                cursor.execute('''
+                    CREATE TABLE IF NOT EXISTS change_log (
+                        seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                        user_id INTEGER NOT NULL,
+                        date TEXT,
+                        operation TEXT NOT NULL,
+                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                    )
+                ''')
+                cursor.execute('CREATE INDEX IF NOT EXISTS idx_change_log_created_at ON change_log (created_at)')
+                
+                # Миграции существующих баз
+                if version < 2:
+                    # Ревизия данных пользователя для дешевой проверки кэшей
+                    cursor.execute('ALTER TABLE users ADD COLUMN revision INTEGER NOT NULL DEFAULT 0')
+                if version < 4:
+                    # Последняя активность для DAU/WAU/MAU
+                    cursor.execute('ALTER TABLE users ADD COLUMN last_seen TIMESTAMP')
+                    cursor.execute('CREATE INDEX IF NOT EXISTS idx_users_last_seen ON users (last_seen)')
+                if version < 5:
+                    # Полнотекстовый поиск по симптомам; user_id в индексе, чтобы
+                    # FTS5 сам пересекал списки документов пользователя и слова
+                    cursor.execute('''
+                        CREATE VIRTUAL TABLE IF NOT EXISTS symptoms_fts USING fts5(
+                            user_id, symptom_text,
+                            content='symptoms', content_rowid='id',
+                            tokenize='unicode61 remove_diacritics 2'
+                        )
+                    ''')
+                    cursor.execute('''
+                        CREATE TRIGGER IF NOT EXISTS symptoms_fts_insert AFTER INSERT ON symptoms BEGIN
+                            INSERT INTO symptoms_fts (rowid, user_id, symptom_text)
+                            VALUES (new.id, new.user_id, new.symptom_text);
+                        END
+                    ''')
+                    cursor.execute('''
+                        CREATE TRIGGER IF NOT EXISTS symptoms_fts_delete AFTER DELETE ON symptoms BEGIN
+                            INSERT INTO symptoms_fts (symptoms_fts, rowid, user_id, symptom_text)
+                            VALUES ('delete', old.id, old.user_id, old.symptom_text);
+                        END
+                    ''')
+                    cursor.execute('''
+                        CREATE TRIGGER IF NOT EXISTS symptoms_fts_update AFTER UPDATE ON symptoms BEGIN
+                            INSERT INTO symptoms_fts (symptoms_fts, rowid, user_id, symptom_text)
+                            VALUES ('delete', old.id, old.user_id, old.symptom_text);
+                            INSERT INTO symptoms_fts (rowid, user_id, symptom_text)
+                            VALUES (new.id, new.user_id, new.symptom_text);
+                        END
+                    ''')
+                    cursor.execute("INSERT INTO symptoms_fts (symptoms_fts) VALUES ('rebuild')")
+                if version < 6:
+                    self._migrate_symptom_catalog(cursor)
+                if version < 7:
+                    # Индексы в порядке выдачи: дни пользователя без полного просмотра
+                    # таблиц и без сортировки во временном B-дереве (см. query_plans.py)
+                    cursor.execute('CREATE INDEX IF NOT EXISTS idx_additional_sleeps_user_date ON additional_sleeps (user_id, date, sleep_time)')
+                    cursor.execute('CREATE INDEX IF NOT EXISTS idx_symptoms_user_date ON symptoms (user_id, date, created_at)')
+                    cursor.execute('DROP INDEX IF EXISTS idx_symptom_usage_top')
+                    cursor.execute('CREATE INDEX IF NOT EXISTS idx_symptom_usage_rank ON symptom_usage (user_id, uses DESC, last_used DESC)')
+                if version < 8:
+                    # Подписка на утреннюю сводку и готовые тексты сводок
+                    cursor.execute('ALTER TABLE users ADD COLUMN digest_enabled BOOLEAN NOT NULL DEFAULT FALSE')
+                    cursor.execute('CREATE INDEX IF NOT EXISTS idx_users_digest ON users (digest_enabled, user_id)')
+                    cursor.execute('''
+                        CREATE TABLE IF NOT EXISTS digests (
+                            digest_date TEXT NOT NULL,
+                            user_id INTEGER NOT NULL,
+                            text TEXT NOT NULL,
+                            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                            sent_at TIMESTAMP,
+                            PRIMARY KEY (digest_date, user_id)
+                        )
+                    ''')
+                if version < 9:
+                    self._migrate_sleep_sessions(cursor)
+                
+                cursor.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
                 conn.commit()
                 logger.info("Database initialized successfully")
         except Exception as e:
             logger.error(f"Error initializing database: {e}")
 
+    def _migrate_symptom_catalog(self, cursor):
+        """Перевод symptoms на каталог: текст хранится один раз, в symptoms - ссылка"""
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS symptom_catalog (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                text TEXT NOT NULL,
+                normalized TEXT NOT NULL UNIQUE,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        
+        # Счетчики использования для быстрого выбора частых симптомов пользователя
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS symptom_usage (
+                user_id INTEGER NOT NULL,
+                catalog_id INTEGER NOT NULL,
+                uses INTEGER NOT NULL DEFAULT 0,
+                last_used TIMESTAMP,
+                PRIMARY KEY (user_id, catalog_id)
+            ) WITHOUT ROWID
+        ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_symptom_usage_top ON symptom_usage (user_id, uses DESC)')
+        
+        # Поиск переезжает на каталог: уникальных текстов намного меньше, чем записей
+        for trigger in ('symptoms_fts_insert', 'symptoms_fts_delete', 'symptoms_fts_update'):
+            cursor.execute(f'DROP TRIGGER IF EXISTS {trigger}')
+        cursor.execute('DROP TABLE IF EXISTS symptoms_fts')
+        
+        cursor.execute('ALTER TABLE symptoms ADD COLUMN catalog_id INTEGER REFERENCES symptom_catalog (id)')
+        
+        # lower() в SQLite не знает кириллицу, поэтому нормализуем в Python
+        cursor.execute('SELECT DISTINCT symptom_text FROM symptoms WHERE symptom_text IS NOT NULL')
+        mapping = [(text, self._intern_symptom(cursor, text)) for (text,) in cursor.fetchall()]
+        # Один проход по symptoms с поиском по ключу вместо UPDATE на каждый текст
+        cursor.execute('CREATE TEMP TABLE symptom_migration (text TEXT PRIMARY KEY, catalog_id INTEGER)')
+        cursor.executemany('INSERT INTO symptom_migration (text, catalog_id) VALUES (?, ?)', mapping)
+        cursor.execute('''
+            UPDATE symptoms SET catalog_id = (
+                SELECT catalog_id FROM symptom_migration WHERE text = symptoms.symptom_text
+            )
+        ''')
+        cursor.execute('DROP TABLE symptom_migration')
+        
+        cursor.execute('ALTER TABLE symptoms DROP COLUMN symptom_text')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_symptoms_user_catalog ON symptoms (user_id, catalog_id)')
+        
+        cursor.execute('''
+            INSERT INTO symptom_usage (user_id, catalog_id, uses, last_used)
+            SELECT user_id, catalog_id, COUNT(*), MAX(created_at) FROM symptoms
+            WHERE catalog_id IS NOT NULL
+            GROUP BY user_id, catalog_id
+        ''')
+        
+        # Счетчики ведутся триггерами в той же транзакции, что и запись симптома
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS symptom_usage_insert AFTER INSERT ON symptoms BEGIN
+                INSERT INTO symptom_usage (user_id, catalog_id, uses, last_used)
+                VALUES (new.user_id, new.catalog_id, 1, CURRENT_TIMESTAMP)
+                ON CONFLICT (user_id, catalog_id) DO UPDATE
+                SET uses = uses + 1, last_used = CURRENT_TIMESTAMP;
+            END
+        ''')
+        # Архивация удаляет симптомы, но это не отмена: счетчики не уменьшаются,
+        # пока в транзакции архивации есть строка в archive_in_progress
+        cursor.execute('CREATE TABLE IF NOT EXISTS archive_in_progress (flag INTEGER PRIMARY KEY)')
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS symptom_usage_delete AFTER DELETE ON symptoms
+            WHEN NOT EXISTS (SELECT 1 FROM archive_in_progress) BEGIN
+                UPDATE symptom_usage SET uses = uses - 1
+                WHERE user_id = old.user_id AND catalog_id = old.catalog_id;
+            END
+        ''')
+        
+        cursor.execute('''
+            CREATE VIRTUAL TABLE IF NOT EXISTS symptom_catalog_fts USING fts5(
+                text, content='symptom_catalog', content_rowid='id',
+                tokenize='unicode61 remove_diacritics 2'
+            )
+        ''')
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS symptom_catalog_fts_insert AFTER INSERT ON symptom_catalog BEGIN
+                INSERT INTO symptom_catalog_fts (rowid, text) VALUES (new.id, new.text);
+            END
+        ''')
+        cursor.execute("INSERT INTO symptom_catalog_fts (symptom_catalog_fts) VALUES ('rebuild')")
+
+    def _migrate_sleep_sessions(self, cursor):
+        """Единая таблица интервалов сна (основной и дополнительные) с индексом по началу.
+
+        days и additional_sleeps остаются основными таблицами записи, а
+        sleep_sessions ведется триггерами в той же транзакции. Время хранится
+        в одном формате, конец основного сна через полночь уже на следующие сутки.
+        """
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS sleep_sessions (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER NOT NULL,
+                date TEXT NOT NULL,
+                kind TEXT NOT NULL,
+                source_id INTEGER NOT NULL,
+                start_ts TEXT NOT NULL,
+                end_ts TEXT,
+                minutes INTEGER
+            )
+        ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_sleep_sessions_user_start ON sleep_sessions (user_id, start_ts)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_sleep_sessions_day ON sleep_sessions (user_id, date, kind)')
+        cursor.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_sleep_sessions_source ON sleep_sessions (kind, source_id)')
+        
+        main_session = f'''
+            SELECT new.user_id, new.date, 'main', new.id, strftime('{SESSION_TIME_FORMAT}', new.sleep_time),
+                   CASE
+                       WHEN new.wake_time IS NULL THEN NULL
+                       WHEN new.wake_time < new.sleep_time THEN strftime('{SESSION_TIME_FORMAT}', new.wake_time, '+1 day')
+                       ELSE strftime('{SESSION_TIME_FORMAT}', new.wake_time)
+                   END,
+                   new.total_sleep_minutes
+            WHERE new.sleep_time IS NOT NULL
+        '''
+        nap_session = f'''
+            SELECT new.user_id, new.date, 'nap', new.id, strftime('{SESSION_TIME_FORMAT}', new.sleep_time),
+                   strftime('{SESSION_TIME_FORMAT}', new.wake_time), new.sleep_minutes
+            WHERE new.sleep_time IS NOT NULL
+        '''
+        columns = 'sleep_sessions (user_id, date, kind, source_id, start_ts, end_ts, minutes)'
+        
+        # INSERT OR REPLACE в days удаляет старую строку без триггера DELETE,
+        # поэтому и вставка сначала убирает основной сон этого дня
+        for event, row in (('INSERT', 'new'), ('UPDATE', 'old')):
+            cursor.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS days_session_{event.lower()} AFTER {event} ON days BEGIN
+                    DELETE FROM sleep_sessions WHERE user_id = {row}.user_id AND date = {row}.date AND kind = 'main';
+                    INSERT INTO {columns} {main_session};
+                END
+            ''')
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS days_session_delete AFTER DELETE ON days BEGIN
+                DELETE FROM sleep_sessions WHERE user_id = old.user_id AND date = old.date AND kind = 'main';
+            END
+        ''')
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS additional_sleeps_session_insert AFTER INSERT ON additional_sleeps BEGIN
+                INSERT INTO {columns} {nap_session};
+            END
+        ''')
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS additional_sleeps_session_update AFTER UPDATE ON additional_sleeps BEGIN
+                DELETE FROM sleep_sessions WHERE kind = 'nap' AND source_id = old.id;
+                INSERT INTO {columns} {nap_session};
+            END
+        ''')
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS additional_sleeps_session_delete AFTER DELETE ON additional_sleeps BEGIN
+                DELETE FROM sleep_sessions WHERE kind = 'nap' AND source_id = old.id;
+            END
+        ''')
+        
+        # Перенос существующих записей
+        cursor.execute(f'''
+            INSERT INTO {columns}
+            SELECT user_id, date, 'main', id, strftime('{SESSION_TIME_FORMAT}', sleep_time),
+                   CASE
+                       WHEN wake_time IS NULL THEN NULL
+                       WHEN wake_time < sleep_time THEN strftime('{SESSION_TIME_FORMAT}', wake_time, '+1 day')
+                       ELSE strftime('{SESSION_TIME_FORMAT}', wake_time)
+                   END,
+                   total_sleep_minutes
+            FROM days WHERE sleep_time IS NOT NULL
+        ''')
+        cursor.execute(f'''
+            INSERT INTO {columns}
+            SELECT user_id, date, 'nap', id, strftime('{SESSION_TIME_FORMAT}', sleep_time),
+                   strftime('{SESSION_TIME_FORMAT}', wake_time), sleep_minutes
+            FROM additional_sleeps WHERE sleep_time IS NOT NULL
+        ''')
+
+    def _intern_symptom(self, cursor, text: str) -> int:
+        """id текста в каталоге симптомов (добавляется при первом использовании)"""
+        normalized = normalize_symptom(text)
+        cursor.execute('SELECT id FROM symptom_catalog WHERE normalized = ?', (normalized,))
+        row = cursor.fetchone()
+        if row:
+            return row[0]
+        cursor.execute('INSERT INTO symptom_catalog (text, normalized) VALUES (?, ?)', (' '.join(text.split()), normalized))
+        return cursor.lastrowid
+
+    def get_top_symptoms(self, user_id: int, limit: int = 6) -> List[Tuple[int, str]]:
+        """Самые частые симптомы пользователя по счетчикам (без просмотра истории)"""
+        try:
+            with self.get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    SELECT u.catalog_id, c.text
+                    FROM symptom_usage u
+                    JOIN symptom_catalog c ON c.id = u.catalog_id
+                    WHERE u.user_id = ? AND u.uses > 0
+                    ORDER BY u.uses DESC, u.last_used DESC
+                    LIMIT ?
+                ''', (user_id, limit))
+                return cursor.fetchall()
+        except Exception as e:
+            logger.error(f"Error getting top symptoms for user {user_id}: {e}")
+            return []
+
+    def get_catalog_symptom(self, catalog_id: int) -> Optional[str]:
+        """Текст симптома из каталога"""
+        try:
+            with self.get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute('SELECT text FROM symptom_catalog WHERE id = ?', (catalog_id,))
+                row = cursor.fetchone()
+                return row[0] if row else None
+        except Exception as e:
+            logger.error(f"Error getting catalog symptom {catalog_id}: {e}")
+            return None
+
+    def _bump_revision(self, cursor, user_id: int):
+        """Увеличение ревизии данных пользователя (в транзакции записи)"""
+        cursor.execute('''
+            INSERT INTO users (user_id, revision) VALUES (?, 1)
+            ON CONFLICT(user_id) DO UPDATE SET revision = revision + 1
+        ''', (user_id,))
+
+    def _record_change(self, cursor, user_id: int, date_str: str, operation: str):
+        """Запись изменения в журнал и увеличение ревизии (в транзакции записи)"""
+        cursor.execute('''
+            INSERT INTO change_log (user_id, date, operation) VALUES (?, ?, ?)
+        ''', (user_id, date_str, operation))
+        self._bump_revision(cursor, user_id)
+
+    def get_changes(self, after_seq: int = 0, limit: int = 1000) -> List[Dict]:
+        """Изменения с номером больше after_seq в порядке записи"""
+        try:
+            with self.get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    SELECT seq, user_id, date, operation, created_at FROM change_log
+                    WHERE seq > ?
+                    ORDER BY seq
+                    LIMIT ?
+                ''', (after_seq, limit))
+                return [{
+                    'seq': row[0],
+                    'user_id': row[1],
+                    'date': date.fromisoformat(row[2]) if row[2] else None,
+                    'operation': row[3],
+                    'created_at': row[4]
+                } for row in cursor.fetchall()]
+        except Exception as e:
+            logger.error(f"Error getting changes after {after_seq}: {e}")
+            return []
+
+    def prune_changes(self, keep_days: int) -> int:
+        """Удаление записей журнала старше keep_days дней"""
+        try:
+            with self.get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute("DELETE FROM change_log WHERE created_at < datetime('now', ?)", (f'-{int(keep_days)} days',))
+                conn.commit()
+                return cursor.rowcount
+        except Exception as e:
+            logger.error(f"Error pruning change log: {e}")
+            return 0
+
+    def get_revision(self, user_id: int) -> int:
+        """Текущая ревизия данных пользователя (поиск по первичному ключу)"""
+        try:
+            with self.get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute('SELECT revision FROM users WHERE user_id = ?', (user_id,))
+                row = cursor.fetchone()
+                return row[0] if row else 0
+        except Exception as e:
+            logger.error(f"Error getting revision for user {user_id}: {e}")
+            return 0
+
+    def touch_users(self, seen: Dict[int, datetime]) -> bool:
+        """Пакетное обновление времени последней активности одной транзакцией"""
+        try:
+            with self.get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.executemany('''
+                    INSERT INTO users (user_id, last_seen) VALUES (?, ?)
+                    ON CONFLICT(user_id) DO UPDATE SET last_seen = MAX(COALESCE(last_seen, ''), excluded.last_seen)
+                ''', list(seen.items()))
+                conn.commit()
+                return True
+        except Exception as e:
+            logger.error(f"Error updating activity for {len(seen)} users: {e}")
+            return False
+
+    def get_activity_counts(self, now: datetime = None) -> Dict[str, int]:
+        """DAU/WAU/MAU одним проходом по индексу last_seen за последние 30 дней"""
+        now = now or datetime.now()
+        try:
+            with self.get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    SELECT COALESCE(SUM(last_seen >= ?), 0), COALESCE(SUM(last_seen >= ?), 0), COUNT(*)
+                    FROM users WHERE last_seen >= ?
+                ''', (now - timedelta(days=1), now - timedelta(days=7), now - timedelta(days=30)))
+                dau, wau, mau = cursor.fetchone()
+                return {'dau': dau, 'wau': wau, 'mau': mau}
+        except Exception as e:
+            logger.error(f"Error counting active users: {e}")
+            return {'dau': 0, 'wau': 0, 'mau': 0}
+
+    def set_digest_subscription(self, user_id: int, enabled: bool) -> bool:
+        """Подписка на утреннюю сводку (или отписка)"""
+        try:
+            with self.get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    INSERT INTO users (user_id, digest_enabled) VALUES (?, ?)
+                    ON CONFLICT(user_id) DO UPDATE SET digest_enabled = excluded.digest_enabled
+                ''', (user_id, enabled))
+                conn.commit()
+                return True
+        except Exception as e:
+            logger.error(f"Error updating digest subscription for user {user_id}: {e}")
+            return False
+
+    def is_digest_subscribed(self, user_id: int) -> bool:
+        """Подписан ли пользователь на утреннюю сводку"""
+        try:
+            with self.get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute('SELECT digest_enabled FROM users WHERE user_id = ?', (user_id,))
+                row = cursor.fetchone()
+                return bool(row and row[0])
+        except Exception as e:
+            logger.error(f"Error checking digest subscription for user {user_id}: {e}")
+            return False
+
+    def get_digest_data(self, digest_date: date, week_days: int = 7, symptom_days: int = 3) -> Dict[int, DigestData]:
+        """Данные сводок всех подписчиков: по одному запросу на таблицу, дни - по индексам (user_id, date)"""
+        last_date = (digest_date - timedelta(days=1)).isoformat()
+        week_start = (digest_date - timedelta(days=week_days)).isoformat()
+        symptoms_start = (digest_date - timedelta(days=symptom_days)).isoformat()
+        try:
+            with self.get_connection() as conn:
+                cursor = conn.cursor()
+                # Один снимок данных: подписка, оформленная между запросами, не разъедется со списком
+                cursor.execute('BEGIN')
+                cursor.execute('SELECT user_id FROM users WHERE digest_enabled = TRUE')
+                subscriber_ids = [row[0] for row in cursor.fetchall()]
+
+                cursor.execute('''
+                    SELECT d.user_id, d.date, d.sleep_time, d.wake_time, d.total_sleep_minutes, d.no_sleep
+                    FROM users u
+                    JOIN days d ON d.user_id = u.user_id AND d.date BETWEEN ? AND ?
+                    WHERE u.digest_enabled = TRUE
+                ''', (week_start, last_date))
+                day_rows = cursor.fetchall()
+
+                cursor.execute('''
+                    SELECT a.user_id, a.date, a.sleep_time, a.wake_time
+                    FROM users u
+                    JOIN additional_sleeps a ON a.user_id = u.user_id AND a.date BETWEEN ? AND ?
+                    WHERE u.digest_enabled = TRUE
+                ''', (week_start, last_date))
+                nap_rows = cursor.fetchall()
+
+                cursor.execute('''
+                    SELECT s.user_id, s.date, s.created_at, c.text
+                    FROM users u
+                    JOIN symptoms s ON s.user_id = u.user_id AND s.date BETWEEN ? AND ?
+                    JOIN symptom_catalog c ON c.id = s.catalog_id
+                    WHERE u.digest_enabled = TRUE
+                ''', (symptoms_start, last_date))
+                symptom_rows = cursor.fetchall()
+
+                return DigestData.collect(last_date, subscriber_ids, day_rows, nap_rows, symptom_rows)
+        except Exception as e:
+            logger.error(f"Error collecting digest data for {digest_date}: {e}")
+            return {}
+
+    def save_digests(self, digest_date: date, texts: Dict[int, str]) -> int:
+        """Сохранение готовых текстов сводок; время отправки уже отправленных не сбрасывается"""
+        date_str = digest_date.isoformat()
+        try:
+            with self.get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute('DELETE FROM digests WHERE digest_date < ?', (date_str,))
+                cursor.executemany('''
+                    INSERT INTO digests (digest_date, user_id, text) VALUES (?, ?, ?)
+                    ON CONFLICT(digest_date, user_id) DO UPDATE SET text = excluded.text
+                ''', [(date_str, user_id, text) for user_id, text in texts.items()])
+                conn.commit()
+                return len(texts)
+        except Exception as e:
+            logger.error(f"Error saving {len(texts)} digests for {digest_date}: {e}")
+            return 0
+
+    def get_pending_digests(self, digest_date: date, after_user_id: int = 0, limit: int = 500) -> List[Tuple[int, str]]:
+        """Неотправленные сводки за день по первичному ключу (digest_date, user_id)"""
+        try:
+            with self.get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    SELECT user_id, text FROM digests
+                    WHERE digest_date = ? AND user_id > ? AND sent_at IS NULL
+                    ORDER BY user_id
+                    LIMIT ?
+                ''', (digest_date.isoformat(), after_user_id, limit))
+                return cursor.fetchall()
+        except Exception as e:
+            logger.error(f"Error getting pending digests for {digest_date}: {e}")
+            return []
+
+    def mark_digests_sent(self, digest_date: date, user_ids: List[int]) -> bool:
+        """Отметка об отправке сводок одной транзакцией"""
+        date_str = digest_date.isoformat()
+        try:
+            with self.get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.executemany(
+                    'UPDATE digests SET sent_at = ? WHERE digest_date = ? AND user_id = ?',
+                    [(datetime.now(), date_str, user_id) for user_id in user_ids]
+                )
+                conn.commit()
+                return True
+        except Exception as e:
+            logger.error(f"Error marking {len(user_ids)} digests as sent: {e}")
+            return False
+
     def add_user(self, user_id: int, username: str, first_name: str, last_name: str):
         """Добавление пользователя"""
         try:
             with self.get_connection() as conn:
                 cursor = conn.cursor()
+                # Upsert вместо INSERT OR REPLACE, чтобы не сбрасывать revision и created_at
                 cursor.execute('''
-                    INSERT OR REPLACE INTO users (user_id, username, first_name, last_name)
+                    INSERT INTO users (user_id, username, first_name, last_name)
                     VALUES (?, ?, ?, ?)
+                    ON CONFLICT(user_id) DO UPDATE SET
+                        username = excluded.username,
+                        first_name = excluded.first_name,
+                        last_name = excluded.last_name
                 ''', (user_id, username or "", first_name or "", last_name or ""))
                 conn.commit()
         except Exception as e:
@@ -134,6 +676,8 @@ class Database:
                         VALUES (?, ?, ?, ?, FALSE)
                     ''', (user_id, date_str, sleep_time_str, datetime.now()))
                 
+                self._record_change(cursor, user_id, date_str, 'sleep')
+                
                 conn.commit()
                 return True
         except Exception as e:
@@ -192,12 +736,84 @@ class Database:
                         VALUES (?, ?, ?, ?, FALSE)
                     ''', (user_id, date_str, wake_time_str, datetime.now()))
                 
+                self._record_change(cursor, user_id, date_str, 'wake')
+                
                 conn.commit()
                 return True
         except Exception as e:
             logger.error(f"Error recording wake for user {user_id}: {e}")
             return False
 
+    def log_sleep_event(self, user_id: int, kind: str, at: datetime,
+                        target_date: date = None) -> Optional[Tuple[Optional[DayState], DayState]]:
+        """Засыпание или пробуждение одной записью (быстрый режим).
+
+        Прежнее состояние дня читается в том же соединении - оно нужно для
+        отмены, - а сам день записывается одним upsert.
+        """
+        try:
+            date_str = (target_date or at.date()).isoformat()
+            
+            with self.get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    SELECT sleep_time, wake_time, total_sleep_minutes, no_sleep FROM days
+                    WHERE user_id = ? AND date = ?
+                ''', (user_id, date_str))
+                row = cursor.fetchone()
+                previous = (row[0], row[1], row[2], bool(row[3])) if row else None
+                state = apply_sleep_event(previous, kind, at)
+                
+                cursor.execute('''
+                    INSERT INTO days (user_id, date, sleep_time, wake_time, total_sleep_minutes, no_sleep, updated_at)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT (user_id, date) DO UPDATE SET
+                        sleep_time = excluded.sleep_time,
+                        wake_time = excluded.wake_time,
+                        total_sleep_minutes = excluded.total_sleep_minutes,
+                        no_sleep = excluded.no_sleep,
+                        updated_at = excluded.updated_at
+                ''', (user_id, date_str, *state, datetime.now()))
+                self._record_change(cursor, user_id, date_str, kind)
+                
+                conn.commit()
+                return previous, state
+        except Exception as e:
+            logger.error(f"Error logging {kind} for user {user_id}: {e}")
+            return None
+
+    def undo_sleep_event(self, user_id: int, target_date: date, written: DayState,
+                         previous: Optional[DayState]) -> bool:
+        """Возврат дня к previous, если после записи written его никто не менял"""
+        try:
+            date_str = target_date.isoformat()
+            condition = '''
+                user_id = ? AND date = ? AND sleep_time IS ? AND wake_time IS ?
+                AND total_sleep_minutes IS ? AND no_sleep = ?
+            '''
+            
+            with self.get_connection() as conn:
+                cursor = conn.cursor()
+                if previous is None:
+                    # Дня до записи не было
+                    cursor.execute(f'DELETE FROM days WHERE {condition}', (user_id, date_str, *written))
+                else:
+                    cursor.execute(f'''
+                        UPDATE days
+                        SET sleep_time = ?, wake_time = ?, total_sleep_minutes = ?, no_sleep = ?, updated_at = ?
+                        WHERE {condition}
+                    ''', (*previous, datetime.now(), user_id, date_str, *written))
+                
+                if cursor.rowcount != 1:
+                    return False
+                self._record_change(cursor, user_id, date_str, 'undo')
+                
+                conn.commit()
+                return True
+        except Exception as e:
+            logger.error(f"Error undoing sleep event for user {user_id}: {e}")
+            return False
+
     def record_no_sleep(self, user_id: int, target_date: date = None) -> bool:
         """Запись отметки 'не спал'"""
         try:
@@ -212,6 +828,8 @@ class Database:
                     INSERT OR REPLACE INTO days (user_id, date, no_sleep, sleep_time, wake_time, total_sleep_minutes, updated_at)
                     VALUES (?, ?, TRUE, NULL, NULL, 0, ?)
                 ''', (user_id, date_str, datetime.now()))
+                self._record_change(cursor, user_id, date_str, 'no_sleep')
+                
                 conn.commit()
                 return True
         except Exception as e:
@@ -228,6 +846,9 @@ class Database:
             sleep_time_str = sleep_time.isoformat()
             wake_time_str = wake_time.isoformat()
             sleep_minutes = int((wake_time - sleep_time).total_seconds() / 60)
+            if sleep_minutes <= 0:
+                logger.warning(f"Rejected additional sleep for user {user_id}: {sleep_time} - {wake_time}")
+                return False
             
             with self.get_connection() as conn:
                 cursor = conn.cursor()
@@ -235,6 +856,8 @@ class Database:
                     INSERT INTO additional_sleeps (user_id, date, sleep_time, wake_time, sleep_minutes)
                     VALUES (?, ?, ?, ?, ?)
                 ''', (user_id, date_str, sleep_time_str, wake_time_str, sleep_minutes))
+                self._record_change(cursor, user_id, date_str, 'additional_sleep')
+                
                 conn.commit()
                 return True
         except Exception as e:
@@ -252,16 +875,18 @@ class Database:
             with self.get_connection() as conn:
                 cursor = conn.cursor()
                 cursor.execute('''
-                    INSERT INTO symptoms (user_id, date, symptom_text)
+                    INSERT INTO symptoms (user_id, date, catalog_id)
                     VALUES (?, ?, ?)
-                ''', (user_id, date_str, symptom_text))
+                ''', (user_id, date_str, self._intern_symptom(cursor, symptom_text)))
+                self._record_change(cursor, user_id, date_str, 'symptom')
+                
                 conn.commit()
                 return True
         except Exception as e:
             logger.error(f"Error adding symptom for user {user_id}: {e}")
             return False
 
-    def get_day_summary(self, user_id: int, target_date: date) -> Dict:
+    def get_day_summary(self, user_id: int, target_date: date) -> DaySummary:
         """Получение сводки за день"""
         try:
             date_str = target_date.isoformat()
@@ -286,51 +911,21 @@ class Database:
                     ORDER BY sleep_time
                 ''', (user_id, date_str))
                 
-                additional_sleeps = [{
-                    'sleep_time': row[0],
-                    'wake_time': row[1], 
-                    'sleep_minutes': row[2]
-                } for row in cursor.fetchall()]
+                additional_rows = cursor.fetchall()
                 
                 # Получаем симптомы
                 cursor.execute('''
-                    SELECT id, symptom_text 
-                    FROM symptoms 
-                    WHERE user_id = ? AND date = ?
-                    ORDER BY created_at
+                    SELECT s.id, c.text 
+                    FROM symptoms s
+                    JOIN symptom_catalog c ON c.id = s.catalog_id
+                    WHERE s.user_id = ? AND s.date = ?
+                    ORDER BY s.created_at
                 ''', (user_id, date_str))
                 
-                symptoms = [{'id': row[0], 'text': row[1]} for row in cursor.fetchall()]
-                
-                # Рассчитываем общее время сна (основной + дополнительные сны)
-                total_sleep_all_minutes = 0
-                main_sleep_minutes = sleep_data[2] if sleep_data and sleep_data[2] else 0
-                
-                for sleep in additional_sleeps:
-                    total_sleep_all_minutes += sleep['sleep_minutes']
-                
-                total_sleep_all_minutes += main_sleep_minutes
-                
-                return {
-                    'sleep_time': sleep_data[0] if sleep_data and sleep_data[0] else None,
-                    'wake_time': sleep_data[1] if sleep_data and sleep_data[1] else None,
-                    'total_sleep_minutes': sleep_data[2] if sleep_data else None,
-                    'total_sleep_all_minutes': total_sleep_all_minutes,  # Основной + доп. сны
-                    'no_sleep': bool(sleep_data[3]) if sleep_data else False,
-                    'additional_sleeps': additional_sleeps,
-                    'symptoms': symptoms
-                }
+                return DaySummary.from_rows(sleep_data, additional_rows, cursor.fetchall())
         except Exception as e:
             logger.error(f"Error getting day summary for user {user_id}: {e}")
-            return {
-                'sleep_time': None, 
-                'wake_time': None, 
-                'total_sleep_minutes': None, 
-                'total_sleep_all_minutes': 0,
-                'no_sleep': False,
-                'additional_sleeps': [],
-                'symptoms': []
-            }
+            return DaySummary()
 
     def check_existing_sleep_data(self, user_id: int, target_date: date) -> Dict:
         """Проверка существующих данных о сне за день"""
@@ -369,16 +964,15 @@ class Database:
             with self.get_connection() as conn:
                 cursor = conn.cursor()
                 
-                # Находим все дни где есть ЛЮБЫЕ данные
+                # Находим все дни где есть ЛЮБЫЕ данные; UNION на верхнем уровне
+                # сливает три индекса (user_id, date) без временного B-дерева
                 cursor.execute('''
-                    SELECT DISTINCT date FROM (
-                        SELECT date FROM days WHERE user_id = ? 
-                        UNION 
-                        SELECT date FROM additional_sleeps WHERE user_id = ?
-                        UNION
-                        SELECT date FROM symptoms WHERE user_id = ?
-                    ) 
-                    ORDER BY date DESC 
+                    SELECT date FROM days WHERE user_id = ?
+                    UNION
+                    SELECT date FROM additional_sleeps WHERE user_id = ?
+                    UNION
+                    SELECT date FROM symptoms WHERE user_id = ?
+                    ORDER BY date DESC
                     LIMIT ?
                 ''', (user_id, user_id, user_id, limit))
                 
@@ -404,22 +998,164 @@ class Database:
             logger.error(f"Error getting user days for user {user_id}: {e}")
             return []
 
-    def get_recent_days(self, user_id: int, days_count: int = 3) -> List[Dict]:
-        """Получение данных за последние N дней"""
+    def get_sleep_series(self, user_id: int, start_date: date, end_date: date) -> List[Tuple[date, Optional[str], int]]:
+        """Данные для графиков за период одним запросом"""
+        try:
+            start_str = start_date.isoformat()
+            end_str = end_date.isoformat()
+            
+            with self.get_connection() as conn:
+                cursor = conn.cursor()
+                # Слияние двух диапазонов индексов по дате; строки одного дня идут
+                # подряд, их интервалы объединяются в Python за один проход
+                cursor.execute('''
+                    SELECT date, 1, sleep_time, wake_time, total_sleep_minutes FROM days
+                    WHERE user_id = ? AND date BETWEEN ? AND ?
+                    UNION ALL
+                    SELECT date, 0, sleep_time, wake_time, sleep_minutes FROM additional_sleeps
+                    WHERE user_id = ? AND date BETWEEN ? AND ?
+                    ORDER BY date
+                ''', (user_id, start_str, end_str, user_id, start_str, end_str))
+                rows = cursor.fetchall()
+                
+                main_sleep_times = {row[0]: row[2] for row in rows if row[1]}
+                return [
+                    (date.fromisoformat(date_str), main_sleep_times.get(date_str), merged.asleep_minutes)
+                    for date_str, merged in merge_rows(rows)
+                ]
+        except Exception as e:
+            logger.error(f"Error getting sleep series for user {user_id}: {e}")
+            return []
+
+    def get_sleep_sessions(self, user_id: int, start: datetime, end: datetime) -> List[SleepSession]:
+        """Интервалы сна, пересекающие [start, end): один диапазон индекса (user_id, start_ts)"""
+        try:
+            with self.get_connection() as conn:
+                cursor = conn.cursor()
+                # Начавшиеся до start попадают в выборку, если сон не длиннее SLEEP_SESSION_MAX_HOURS
+                cursor.execute('''
+                    SELECT kind, date, start_ts, end_ts, minutes FROM sleep_sessions
+                    WHERE user_id = ? AND start_ts >= ? AND start_ts < ? AND (end_ts IS NULL OR end_ts > ?)
+                    ORDER BY start_ts
+                ''', (
+                    user_id,
+                    (start - timedelta(hours=config.SLEEP_SESSION_MAX_HOURS)).strftime(SESSION_TIME_FORMAT),
+                    end.strftime(SESSION_TIME_FORMAT),
+                    start.strftime(SESSION_TIME_FORMAT)
+                ))
+                return [
+                    SleepSession(kind, date_str, parse_time(start_ts), parse_time(end_ts), minutes)
+                    for kind, date_str, start_ts, end_ts, minutes in cursor.fetchall()
+                ]
+        except Exception as e:
+            logger.error(f"Error getting sleep sessions for user {user_id}: {e}")
+            return []
+
+    def count_user_days(self, user_id: int) -> int:
+        """Количество дней пользователя с любыми данными"""
         try:
-            recent_days = []
+            with self.get_connection() as conn:
+                cursor = conn.cursor()
+                # ORDER BY позволяет слить индексы (user_id, date) без временного B-дерева
+                cursor.execute('''
+                    SELECT COUNT(*) FROM (
+                        SELECT date FROM days WHERE user_id = ?
+                        UNION
+                        SELECT date FROM additional_sleeps WHERE user_id = ?
+                        UNION
+                        SELECT date FROM symptoms WHERE user_id = ?
+                        ORDER BY date
+                    )
+                ''', (user_id, user_id, user_id))
+                return cursor.fetchone()[0]
+        except Exception as e:
+            logger.error(f"Error counting user days for user {user_id}: {e}")
+            return 0
+
+    def iter_day_summaries(self, user_id: int, batch_size: int = 100) -> Iterator[Tuple[date, DaySummary]]:
+        """Сводки всех дней пользователя по возрастанию даты, порциями по batch_size дней"""
+        last_date = ''
+        
+        while True:
+            with self.get_connection() as conn:
+                cursor = conn.cursor()
+                
+                cursor.execute('''
+                    SELECT date FROM days WHERE user_id = ? AND date > ?
+                    UNION
+                    SELECT date FROM additional_sleeps WHERE user_id = ? AND date > ?
+                    UNION
+                    SELECT date FROM symptoms WHERE user_id = ? AND date > ?
+                    ORDER BY date
+                    LIMIT ?
+                ''', (user_id, last_date, user_id, last_date, user_id, last_date, batch_size))
+                dates = [row[0] for row in cursor.fetchall()]
+                
+                if not dates:
+                    return
+                
+                # Три запроса на всю порцию вместо трех на каждый день
+                bounds = (user_id, dates[0], dates[-1])
+                cursor.execute('''
+                    SELECT date, sleep_time, wake_time, total_sleep_minutes, no_sleep
+                    FROM days WHERE user_id = ? AND date BETWEEN ? AND ?
+                ''', bounds)
+                sleep_data = {row[0]: row[1:] for row in cursor.fetchall()}
+                
+                additional_rows = {}
+                cursor.execute('''
+                    SELECT date, sleep_time, wake_time, sleep_minutes
+                    FROM additional_sleeps WHERE user_id = ? AND date BETWEEN ? AND ?
+                    ORDER BY date, sleep_time
+                ''', bounds)
+                for row in cursor.fetchall():
+                    additional_rows.setdefault(row[0], []).append(row[1:])
+                
+                symptom_rows = {}
+                cursor.execute('''
+                    SELECT s.date, s.id, c.text
+                    FROM symptoms s JOIN symptom_catalog c ON c.id = s.catalog_id
+                    WHERE s.user_id = ? AND s.date BETWEEN ? AND ?
+                    ORDER BY s.date, s.created_at
+                ''', bounds)
+                for row in cursor.fetchall():
+                    symptom_rows.setdefault(row[0], []).append(row[1:])
             
-            for i in range(days_count):
-                target_date = date.today() - timedelta(days=i)
-                summary = self.get_day_summary(user_id, target_date)
-                recent_days.append({
-                    'date': target_date,
-                    'summary': summary
-                })
+            for date_str in dates:
+                yield date.fromisoformat(date_str), DaySummary.from_rows(
+                    sleep_data.get(date_str), additional_rows.get(date_str, []), symptom_rows.get(date_str, [])
+                )
             
-            return recent_days
+            last_date = dates[-1]
+
+    def search_symptoms(self, user_id: int, text: str, limit: int = 10, offset: int = 0) -> List[Tuple[date, List[str]]]:
+        """Дни с подходящими симптомами, лучшие совпадения (bm25) первыми"""
+        match = build_fts_query(text)
+        if match is None:
+            return []
+        
+        try:
+            with self.get_connection() as conn:
+                cursor = conn.cursor()
+                # Сначала совпадения в каталоге (MATERIALIZED: bm25() доступна только
+                # в запросе к самой FTS-таблице), затем дни пользователя по индексу
+                cursor.execute('''
+                    WITH matched AS MATERIALIZED (
+                        SELECT rowid AS catalog_id, text, bm25(symptom_catalog_fts) AS score
+                        FROM symptom_catalog_fts
+                        WHERE symptom_catalog_fts MATCH ?
+                    )
+                    SELECT s.date, json_group_array(m.text)
+                    FROM matched m
+                    JOIN symptoms s ON s.user_id = ? AND s.catalog_id = m.catalog_id
+                    GROUP BY s.date
+                    ORDER BY MIN(m.score), s.date DESC
+                    LIMIT ? OFFSET ?
+                ''', (match, user_id, limit, offset))
+                
+                return [(date.fromisoformat(row[0]), json.loads(row[1])) for row in cursor.fetchall()]
         except Exception as e:
-            logger.error(f"Error getting recent days for user {user_id}: {e}")
+            logger.error(f"Error searching symptoms for user {user_id}: {e}")
             return []
 
     def delete_day(self, user_id: int, target_date: date) -> bool:
@@ -439,6 +1175,8 @@ class Database:
                 # Удаляем симптомы
                 cursor.execute('DELETE FROM symptoms WHERE user_id = ? AND date = ?', (user_id, date_str))
                 
+                self._record_change(cursor, user_id, date_str, 'delete_day')
+                
                 conn.commit()
                 return True
         except Exception as e:
@@ -450,7 +1188,11 @@ class Database:
         try:
             with self.get_connection() as conn:
                 cursor = conn.cursor()
+                cursor.execute('SELECT user_id, date FROM symptoms WHERE id = ?', (symptom_id,))
+                row = cursor.fetchone()
                 cursor.execute('DELETE FROM symptoms WHERE id = ?', (symptom_id,))
+                if row:
+                    self._record_change(cursor, row[0], row[1], 'delete_symptom')
                 conn.commit()
                 return True
         except Exception as e:
@@ -462,9 +1204,235 @@ class Database:
         try:
             with self.get_connection() as conn:
                 cursor = conn.cursor()
+                cursor.execute('SELECT user_id, date FROM additional_sleeps WHERE id = ?', (sleep_id,))
+                row = cursor.fetchone()
                 cursor.execute('DELETE FROM additional_sleeps WHERE id = ?', (sleep_id,))
+                if row:
+                    self._record_change(cursor, row[0], row[1], 'delete_additional_sleep')
                 conn.commit()
                 return True
         except Exception as e:
             logger.error(f"Error deleting additional sleep {sleep_id}: {e}")
-            return False
\ No newline at end of file
+            return False
+
+    def _attach_archive(self, cursor):
+        """Подключение архивной базы как схемы archive"""
+        cursor.execute('ATTACH DATABASE ? AS archive', (self.archive_name,))
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS archive.archived_days (
+                user_id INTEGER,
+                date TEXT,
+                total_sleep_all_minutes INTEGER,
+                has_main_data BOOLEAN,
+                payload BLOB,
+                archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (user_id, date)
+            )
+        ''')
+
+    def archive_days_before(self, cutoff: date, batch_size: int = 500) -> int:
+        """Перенос дней старше cutoff в архивную базу (не больше batch_size дней за вызов)"""
+        if not self.archive_name:
+            return 0
+        
+        try:
+            cutoff_str = cutoff.isoformat()
+            
+            with self.get_connection() as conn:
+                cursor = conn.cursor()
+                self._attach_archive(cursor)
+                
+                cursor.execute('''
+                    SELECT user_id, date FROM days WHERE date < ?
+                    UNION
+                    SELECT user_id, date FROM additional_sleeps WHERE date < ?
+                    UNION
+                    SELECT user_id, date FROM symptoms WHERE date < ?
+                    LIMIT ?
+                ''', (cutoff_str, cutoff_str, cutoff_str, batch_size))
+                
+                pairs = cursor.fetchall()
+                # Флаг виден только этой транзакции и снимается до commit
+                cursor.execute('INSERT INTO archive_in_progress (flag) VALUES (1)')
+                
+                for user_id, date_str in pairs:
+                    cursor.execute('''
+                        SELECT sleep_time, wake_time, total_sleep_minutes, no_sleep
+                        FROM days WHERE user_id = ? AND date = ?
+                    ''', (user_id, date_str))
+                    day = cursor.fetchone()
+                    
+                    cursor.execute('''
+                        SELECT sleep_time, wake_time, sleep_minutes
+                        FROM additional_sleeps WHERE user_id = ? AND date = ?
+                        ORDER BY sleep_time
+                    ''', (user_id, date_str))
+                    additional_sleeps = [list(row) for row in cursor.fetchall()]
+                    
+                    cursor.execute('''
+                        SELECT c.text FROM symptoms s JOIN symptom_catalog c ON c.id = s.catalog_id
+                        WHERE s.user_id = ? AND s.date = ?
+                        ORDER BY s.created_at
+                    ''', (user_id, date_str))
+                    symptoms = [row[0] for row in cursor.fetchall()]
+                    
+                    # День могли дописать после прошлой архивации - объединяем с архивом
+                    cursor.execute('''
+                        SELECT payload FROM archive.archived_days WHERE user_id = ? AND date = ?
+                    ''', (user_id, date_str))
+                    archived = cursor.fetchone()
+                    if archived:
+                        previous = json.loads(zlib.decompress(archived[0]))
+                        day = day or previous['day']
+                        additional_sleeps = previous['additional_sleeps'] + additional_sleeps
+                        symptoms = previous['symptoms'] + symptoms
+                    
+                    payload = {
+                        'day': list(day) if day else None,
+                        'additional_sleeps': additional_sleeps,
+                        'symptoms': symptoms
+                    }
+                    total_sleep_all_minutes = DaySummary.from_rows(day, additional_sleeps, []).total_sleep_all_minutes
+                    has_main_data = bool(day and (day[0] or day[1] or day[3]))
+                    
+                    cursor.execute('''
+                        INSERT OR REPLACE INTO archive.archived_days
+                        (user_id, date, total_sleep_all_minutes, has_main_data, payload)
+                        VALUES (?, ?, ?, ?, ?)
+                    ''', (user_id, date_str, total_sleep_all_minutes, has_main_data,
+                          zlib.compress(json.dumps(payload, ensure_ascii=False).encode('utf-8'))))
+                    
+                    cursor.execute('DELETE FROM days WHERE user_id = ? AND date = ?', (user_id, date_str))
+                    cursor.execute('DELETE FROM additional_sleeps WHERE user_id = ? AND date = ?', (user_id, date_str))
+                    cursor.execute('DELETE FROM symptoms WHERE user_id = ? AND date = ?', (user_id, date_str))
+                    self._record_change(cursor, user_id, date_str, 'archive')
+                
+                cursor.execute('DELETE FROM archive_in_progress')
+                conn.commit()
+                return len(pairs)
+        except Exception as e:
+            logger.error(f"Error archiving days before {cutoff}: {e}")
+            return 0
+
+    def get_archived_days(self, user_id: int, limit: int = 30, offset: int = 0) -> List[Tuple[date, bool]]:
+        """Получение списка архивных дней пользователя"""
+        if not self.archive_name:
+            return []
+        
+        try:
+            with self.get_connection() as conn:
+                cursor = conn.cursor()
+                self._attach_archive(cursor)
+                
+                cursor.execute('''
+                    SELECT date, has_main_data FROM archive.archived_days
+                    WHERE user_id = ?
+                    ORDER BY date DESC
+                    LIMIT ? OFFSET ?
+                ''', (user_id, limit, offset))
+                
+                return [(date.fromisoformat(row[0]), bool(row[1])) for row in cursor.fetchall()]
+        except Exception as e:
+            logger.error(f"Error getting archived days for user {user_id}: {e}")
+            return []
+
+    def get_archived_day_summary(self, user_id: int, target_date: date) -> Optional[DaySummary]:
+        """Получение сводки архивного дня (в формате get_day_summary)"""
+        if not self.archive_name:
+            return None
+        
+        try:
+            with self.get_connection() as conn:
+                cursor = conn.cursor()
+                self._attach_archive(cursor)
+                
+                cursor.execute('''
+                    SELECT payload FROM archive.archived_days
+                    WHERE user_id = ? AND date = ?
+                ''', (user_id, target_date.isoformat()))
+                
+                row = cursor.fetchone()
+                if not row:
+                    return None
+                
+                # Итог пересчитывается из интервалов: в старых архивах пересечения снов сложены
+                payload = json.loads(zlib.decompress(row[0]))
+                return DaySummary.from_rows(
+                    payload['day'], payload['additional_sleeps'], [(None, text) for text in payload['symptoms']]
+                )
+        except Exception as e:
+            logger.error(f"Error getting archived day summary for user {user_id}: {e}")
+            return None
+
+    def compact(self, max_pages: int = 1000):
+        """Постепенное освобождение места и обновление статистики планировщика"""
+        try:
+            conn = sqlite3.connect(self.db_name, isolation_level=None)
+            try:
+                if conn.execute('PRAGMA auto_vacuum').fetchone()[0] != 2:
+                    # Полный VACUUM блокирует базу, поэтому ночью не выполняется
+                    logger.warning("Incremental auto_vacuum is off, run 'python archive.py vacuum' once")
+                else:
+                    conn.execute(f'PRAGMA incremental_vacuum({int(max_pages)})').fetchall()
+                
+                # ANALYZE только по устаревшим таблицам и с ограничением числа строк
+                conn.execute('PRAGMA analysis_limit = 1000')
+                conn.execute('PRAGMA optimize')
+            finally:
+                conn.close()
+        except Exception as e:
+            logger.error(f"Error compacting database: {e}")
+
+    def enable_incremental_vacuum(self) -> bool:
+        """Однократное включение incremental auto_vacuum для базы, созданной до него.
+
+        Требует полного VACUUM: база блокируется на все время перестройки,
+        поэтому запускается вручную при остановленном боте.
+        """
+        try:
+            conn = sqlite3.connect(self.db_name, isolation_level=None)
+            try:
+                if conn.execute('PRAGMA auto_vacuum').fetchone()[0] == 2:
+                    return False
+                conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+                conn.execute('VACUUM')
+                return True
+            finally:
+                conn.close()
+        except Exception as e:
+            logger.error(f"Error enabling incremental auto_vacuum: {e}")
+            return False
+
+    def backup(self, target_path: str, pages: int = 256, sleep: float = 0.005) -> Dict:
+        """Онлайн-копия базы через sqlite3 backup API.
+
+        Копирование идет шагами по pages страниц с паузой между ними,
+        поэтому запись в базу во время копии не блокируется надолго.
+        """
+        started = time.perf_counter()
+        steps = 0
+        
+        def progress(status, remaining, total):
+            nonlocal steps
+            steps += 1
+        
+        source = sqlite3.connect(self.db_name)
+        target = sqlite3.connect(target_path)
+        try:
+            source.backup(target, pages=pages, progress=progress, sleep=sleep)
+            page_count = target.execute('PRAGMA page_count').fetchone()[0]
+            page_size = target.execute('PRAGMA page_size').fetchone()[0]
+        finally:
+            target.close()
+            source.close()
+        
+        seconds = time.perf_counter() - started
+        size = page_count * page_size
+        return {
+            'pages': page_count,
+            'page_size': page_size,
+            'bytes': size,
+            'steps': steps,
+            'seconds': seconds,
+            'mb_per_sec': size / 1024 / 1024 / seconds if seconds > 0 else 0.0
+        }
@@ -0,0 +1,187 @@
+import asyncio
+import logging
+import sys
+import time
+from datetime import date, datetime, timedelta
+from typing import Callable, Dict
+
+from telegram.error import Forbidden, RetryAfter
+from telegram.ext import Application, ContextTypes
+
+import config
+from models import DigestData
+from outbound import bulk_lane
+
+logger = logging.getLogger(__name__)
+
+
+def _format_minutes(minutes: int) -> str:
+    return f"{minutes // 60}ч {minutes % 60}м"
+
+
+def format_digest(digest_date: date, data: DigestData) -> str:
+    """Текст утренней сводки: прошлые сутки, среднее за неделю и недавние симптомы"""
+    last_date = digest_date - timedelta(days=1)
+    lines = [f"☀️ Доброе утро! Сводка за {last_date.strftime('%d.%m')}", ""]
+
+    if data.no_sleep:
+        lines.append("🚫 Не спал")
+    elif data.sleep_time or data.wake_time or data.last_minutes:
+        sleep_time = data.sleep_time.strftime('%H:%M') if data.sleep_time else "—"
+        wake_time = data.wake_time.strftime('%H:%M') if data.wake_time else "—"
+        lines.append(f"💤 Сон: {sleep_time} - {wake_time}, всего {_format_minutes(data.last_minutes)}")
+    else:
+        lines.append("💤 Сон не записан")
+
+    week_average = data.week_average
+    if week_average is not None:
+        lines.append(f"📊 В среднем за {config.DIGEST_WEEK_DAYS} дн.: {_format_minutes(week_average)}")
+
+    if data.symptoms:
+        lines.append(f"🤒 Симптомы за {config.DIGEST_SYMPTOM_DAYS} дн.: {', '.join(data.symptoms)}")
+
+    return "\n".join(lines)
+
+
+class DigestService:
+    """Утренние сводки подписчиков.
+
+    Ночью данные всех подписчиков читаются несколькими пакетными запросами,
+    тексты сводок сохраняются в базе. Утренняя рассылка только читает готовые
+    тексты порциями и отправляет их не быстрее rate сообщений в секунду.
+    Часы (clock) и ожидание (sleep) можно подменить, бот передается в send().
+    """
+
+    def __init__(self, storage, clock: Callable[[], datetime] = None, sleep=None, rate: int = None):
+        self.storage = storage
+        self.clock = clock or datetime.now
+        self.sleep = sleep or asyncio.sleep
+        self.rate = rate or config.DIGEST_SEND_PER_SECOND
+        self._built_for = None
+        self.metrics = {'built': 0, 'sent': 0, 'failed': 0, 'unsubscribed': 0, 'build_seconds': 0.0, 'send_seconds': 0.0}
+
+    def build(self, digest_date: date = None) -> int:
+        """Сборка и сохранение сводок всех подписчиков за день (вызывается в отдельном потоке)"""
+        digest_date = digest_date or self.clock().date()
+        started = time.perf_counter()
+        data = self.storage.get_digest_data(digest_date, config.DIGEST_WEEK_DAYS, config.DIGEST_SYMPTOM_DAYS)
+        texts = {user_id: format_digest(digest_date, item) for user_id, item in data.items()}
+        saved = self.storage.save_digests(digest_date, texts)
+
+        self._built_for = digest_date
+        self.metrics['built'] += saved
+        self.metrics['build_seconds'] += time.perf_counter() - started
+        logger.info(f"Built {saved} digests for {digest_date} in {time.perf_counter() - started:.2f}s")
+        return saved
+
+    async def _send_one(self, bot, user_id: int, text: str) -> bool:
+        """Отправка одной сводки; при RetryAfter - одна повторная попытка"""
+        for attempt in range(2):
+            try:
+                await bot.send_message(user_id, text)
+                return True
+            except RetryAfter as e:
+                if attempt:
+                    break
+                await self.sleep(e.retry_after)
+            except Forbidden:
+                # Пользователь заблокировал бота: отписываем, чтобы не писать ему каждое утро
+                await asyncio.to_thread(self.storage.set_digest_subscription, user_id, False)
+                self.metrics['unsubscribed'] += 1
+                break
+            except Exception as e:
+                logger.warning(f"Could not send digest to user {user_id}: {e}")
+                break
+        self.metrics['failed'] += 1
+        return False
+
+    async def send(self, bot, digest_date: date = None) -> Dict[str, int]:
+        """Рассылка готовых сводок за день: без запросов по каждому пользователю, с ограничением скорости"""
+        digest_date = digest_date or self.clock().date()
+        if self._built_for != digest_date:
+            # Ночная сборка пропущена (бот был остановлен) - собираем сейчас тем же пакетным проходом
+            await asyncio.to_thread(self.build, digest_date)
+
+        started = time.perf_counter()
+        sent = failed = 0
+        after_user_id = 0
+        with bulk_lane():
+            while True:
+                batch = await asyncio.to_thread(
+                    self.storage.get_pending_digests, digest_date, after_user_id, config.DIGEST_FETCH_SIZE
+                )
+                for start in range(0, len(batch), self.rate):
+                    if sent or failed:
+                        # Не больше rate сообщений в секунду
+                        elapsed = (self.clock() - second_started).total_seconds()
+                        if elapsed < 1:
+                            await self.sleep(1 - elapsed)
+                    second_started = self.clock()
+
+                    chunk = batch[start:start + self.rate]
+                    results = await asyncio.gather(*(self._send_one(bot, user_id, text) for user_id, text in chunk))
+                    sent += sum(results)
+                    failed += len(results) - sum(results)
+                    # Неудачные тоже отмечаются: повтор утром того же дня уже не нужен
+                    await asyncio.to_thread(self.storage.mark_digests_sent, digest_date, [user_id for user_id, _ in chunk])
+
+                if len(batch) < config.DIGEST_FETCH_SIZE:
+                    break
+                after_user_id = batch[-1][0]
+
+        self.metrics['sent'] += sent
+        self.metrics['send_seconds'] += time.perf_counter() - started
+        logger.info(f"Sent {sent} digests for {digest_date} ({failed} failed) in {time.perf_counter() - started:.1f}s")
+        return {'sent': sent, 'failed': failed}
+
+    def stats(self) -> Dict:
+        """Метрики сборки и рассылки"""
+        return dict(self.metrics)
+
+
+async def build_digests_job(context: ContextTypes.DEFAULT_TYPE):
+    """Ночная сборка сводок из job queue"""
+    try:
+        await asyncio.to_thread(context.job.data.build)
+    except Exception as e:
+        logger.error(f"Error building digests: {e}")
+
+
+async def send_digests_job(context: ContextTypes.DEFAULT_TYPE):
+    """Утренняя рассылка сводок из job queue"""
+    try:
+        await context.job.data.send(context.bot)
+    except Exception as e:
+        logger.error(f"Error sending digests: {e}")
+
+
+def schedule_digest_jobs(application: Application, service: DigestService):
+    """Регистрация ночной сборки и утренней рассылки сводок в job queue"""
+    if config.DIGEST_SEND_TIME is None:
+        return
+    if application.job_queue is None:
+        logger.warning("Job queue is not available, morning digests are disabled")
+        return
+
+    application.job_queue.run_daily(build_digests_job, time=config.DIGEST_BUILD_TIME, data=service, name="digest_build")
+    application.job_queue.run_daily(send_digests_job, time=config.DIGEST_SEND_TIME, data=service, name="digest_send")
+
+
+def main():
+    """Предпросмотр: сборка сводок за дату (по умолчанию сегодня) без отправки"""
+    from storage import create_database
+
+    digest_date = date.fromisoformat(sys.argv[1]) if len(sys.argv) > 1 else date.today()
+    storage = create_database()
+    try:
+        service = DigestService(storage)
+        count = service.build(digest_date)
+        print(f"Сводок за {digest_date}: {count} ({service.metrics['build_seconds'] * 1000:.0f} мс)")
+        for user_id, text in storage.get_pending_digests(digest_date, limit=3):
+            print(f"\n[{user_id}]\n{text}")
+    finally:
+        storage.close()
+
+
+if __name__ == '__main__':
+    main()
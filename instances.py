@@ -0,0 +1,99 @@
+import asyncio
+import logging
+import re
+from contextvars import ContextVar
+from functools import partial
+from typing import List, Optional
+
+from telegram import Update
+from telegram.ext import Application, ContextTypes, TypeHandler
+
+import config
+from activity import ActivityTracker
+from digest import DigestService
+from lifecycle import GracefulLifecycle, install_signal_handlers
+from storage import LazyStorage, create_database, namespace_path
+
+logger = logging.getLogger(__name__)
+
+# Имя бота становится частью имени файла и именем схемы PostgreSQL
+NAME_PATTERN = re.compile(r'^[a-z][a-z0-9_]*$')
+
+# Бот, чье обновление обрабатывается в текущей задаче
+_current: ContextVar = ContextVar('bot_instance', default=None)
+
+
+class BotInstance:
+    """Бот в общем процессе: токен, пространство имен хранилища и привязанное к нему состояние.
+
+    Активность, сводки, handoff и persistence у каждого бота свои. Пулы
+    процессов графиков и отчетов, исходящие соединения, ограничение частоты
+    и пул PostgreSQL общие для всех ботов процесса.
+    """
+
+    def __init__(self, name: Optional[str], token: str):
+        self.name = name
+        self.token = token
+        self.storage = LazyStorage(partial(create_database, namespace=name))
+        self.activity = ActivityTracker(self.storage)
+        self.digests = DigestService(self.storage)
+        self.lifecycle = GracefulLifecycle(handoff_path=namespace_path(config.HANDOFF_FILE, name))
+        self.persistence_file = namespace_path(config.PERSISTENCE_FILE, name)
+        # Запись обновлений для replay.py (UPDATE_RECORD_FILE), создается вместе с Application
+        self.recorder = None
+        self.application: Optional[Application] = None
+
+    async def bind(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Группа -4: остальные обработчики обновления работают с данными этого бота"""
+        _current.set(self)
+
+    def register(self, application: Application):
+        """Привязка Application к боту (раньше всех остальных обработчиков)"""
+        self.application = application
+        application.bot_data['instance'] = self
+        application.add_handler(TypeHandler(Update, self.bind), group=-4)
+
+    def __repr__(self):
+        return f"BotInstance({self.name!r})"
+
+
+class CurrentInstance:
+    """Атрибут бота, чье обновление сейчас обрабатывается.
+
+    Вне обработки обновлений (и в режиме одного бота) - атрибут бота по умолчанию.
+    """
+
+    def __init__(self, attribute: str, default: BotInstance):
+        self._attribute = attribute
+        self._default = default
+
+    def resolve(self):
+        return getattr(_current.get() or self._default, self._attribute)
+
+    def __getattr__(self, name):
+        return getattr(self.resolve(), name)
+
+
+def load_instances() -> List[BotInstance]:
+    """Боты из BOT_INSTANCES в порядке объявления"""
+    for name in config.BOT_INSTANCES:
+        if not NAME_PATTERN.match(name):
+            raise ValueError(f"Invalid bot instance name: {name!r}")
+    return [BotInstance(name, token) for name, token in config.BOT_INSTANCES.items()]
+
+
+async def run_instances(instances: List[BotInstance]):
+    """Все боты на одном event loop; SIGTERM/SIGINT останавливают их вместе"""
+    stop = asyncio.Event()
+    install_signal_handlers(stop.set)
+
+    async def run(instance: BotInstance):
+        application = instance.application
+        try:
+            await instance.lifecycle.run(application, application.updater.start_polling, stop)
+        except Exception as e:
+            logger.error(f"Bot instance {instance.name} stopped with error: {e}")
+            # Остальные боты тоже останавливаются: процесс перезапустится целиком
+            stop.set()
+
+    await asyncio.gather(*(run(instance) for instance in instances))
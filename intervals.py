@@ -0,0 +1,115 @@
+from datetime import datetime, timedelta
+from typing import Iterable, Iterator, List, Optional, Sequence, Tuple
+
+Interval = Tuple[datetime, datetime]
+
+
+def parse_time(value) -> Optional[datetime]:
+    """Время из строки ISO (SQLite/PostgreSQL хранят TEXT) или None"""
+    if not value:
+        return None
+    if isinstance(value, datetime):
+        return value
+    return datetime.fromisoformat(value)
+
+
+class SleepIntervals:
+    """Объединенные интервалы сна за день: реальное время сна, перерывы и пересечения"""
+
+    __slots__ = ('intervals', 'gaps', 'asleep_minutes', 'overlap_minutes')
+
+    def __init__(self, intervals: List[Interval], gaps: List[Interval], asleep_minutes: int, overlap_minutes: int):
+        self.intervals = intervals
+        self.gaps = gaps
+        self.asleep_minutes = asleep_minutes
+        self.overlap_minutes = overlap_minutes
+
+    def __repr__(self):
+        return (
+            f"SleepIntervals(intervals={self.intervals!r}, gaps={self.gaps!r}, "
+            f"asleep_minutes={self.asleep_minutes!r}, overlap_minutes={self.overlap_minutes!r})"
+        )
+
+
+def _minutes(start: datetime, end: datetime) -> int:
+    # Так же, как при записи сна: целые минуты с отбрасыванием секунд
+    return int((end - start).total_seconds() / 60)
+
+
+def main_sleep_interval(sleep_time, wake_time) -> Optional[Interval]:
+    """Интервал основного сна; пробуждение раньше засыпания - сон через полночь"""
+    sleep_time, wake_time = parse_time(sleep_time), parse_time(wake_time)
+    if not sleep_time or not wake_time:
+        return None
+    if wake_time < sleep_time:
+        wake_time += timedelta(days=1)
+    return sleep_time, wake_time
+
+
+def merge_intervals(intervals: Iterable[Interval], extra_minutes: int = 0) -> SleepIntervals:
+    """Объединение интервалов проходом по отсортированным началам.
+
+    Пересекающиеся интервалы сливаются, соприкасающиеся остаются отдельными
+    (без перерыва между ними), пустые и отрицательные отбрасываются.
+    extra_minutes - сон без известных границ (только длительность), он
+    добавляется к итогу как есть.
+    """
+    merged: List[List[datetime]] = []
+    raw_minutes = 0
+    for start, end in sorted(interval for interval in intervals if interval[1] > interval[0]):
+        raw_minutes += _minutes(start, end)
+        if merged and start < merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+
+    asleep = sum(_minutes(start, end) for start, end in merged)
+    gaps = [(merged[i][1], merged[i + 1][0]) for i in range(len(merged) - 1) if merged[i + 1][0] > merged[i][1]]
+    return SleepIntervals(
+        [(start, end) for start, end in merged], gaps, asleep + extra_minutes, raw_minutes - asleep
+    )
+
+
+def merge_between(intervals: Iterable[Tuple[datetime, Optional[datetime]]], start: datetime, end: datetime) -> SleepIntervals:
+    """Сон внутри [start, end): интервалы обрезаются по границам, незавершенные не учитываются"""
+    return merge_intervals(
+        (max(interval_start, start), min(interval_end, end))
+        for interval_start, interval_end in intervals if interval_end is not None
+    )
+
+
+def merge_day(sleep_time, wake_time, total_sleep_minutes: Optional[int], naps: Iterable[Sequence]) -> SleepIntervals:
+    """Основной сон и дополнительные сны одного дня; naps - (sleep_time, wake_time, ...)"""
+    intervals = []
+    extra_minutes = 0
+    main = main_sleep_interval(sleep_time, wake_time)
+    if main:
+        intervals.append(main)
+    elif total_sleep_minutes:
+        extra_minutes = total_sleep_minutes
+    for nap in naps:
+        start, end = parse_time(nap[0]), parse_time(nap[1])
+        if start and end:
+            intervals.append((start, end))
+    return merge_intervals(intervals, extra_minutes)
+
+
+def merge_rows(rows: Iterable[Sequence]) -> Iterator[Tuple[str, SleepIntervals]]:
+    """Объединение сна по дням для диапазона одним проходом.
+
+    rows - (date, is_main, sleep_time, wake_time, minutes), отсортированные по дате:
+    строка days (is_main) и строки additional_sleeps того же дня идут подряд.
+    Возвращает (date, SleepIntervals) по возрастанию даты.
+    """
+    current_date, main, naps = None, None, []
+    for date_str, is_main, sleep_time, wake_time, minutes in rows:
+        if date_str != current_date:
+            if current_date is not None:
+                yield current_date, merge_day(*(main or (None, None, None)), naps)
+            current_date, main, naps = date_str, None, []
+        if is_main:
+            main = (sleep_time, wake_time, minutes)
+        else:
+            naps.append((sleep_time, wake_time))
+    if current_date is not None:
+        yield current_date, merge_day(*(main or (None, None, None)), naps)
@@ -0,0 +1,197 @@
+import asyncio
+import json
+import logging
+import os
+import signal
+import time
+from collections import deque
+from typing import Dict, List
+
+from telegram import Update
+from telegram.ext import Application, ApplicationHandlerStop, ContextTypes, TypeHandler
+
+import config
+from startup import startup_report
+
+logger = logging.getLogger(__name__)
+
+
+def install_signal_handlers(callback):
+    """SIGTERM и SIGINT запускают плавную остановку"""
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, callback)
+        except NotImplementedError:
+            # Windows: остается KeyboardInterrupt
+            pass
+
+
+class GracefulLifecycle:
+    """Запуск и плавная остановка бота без потери и повторной обработки обновлений.
+
+    По SIGTERM/SIGINT прием новых обновлений прекращается (polling подтверждает
+    offset, webhook-сервер закрывается), уже полученные обрабатываются до
+    истечения drain_timeout. Необработанные к этому времени обновления и
+    номера последних обработанных сохраняются в handoff-файл: следующий
+    процесс начинает с них и пропускает уже обработанные update_id.
+    """
+
+    def __init__(self, drain_timeout: float = None, handoff_path: str = None, remember: int = None):
+        self.drain_timeout = drain_timeout if drain_timeout is not None else config.SHUTDOWN_DRAIN_TIMEOUT
+        self.handoff_path = handoff_path or config.HANDOFF_FILE
+        # Последние обработанные update_id (порядок - для вытеснения старых)
+        self._seen: deque = deque(maxlen=remember or config.HANDOFF_REMEMBER_UPDATES)
+        self._seen_ids = set()
+        self._stop = None
+        self.metrics = {'restored': 0, 'duplicates': 0, 'handed_off': 0}
+        self.shutdown_phases: List = []
+
+    def _remember(self, update_id: int):
+        if len(self._seen) == self._seen.maxlen:
+            self._seen_ids.discard(self._seen[0])
+        self._seen.append(update_id)
+        self._seen_ids.add(update_id)
+
+    async def dedupe(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Группа -3: обновление, уже обработанное этим или прошлым процессом, пропускается"""
+        if update.update_id in self._seen_ids:
+            self.metrics['duplicates'] += 1
+            raise ApplicationHandlerStop
+        self._remember(update.update_id)
+
+    def register(self, application: Application):
+        """Подключение проверки повторов раньше всех обработчиков"""
+        application.add_handler(TypeHandler(Update, self.dedupe), group=-3)
+
+    def restore(self, application: Application) -> int:
+        """Загрузка handoff-файла: номера обработанных обновлений и необработанная очередь"""
+        if not os.path.exists(self.handoff_path):
+            return 0
+
+        try:
+            with open(self.handoff_path, encoding='utf-8') as f:
+                handoff = json.load(f)
+            for update_id in handoff.get('seen', []):
+                self._remember(update_id)
+            for data in handoff.get('updates', []):
+                application.update_queue.put_nowait(Update.de_json(data, application.bot))
+            self.metrics['restored'] = len(handoff.get('updates', []))
+        except Exception as e:
+            logger.error(f"Error restoring handoff file {self.handoff_path}: {e}")
+        finally:
+            # Файл нужен один раз: повторный запуск не должен снова брать эти обновления
+            os.remove(self.handoff_path)
+        return self.metrics['restored']
+
+    def _take_pending(self, application: Application) -> List[Update]:
+        """Извлечение обновлений, которые не успели обработать до истечения срока"""
+        pending = []
+        while not application.update_queue.empty():
+            pending.append(application.update_queue.get_nowait())
+            application.update_queue.task_done()
+        return pending
+
+    def save_handoff(self, pending: List[Update]):
+        """Атомарная запись handoff-файла для следующего процесса"""
+        handoff = {
+            'saved_at': time.time(),
+            'seen': list(self._seen),
+            'updates': [update.to_dict() for update in pending if isinstance(update, Update)]
+        }
+        tmp_path = f"{self.handoff_path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(handoff, f, ensure_ascii=False)
+        os.replace(tmp_path, self.handoff_path)
+        self.metrics['handed_off'] = len(handoff['updates'])
+
+    async def _phase(self, name: str, coro):
+        """Замер фазы остановки"""
+        started = time.perf_counter()
+        try:
+            return await coro
+        finally:
+            self.shutdown_phases.append((name, time.perf_counter() - started))
+
+    async def drain(self, application: Application) -> bool:
+        """Ожидание обработки уже полученных обновлений, не дольше drain_timeout"""
+        try:
+            await asyncio.wait_for(application.update_queue.join(), timeout=self.drain_timeout)
+            return True
+        except asyncio.TimeoutError:
+            logger.warning(f"Updates were not drained in {self.drain_timeout}s, handing off the rest")
+            return False
+
+    def request_stop(self):
+        """Начать плавную остановку (обработчик сигналов)"""
+        if self._stop is not None:
+            self._stop.set()
+
+    async def run(self, application: Application, start_updater, stop: asyncio.Event = None):
+        """Полный цикл работы: запуск, ожидание сигнала, дренаж и остановка.
+
+        stop - общее событие остановки нескольких ботов процесса; сигналы
+        тогда обрабатывает тот, кто его создал.
+        """
+        self._stop = stop
+        if stop is None:
+            self._stop = asyncio.Event()
+            install_signal_handlers(self.request_stop)
+
+        try:
+            with startup_report.measure("инициализация Application"):
+                await application.initialize()
+                if application.post_init:
+                    await application.post_init(application)
+            self.restore(application)
+            with startup_report.measure("запуск приема обновлений"):
+                await start_updater()
+                await application.start()
+            if self.metrics['restored']:
+                logger.warning(f"Restored {self.metrics['restored']} unprocessed updates from previous process")
+
+            await self._stop.wait()
+        finally:
+            await self.shutdown(application)
+
+    async def shutdown(self, application: Application):
+        """Остановка: прием, дренаж, handoff, задачи и состояние, ресурсы"""
+        started = time.perf_counter()
+
+        if application.updater and application.updater.running:
+            # Polling при остановке подтверждает offset всех полученных обновлений
+            await self._phase("updater.stop", application.updater.stop())
+
+        drained = await self._phase("drain", self.drain(application))
+        if not drained:
+            self.save_handoff(self._take_pending(application))
+        elif self._seen:
+            # Номера обработанных обновлений нужны новому процессу даже без очереди
+            self.save_handoff([])
+
+        if application.running:
+            await self._phase("stop", application.stop())
+        if application.post_stop:
+            await self._phase("post_stop", application.post_stop(application))
+        # Application.shutdown сохраняет user_data в persistence
+        await self._phase("shutdown", application.shutdown())
+        if application.post_shutdown:
+            await self._phase("post_shutdown", application.post_shutdown(application))
+
+        self.shutdown_phases.append(("всего", time.perf_counter() - started))
+        print(self.format())
+
+    def stats(self) -> Dict:
+        """Счетчики повторов и handoff"""
+        return dict(self.metrics)
+
+    def format(self) -> str:
+        """Текстовый отчет об остановке"""
+        lines = ["Время остановки:"]
+        for name, seconds in self.shutdown_phases:
+            lines.append(f"  {name}: {seconds * 1000:.1f} мс")
+        lines.append(
+            f"  повторов пропущено: {self.metrics['duplicates']}, "
+            f"передано следующему процессу: {self.metrics['handed_off']}"
+        )
+        return "\n".join(lines)
@@ -0,0 +1,236 @@
+import sys
+import tracemalloc
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from intervals import SleepIntervals, merge_day, parse_time
+
+
+class NapEntry:
+    """Дополнительный (дневной) сон"""
+
+    __slots__ = ('sleep_time', 'wake_time', 'sleep_minutes')
+
+    def __init__(self, sleep_time: datetime, wake_time: datetime, sleep_minutes: int):
+        self.sleep_time = sleep_time
+        self.wake_time = wake_time
+        self.sleep_minutes = sleep_minutes
+
+    @classmethod
+    def from_row(cls, row: Sequence) -> 'NapEntry':
+        """Из строки (sleep_time, wake_time, sleep_minutes)"""
+        return cls(parse_time(row[0]), parse_time(row[1]), row[2] or 0)
+
+    def __repr__(self):
+        return f"NapEntry({self.sleep_time!r}, {self.wake_time!r}, {self.sleep_minutes!r})"
+
+
+class SleepSession:
+    """Интервал сна из sleep_sessions: основной ('main') или дополнительный ('nap')"""
+
+    __slots__ = ('kind', 'date', 'start', 'end', 'minutes')
+
+    def __init__(self, kind: str, date: str, start: datetime, end: Optional[datetime], minutes: Optional[int]):
+        self.kind = kind
+        self.date = date
+        self.start = start
+        self.end = end
+        self.minutes = minutes
+
+    def __repr__(self):
+        return f"SleepSession({self.kind!r}, {self.date!r}, {self.start!r}, {self.end!r}, {self.minutes!r})"
+
+
+class SymptomEntry:
+    """Симптом за день (id нет у архивных записей)"""
+
+    __slots__ = ('id', 'text')
+
+    def __init__(self, id: Optional[int], text: str):
+        self.id = id
+        self.text = text
+
+    def __repr__(self):
+        return f"SymptomEntry({self.id!r}, {self.text!r})"
+
+
+class DaySummary:
+    """Сводка дня: основной сон, дополнительные сны и симптомы"""
+
+    __slots__ = ('sleep_time', 'wake_time', 'total_sleep_minutes', 'total_sleep_all_minutes',
+                 'no_sleep', 'additional_sleeps', 'symptoms')
+
+    def __init__(self, sleep_time: Optional[datetime] = None, wake_time: Optional[datetime] = None,
+                 total_sleep_minutes: Optional[int] = None, no_sleep: bool = False,
+                 additional_sleeps: List[NapEntry] = None, symptoms: List[SymptomEntry] = None,
+                 total_sleep_all_minutes: int = None):
+        self.sleep_time = sleep_time
+        self.wake_time = wake_time
+        self.total_sleep_minutes = total_sleep_minutes
+        self.no_sleep = no_sleep
+        self.additional_sleeps = additional_sleeps or []
+        self.symptoms = symptoms or []
+        if total_sleep_all_minutes is None:
+            # Основной + дополнительные сны, пересечения считаются один раз
+            total_sleep_all_minutes = self.sleep_intervals().asleep_minutes
+        self.total_sleep_all_minutes = total_sleep_all_minutes
+
+    @classmethod
+    def from_rows(cls, sleep_data: Optional[Sequence], additional_rows, symptom_rows) -> 'DaySummary':
+        """Из строки days (sleep_time, wake_time, total_sleep_minutes, no_sleep),
+        строк additional_sleeps и строк symptoms (id, текст)"""
+        return cls(
+            sleep_time=parse_time(sleep_data[0]) if sleep_data else None,
+            wake_time=parse_time(sleep_data[1]) if sleep_data else None,
+            total_sleep_minutes=sleep_data[2] if sleep_data else None,
+            no_sleep=bool(sleep_data[3]) if sleep_data else False,
+            additional_sleeps=[NapEntry.from_row(row) for row in additional_rows],
+            symptoms=[SymptomEntry(row[0], row[1]) for row in symptom_rows]
+        )
+
+    def sleep_intervals(self) -> SleepIntervals:
+        """Объединенные интервалы основного и дополнительных снов"""
+        return merge_day(
+            self.sleep_time, self.wake_time, self.total_sleep_minutes,
+            [(nap.sleep_time, nap.wake_time) for nap in self.additional_sleeps]
+        )
+
+    def has_data(self) -> bool:
+        """Есть ли за день хоть какие-то записи"""
+        return bool(self.sleep_time or self.wake_time or self.no_sleep or self.symptoms or self.additional_sleeps)
+
+    def __repr__(self):
+        return (
+            f"DaySummary(sleep_time={self.sleep_time!r}, wake_time={self.wake_time!r}, "
+            f"total_sleep_all_minutes={self.total_sleep_all_minutes!r}, no_sleep={self.no_sleep!r}, "
+            f"additional_sleeps={self.additional_sleeps!r}, symptoms={self.symptoms!r})"
+        )
+
+
+class DigestData:
+    """Данные утренней сводки подписчика: прошлые сутки, сон по дням недели и симптомы"""
+
+    __slots__ = ('sleep_time', 'wake_time', 'no_sleep', 'last_minutes', 'week_minutes', 'symptoms')
+
+    def __init__(self):
+        self.sleep_time: Optional[datetime] = None
+        self.wake_time: Optional[datetime] = None
+        self.no_sleep = False
+        self.last_minutes = 0
+        # Общее время сна (основной + дополнительные) по дням недели: дата -> минуты
+        self.week_minutes: Dict[str, int] = {}
+        self.symptoms: List[str] = []
+
+    @property
+    def week_average(self) -> Optional[int]:
+        """Среднее время сна за дни недели, когда сон записан"""
+        minutes = [value for value in self.week_minutes.values() if value > 0]
+        return sum(minutes) // len(minutes) if minutes else None
+
+    @classmethod
+    def collect(cls, last_date: str, subscriber_ids, day_rows, nap_rows, symptom_rows,
+                symptom_limit: int = 5) -> Dict[int, 'DigestData']:
+        """Раскладка результатов пакетных запросов по подписчикам.
+
+        day_rows: (user_id, date, sleep_time, wake_time, total_sleep_minutes, no_sleep),
+        nap_rows: (user_id, date, sleep_time, wake_time), symptom_rows: (user_id, date, created_at, текст).
+        Строки пользователей не из subscriber_ids (подписались после выборки списка) пропускаются.
+        """
+        digests = {user_id: cls() for user_id in subscriber_ids}
+
+        days: Dict[Tuple[int, str], List] = {}
+        for user_id, date_str, sleep_time, wake_time, minutes, no_sleep in day_rows:
+            if user_id not in digests:
+                continue
+            days[user_id, date_str] = [(sleep_time, wake_time, minutes), []]
+            if date_str == last_date:
+                digest = digests[user_id]
+                digest.sleep_time = parse_time(sleep_time)
+                digest.wake_time = parse_time(wake_time)
+                digest.no_sleep = bool(no_sleep)
+
+        for user_id, date_str, sleep_time, wake_time in nap_rows:
+            if user_id not in digests:
+                continue
+            days.setdefault((user_id, date_str), [(None, None, None), []])[1].append((sleep_time, wake_time))
+
+        # Время сна за день - объединение основного и дополнительных снов
+        for (user_id, date_str), (main, naps) in days.items():
+            digests[user_id].week_minutes[date_str] = merge_day(*main, naps).asleep_minutes
+
+        for digest in digests.values():
+            digest.last_minutes = digest.week_minutes.get(last_date, 0)
+
+        # Сначала последние симптомы, каждый текст один раз
+        for user_id, _, _, text in sorted(symptom_rows, key=lambda row: (row[1], str(row[2])), reverse=True):
+            if user_id not in digests:
+                continue
+            symptoms = digests[user_id].symptoms
+            if text not in symptoms and len(symptoms) < symptom_limit:
+                symptoms.append(text)
+
+        return digests
+
+    def __repr__(self):
+        return (
+            f"DigestData(sleep_time={self.sleep_time!r}, wake_time={self.wake_time!r}, "
+            f"last_minutes={self.last_minutes!r}, week_average={self.week_average!r}, symptoms={self.symptoms!r})"
+        )
+
+
+def _sample_rows(day: int):
+    """Строки типичного дня: основной сон, два доп. сна и три симптома"""
+    start = datetime(2024, 1, 1, 23, 15) + timedelta(days=day)
+    sleep_data = (start.isoformat(), (start + timedelta(hours=7, minutes=40)).isoformat(), 460, 0)
+    additional_rows = [
+        ((start + timedelta(hours=h)).isoformat(), (start + timedelta(hours=h, minutes=40)).isoformat(), 40)
+        for h in (14, 17)
+    ]
+    symptom_rows = [(day * 3 + i, text) for i, text in enumerate(("Головная боль", "Сонливость", "Изжога"))]
+    return sleep_data, additional_rows, symptom_rows
+
+
+def _dict_summary(sleep_data, additional_rows, symptom_rows) -> Dict:
+    """Прежний формат сводки (словари со временем в виде строк) для сравнения"""
+    additional_sleeps = [{'sleep_time': row[0], 'wake_time': row[1], 'sleep_minutes': row[2]} for row in additional_rows]
+    return {
+        'sleep_time': sleep_data[0],
+        'wake_time': sleep_data[1],
+        'total_sleep_minutes': sleep_data[2],
+        'total_sleep_all_minutes': sleep_data[2] + sum(sleep['sleep_minutes'] for sleep in additional_sleeps),
+        'no_sleep': bool(sleep_data[3]),
+        'additional_sleeps': additional_sleeps,
+        'symptoms': [{'id': row[0], 'text': row[1]} for row in symptom_rows]
+    }
+
+
+def measure_memory(build, count: int) -> float:
+    """Средний объем памяти, который удерживает одна сводка (байт).
+
+    Строки выборки создаются под трассировкой и удаляются после построения,
+    поэтому учитываются и строки времени, на которые ссылаются словари.
+    """
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        rows = [_sample_rows(day) for day in range(count)]
+        summaries = [build(*day_rows) for day_rows in rows]
+        del rows
+        after = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+    del summaries
+    return (after - before) / count
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    old = measure_memory(_dict_summary, count)
+    new = measure_memory(DaySummary.from_rows, count)
+    print(f"Сводок: {count}")
+    print(f"Словари:    {old:8.0f} байт на сводку")
+    print(f"DaySummary: {new:8.0f} байт на сводку ({new / old:.0%})")
+
+
+if __name__ == '__main__':
+    main()
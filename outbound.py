@@ -0,0 +1,164 @@
+import asyncio
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Optional, Tuple
+
+from telegram.request import BaseRequest, HTTPXRequest, RequestData
+
+import config
+
+# Полосы в порядке приоритета: ответы пользователю всегда раньше массовых отправок
+INTERACTIVE = "interactive"
+BULK = "bulk"
+LANES = (INTERACTIVE, BULK)
+
+# Полоса текущей задачи asyncio (по умолчанию - интерактивная)
+_current_lane: ContextVar[Optional[str]] = ContextVar("outbound_lane", default=None)
+
+
+@contextmanager
+def bulk_lane():
+    """Запросы Bot API внутри блока идут в фоновую полосу (отчеты, рассылки)"""
+    token = _current_lane.set(BULK)
+    try:
+        yield
+    finally:
+        _current_lane.reset(token)
+
+
+class PriorityRequest(BaseRequest):
+    """Исходящие запросы Bot API с приоритетами поверх общего keep-alive пула HTTPXRequest.
+
+    Одновременно выполняется не больше max_connections запросов (по размеру пула),
+    фоновая полоса занимает не больше bulk_connections из них. Освободившееся
+    соединение получает первый ожидающий запрос самой приоритетной полосы.
+    Один объект может обслуживать несколько ботов: пул закрывается, когда
+    его освободил последний из них. Запросы выполняет transport (по умолчанию
+    HTTPXRequest); замеры подставляют вместо него Bot API без сети.
+    """
+
+    def __init__(self, max_connections: int = None, bulk_connections: int = None,
+                 read_timeout: float = None, connect_timeout: float = None, transport: BaseRequest = None):
+        self.max_connections = max_connections or config.OUTBOUND_CONNECTIONS
+        self.bulk_connections = min(bulk_connections or config.OUTBOUND_BULK_CONNECTIONS, self.max_connections)
+        self._request = transport or HTTPXRequest(
+            connection_pool_size=self.max_connections,
+            read_timeout=read_timeout or config.OUTBOUND_READ_TIMEOUT,
+            write_timeout=read_timeout or config.OUTBOUND_READ_TIMEOUT,
+            connect_timeout=connect_timeout or config.OUTBOUND_CONNECT_TIMEOUT,
+        )
+        self._waiters: Dict[str, deque] = {lane: deque() for lane in LANES}
+        self._in_flight: Dict[str, int] = {lane: 0 for lane in LANES}
+        self._users = 0
+        self.metrics = {
+            lane: {'sent': 0, 'failed': 0, 'wait_seconds': 0.0, 'send_seconds': 0.0, 'max_send_seconds': 0.0}
+            for lane in LANES
+        }
+
+    def set_transport(self, transport: BaseRequest):
+        """Замена транспорта до initialize(): полосы и метрики остаются прежними"""
+        if self._users:
+            raise RuntimeError("Transport can't be replaced while the request is in use")
+        self._request = transport
+
+    @property
+    def read_timeout(self) -> Optional[float]:
+        return self._request.read_timeout
+
+    async def initialize(self):
+        self._users += 1
+        await self._request.initialize()
+
+    async def shutdown(self):
+        self._users = max(self._users - 1, 0)
+        if not self._users:
+            await self._request.shutdown()
+
+    def _can_start(self, lane: str) -> bool:
+        if sum(self._in_flight.values()) >= self.max_connections:
+            return False
+        return lane != BULK or self._in_flight[BULK] < self.bulk_connections
+
+    async def _acquire(self, lane: str):
+        """Ожидание свободного соединения с учетом приоритета полосы"""
+        ahead = any(self._waiters[other] for other in LANES[:LANES.index(lane) + 1])
+        if not ahead and self._can_start(lane):
+            self._in_flight[lane] += 1
+            return
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters[lane].append(waiter)
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter in self._waiters[lane]:
+                self._waiters[lane].remove(waiter)
+            elif waiter.done() and not waiter.cancelled():
+                # Соединение уже передали этой задаче - возвращаем его следующему
+                self._release(lane)
+            raise
+
+    def _release(self, lane: str):
+        """Освобождение соединения и передача его ожидающим по приоритету"""
+        self._in_flight[lane] -= 1
+        for next_lane in LANES:
+            waiters = self._waiters[next_lane]
+            while waiters and self._can_start(next_lane):
+                waiter = waiters.popleft()
+                if not waiter.done():
+                    self._in_flight[next_lane] += 1
+                    waiter.set_result(None)
+
+    async def do_request(
+        self,
+        url: str,
+        method: str,
+        request_data: RequestData = None,
+        read_timeout=BaseRequest.DEFAULT_NONE,
+        write_timeout=BaseRequest.DEFAULT_NONE,
+        connect_timeout=BaseRequest.DEFAULT_NONE,
+        pool_timeout=BaseRequest.DEFAULT_NONE,
+    ) -> Tuple[int, bytes]:
+        lane = _current_lane.get() or INTERACTIVE
+        metrics = self.metrics[lane]
+
+        queued_at = time.perf_counter()
+        await self._acquire(lane)
+        started = time.perf_counter()
+        metrics['wait_seconds'] += started - queued_at
+
+        try:
+            result = await self._request.do_request(
+                url, method, request_data,
+                read_timeout=read_timeout, write_timeout=write_timeout,
+                connect_timeout=connect_timeout, pool_timeout=pool_timeout
+            )
+            metrics['sent'] += 1
+            return result
+        except Exception:
+            metrics['failed'] += 1
+            raise
+        finally:
+            seconds = time.perf_counter() - started
+            metrics['send_seconds'] += seconds
+            metrics['max_send_seconds'] = max(metrics['max_send_seconds'], seconds)
+            self._release(lane)
+
+    def stats(self) -> Dict[str, Dict]:
+        """Глубина очередей, число запросов и задержки по полосам"""
+        result = {}
+        for lane in LANES:
+            metrics = self.metrics[lane]
+            done = metrics['sent'] + metrics['failed']
+            result[lane] = {
+                'queued': len(self._waiters[lane]),
+                'in_flight': self._in_flight[lane],
+                'sent': metrics['sent'],
+                'failed': metrics['failed'],
+                'avg_wait_ms': metrics['wait_seconds'] / done * 1000 if done else 0.0,
+                'avg_send_ms': metrics['send_seconds'] / done * 1000 if done else 0.0,
+                'max_send_ms': metrics['max_send_seconds'] * 1000
+            }
+        return result
@@ -0,0 +1,952 @@
+import asyncio
+import concurrent.futures
+import logging
+import threading
+from contextlib import asynccontextmanager
+from datetime import datetime, date, timedelta
+from typing import List, Dict, Optional, Tuple
+
+import config
+from models import DaySummary, DigestData
+from storage import DayState, Storage, apply_sleep_event, normalize_symptom
+
+logger = logging.getLogger(__name__)
+
+# Та же схема, что и в SQLite. Внешние ключи не объявлены: SQLite их
+# не проверяет, и записи могут появляться раньше строки в users.
+SCHEMA = [
+    '''
+    CREATE TABLE IF NOT EXISTS users (
+        user_id BIGINT PRIMARY KEY,
+        username TEXT,
+        first_name TEXT,
+        last_name TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS days (
+        id SERIAL PRIMARY KEY,
+        user_id BIGINT,
+        date TEXT,
+        sleep_time TEXT,
+        wake_time TEXT,
+        total_sleep_minutes INTEGER,
+        no_sleep BOOLEAN DEFAULT FALSE,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        UNIQUE(user_id, date)
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS additional_sleeps (
+        id SERIAL PRIMARY KEY,
+        user_id BIGINT,
+        date TEXT,
+        sleep_time TEXT,
+        wake_time TEXT,
+        sleep_minutes INTEGER,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS symptoms (
+        id SERIAL PRIMARY KEY,
+        user_id BIGINT,
+        date TEXT,
+        symptom_text TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    ''',
+    'ALTER TABLE users ADD COLUMN IF NOT EXISTS revision BIGINT NOT NULL DEFAULT 0',
+    'ALTER TABLE users ADD COLUMN IF NOT EXISTS last_seen TIMESTAMP',
+    'CREATE INDEX IF NOT EXISTS idx_users_last_seen ON users (last_seen)',
+    '''
+    CREATE TABLE IF NOT EXISTS change_log (
+        seq BIGSERIAL PRIMARY KEY,
+        user_id BIGINT NOT NULL,
+        date TEXT,
+        operation TEXT NOT NULL,
+        xact_id XID8 NOT NULL DEFAULT pg_current_xact_id(),
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    ''',
+    'CREATE INDEX IF NOT EXISTS idx_change_log_created_at ON change_log (created_at)',
+    'CREATE INDEX IF NOT EXISTS idx_change_log_xact_seq ON change_log (xact_id, seq)',
+    'CREATE INDEX IF NOT EXISTS idx_additional_sleeps_user_date ON additional_sleeps (user_id, date)',
+    'CREATE INDEX IF NOT EXISTS idx_symptoms_user_date ON symptoms (user_id, date)',
+    '''
+    CREATE TABLE IF NOT EXISTS symptom_catalog (
+        id BIGSERIAL PRIMARY KEY,
+        text TEXT NOT NULL,
+        normalized TEXT NOT NULL UNIQUE,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS symptom_usage (
+        user_id BIGINT NOT NULL,
+        catalog_id BIGINT NOT NULL,
+        uses INTEGER NOT NULL DEFAULT 0,
+        last_used TIMESTAMP,
+        PRIMARY KEY (user_id, catalog_id)
+    )
+    ''',
+    # Ранжирование частых симптомов целиком по индексу (uses, затем last_used)
+    'DROP INDEX IF EXISTS idx_symptom_usage_top',
+    'CREATE INDEX IF NOT EXISTS idx_symptom_usage_rank ON symptom_usage (user_id, uses DESC, last_used DESC)',
+    # Перевод symptoms на каталог: текст хранится один раз, в symptoms - ссылка
+    r'''
+    DO $$
+    BEGIN
+        IF EXISTS (
+            SELECT 1 FROM information_schema.columns
+            WHERE table_schema = current_schema() AND table_name = 'symptoms' AND column_name = 'symptom_text'
+        ) THEN
+            ALTER TABLE symptoms ADD COLUMN IF NOT EXISTS catalog_id BIGINT;
+            INSERT INTO symptom_catalog (text, normalized)
+            SELECT DISTINCT ON (normalized) regexp_replace(btrim(symptom_text), '\s+', ' ', 'g'), normalized
+            FROM (
+                SELECT symptom_text, regexp_replace(lower(btrim(symptom_text)), '\s+', ' ', 'g') AS normalized
+                FROM symptoms WHERE symptom_text IS NOT NULL
+            ) AS texts
+            ORDER BY normalized
+            ON CONFLICT (normalized) DO NOTHING;
+            UPDATE symptoms s SET catalog_id = c.id
+            FROM symptom_catalog c
+            WHERE c.normalized = regexp_replace(lower(btrim(s.symptom_text)), '\s+', ' ', 'g');
+            ALTER TABLE symptoms DROP COLUMN symptom_text;
+            INSERT INTO symptom_usage (user_id, catalog_id, uses, last_used)
+            SELECT user_id, catalog_id, COUNT(*), MAX(created_at) FROM symptoms
+            WHERE catalog_id IS NOT NULL
+            GROUP BY user_id, catalog_id
+            ON CONFLICT DO NOTHING;
+        END IF;
+    END $$
+    ''',
+    'CREATE INDEX IF NOT EXISTS idx_symptoms_user_catalog ON symptoms (user_id, catalog_id)',
+    "CREATE INDEX IF NOT EXISTS idx_symptom_catalog_search ON symptom_catalog USING GIN (to_tsvector('russian', text))",
+    # Подписка на утреннюю сводку и готовые тексты сводок
+    'ALTER TABLE users ADD COLUMN IF NOT EXISTS digest_enabled BOOLEAN NOT NULL DEFAULT FALSE',
+    'CREATE INDEX IF NOT EXISTS idx_users_digest ON users (digest_enabled, user_id)',
+    '''
+    CREATE TABLE IF NOT EXISTS digests (
+        digest_date TEXT NOT NULL,
+        user_id BIGINT NOT NULL,
+        text TEXT NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        sent_at TIMESTAMP,
+        PRIMARY KEY (digest_date, user_id)
+    )
+    ''',
+]
+
+
+class PostgresDatabase(Storage):
+    """Хранилище на PostgreSQL (asyncpg) с общим пулом соединений.
+
+    Бот вызывает методы хранилища синхронно, поэтому пул живёт в отдельном
+    потоке со своим event loop, а методы дожидаются результата корутин.
+    Несколько процессов бота могут работать с одной базой одновременно.
+
+    Хранилище со схемой schema и pool_of работает в своей схеме поверх пула
+    (и потока) другого хранилища: так несколько ботов одного процесса делят
+    соединения. Пул закрывается вместе с последним использующим его хранилищем.
+    """
+
+    def __init__(self, dsn: str, min_size: int = 1, max_size: int = 10,
+                 schema: str = None, pool_of: 'PostgresDatabase' = None):
+        try:
+            import asyncpg
+        except ImportError:
+            raise ImportError("Для DATABASE_BACKEND = 'postgres' установите пакет asyncpg")
+
+        self.dsn = dsn
+        self.schema = schema
+        self._closed = False
+        # Пул уже закрыт последним из хранилищ - открываем новый, а не берем остановленный loop
+        if pool_of is not None and pool_of._share_pool():
+            self._loop, self._thread, self._pool = pool_of._loop, pool_of._thread, pool_of._pool
+            self._pool_users, self._pool_lock = pool_of._pool_users, pool_of._pool_lock
+        else:
+            self._loop = asyncio.new_event_loop()
+            self._thread = threading.Thread(target=self._loop.run_forever, name="postgres-pool", daemon=True)
+            self._thread.start()
+            # create_pool возвращает awaitable-пул, а не корутину
+            async def _create_pool():
+                return await asyncpg.create_pool(dsn, min_size=min_size, max_size=max_size)
+
+            self._pool_users, self._pool_lock = [1], threading.Lock()
+            try:
+                self._pool = self._run(_create_pool())
+            except Exception:
+                self._stop_loop()
+                raise
+        self.init_db()
+
+    def _share_pool(self) -> bool:
+        """Еще одно хранилище на этом пуле; False - пул уже закрыт"""
+        with self._pool_lock:
+            if not self._pool_users[0]:
+                return False
+            self._pool_users[0] += 1
+            return True
+
+    def _run(self, coro):
+        """Выполнение корутины в потоке пула и ожидание результата (не дольше POSTGRES_TIMEOUT)"""
+        future = asyncio.run_coroutine_threadsafe(coro, self._loop)
+        try:
+            return future.result(timeout=config.POSTGRES_TIMEOUT)
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            raise TimeoutError(f"PostgreSQL call did not finish in {config.POSTGRES_TIMEOUT}s")
+
+    @asynccontextmanager
+    async def _acquire(self):
+        """Соединение из пула; в схеме хранилища, если она задана.
+
+        search_path сбрасывается пулом при возврате соединения (RESET ALL),
+        поэтому соединение не уносит чужую схему в другое хранилище.
+        """
+        async with self._pool.acquire() as conn:
+            if self.schema:
+                await conn.execute(f'SET search_path TO "{self.schema}"')
+            yield conn
+
+    def _stop_loop(self):
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+
+    def close(self):
+        """Закрытие пула соединений (общий пул - после последнего хранилища)"""
+        with self._pool_lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._pool_users[0] -= 1
+            if self._pool_users[0] > 0:
+                return
+        try:
+            self._run(self._pool.close())
+        finally:
+            self._stop_loop()
+
+    def init_db(self):
+        """Инициализация базы данных"""
+        async def _init():
+            async with self._acquire() as conn:
+                async with conn.transaction():
+                    if self.schema:
+                        await conn.execute(f'CREATE SCHEMA IF NOT EXISTS "{self.schema}"')
+                    for statement in SCHEMA:
+                        await conn.execute(statement)
+
+        try:
+            self._run(_init())
+            logger.info("Database initialized successfully")
+        except Exception as e:
+            logger.error(f"Error initializing database: {e}")
+
+    async def _bump_revision(self, conn, user_id: int):
+        """Увеличение ревизии данных пользователя (в транзакции записи)"""
+        await conn.execute('''
+            INSERT INTO users (user_id, revision) VALUES ($1, 1)
+            ON CONFLICT (user_id) DO UPDATE SET revision = users.revision + 1
+        ''', user_id)
+
+    async def _record_change(self, conn, user_id: int, date_str: str, operation: str):
+        """Запись изменения в журнал и увеличение ревизии (в транзакции записи)"""
+        await self._bump_revision(conn, user_id)
+        await conn.execute('''
+            INSERT INTO change_log (user_id, date, operation) VALUES ($1, $2, $3)
+        ''', user_id, date_str, operation)
+
+    def get_changes(self, after_seq: int = 0, limit: int = 1000) -> List[Dict]:
+        """Изменения после записи after_seq в порядке журнала.
+
+        seq выдаются до коммита, и параллельные транзакции становятся видимыми
+        не по порядку seq. Поэтому журнал упорядочен по (xact_id, seq) и отдается
+        только до самой старой незавершенной транзакции: записи до этой границы
+        окончательны, а новые транзакции получат xact_id больше нее.
+        Если запись after_seq уже удалена, журнал отдается с начала.
+        """
+        async def _get():
+            async with self._acquire() as conn:
+                return await conn.fetch('''
+                    SELECT seq, user_id, date, operation, created_at FROM change_log
+                    WHERE (xact_id, seq) > (
+                        COALESCE((SELECT xact_id FROM change_log WHERE seq = $1), '0'::xid8), $1
+                    )
+                      AND xact_id < pg_snapshot_xmin(pg_current_snapshot())
+                    ORDER BY xact_id, seq
+                    LIMIT $2
+                ''', after_seq, limit)
+
+        try:
+            return [{
+                'seq': row['seq'],
+                'user_id': row['user_id'],
+                'date': date.fromisoformat(row['date']) if row['date'] else None,
+                'operation': row['operation'],
+                'created_at': row['created_at']
+            } for row in self._run(_get())]
+        except Exception as e:
+            logger.error(f"Error getting changes after {after_seq}: {e}")
+            return []
+
+    def prune_changes(self, keep_days: int) -> int:
+        """Удаление записей журнала старше keep_days дней"""
+        async def _prune():
+            async with self._acquire() as conn:
+                result = await conn.execute(
+                    'DELETE FROM change_log WHERE created_at < now() - make_interval(days => $1)', int(keep_days)
+                )
+                return int(result.split()[-1])
+
+        try:
+            return self._run(_prune())
+        except Exception as e:
+            logger.error(f"Error pruning change log: {e}")
+            return 0
+
+    def get_revision(self, user_id: int) -> int:
+        """Текущая ревизия данных пользователя"""
+        async def _get():
+            async with self._acquire() as conn:
+                return await conn.fetchval('SELECT revision FROM users WHERE user_id = $1', user_id)
+
+        try:
+            return self._run(_get()) or 0
+        except Exception as e:
+            logger.error(f"Error getting revision for user {user_id}: {e}")
+            return 0
+
+    def touch_users(self, seen: Dict[int, datetime]) -> bool:
+        """Пакетное обновление времени последней активности одной транзакцией"""
+        async def _touch():
+            async with self._acquire() as conn:
+                async with conn.transaction():
+                    await conn.executemany('''
+                        INSERT INTO users (user_id, last_seen) VALUES ($1, $2)
+                        ON CONFLICT (user_id) DO UPDATE
+                        SET last_seen = GREATEST(users.last_seen, excluded.last_seen)
+                    ''', list(seen.items()))
+
+        try:
+            self._run(_touch())
+            return True
+        except Exception as e:
+            logger.error(f"Error updating activity for {len(seen)} users: {e}")
+            return False
+
+    def get_activity_counts(self, now: datetime = None) -> Dict[str, int]:
+        """DAU/WAU/MAU одним проходом по индексу last_seen за последние 30 дней"""
+        now = now or datetime.now()
+
+        async def _count():
+            async with self._acquire() as conn:
+                return await conn.fetchrow('''
+                    SELECT COUNT(*) FILTER (WHERE last_seen >= $1) AS dau,
+                           COUNT(*) FILTER (WHERE last_seen >= $2) AS wau,
+                           COUNT(*) AS mau
+                    FROM users WHERE last_seen >= $3
+                ''', now - timedelta(days=1), now - timedelta(days=7), now - timedelta(days=30))
+
+        try:
+            return dict(self._run(_count()))
+        except Exception as e:
+            logger.error(f"Error counting active users: {e}")
+            return {'dau': 0, 'wau': 0, 'mau': 0}
+
+    def set_digest_subscription(self, user_id: int, enabled: bool) -> bool:
+        """Подписка на утреннюю сводку (или отписка)"""
+        async def _set():
+            async with self._acquire() as conn:
+                await conn.execute('''
+                    INSERT INTO users (user_id, digest_enabled) VALUES ($1, $2)
+                    ON CONFLICT (user_id) DO UPDATE SET digest_enabled = excluded.digest_enabled
+                ''', user_id, enabled)
+
+        try:
+            self._run(_set())
+            return True
+        except Exception as e:
+            logger.error(f"Error updating digest subscription for user {user_id}: {e}")
+            return False
+
+    def is_digest_subscribed(self, user_id: int) -> bool:
+        """Подписан ли пользователь на утреннюю сводку"""
+        async def _get():
+            async with self._acquire() as conn:
+                return await conn.fetchval('SELECT digest_enabled FROM users WHERE user_id = $1', user_id)
+
+        try:
+            return bool(self._run(_get()))
+        except Exception as e:
+            logger.error(f"Error checking digest subscription for user {user_id}: {e}")
+            return False
+
+    def get_digest_data(self, digest_date: date, week_days: int = 7, symptom_days: int = 3) -> Dict[int, DigestData]:
+        """Данные сводок всех подписчиков: по одному запросу на таблицу, дни - по индексам (user_id, date)"""
+        last_date = (digest_date - timedelta(days=1)).isoformat()
+        week_start = (digest_date - timedelta(days=week_days)).isoformat()
+        symptoms_start = (digest_date - timedelta(days=symptom_days)).isoformat()
+
+        async def _collect():
+            async with self._acquire() as conn:
+                # Один снимок данных: подписка, оформленная между запросами, не разъедется со списком
+                async with conn.transaction(isolation='repeatable_read', readonly=True):
+                    subscribers = await conn.fetch('SELECT user_id FROM users WHERE digest_enabled')
+                    day_rows = await conn.fetch('''
+                        SELECT d.user_id, d.date, d.sleep_time, d.wake_time, d.total_sleep_minutes, d.no_sleep
+                        FROM users u
+                        JOIN days d ON d.user_id = u.user_id AND d.date BETWEEN $1 AND $2
+                        WHERE u.digest_enabled
+                    ''', week_start, last_date)
+                    nap_rows = await conn.fetch('''
+                        SELECT a.user_id, a.date, a.sleep_time, a.wake_time
+                        FROM users u
+                        JOIN additional_sleeps a ON a.user_id = u.user_id AND a.date BETWEEN $1 AND $2
+                        WHERE u.digest_enabled
+                    ''', week_start, last_date)
+                    symptom_rows = await conn.fetch('''
+                        SELECT s.user_id, s.date, s.created_at, c.text
+                        FROM users u
+                        JOIN symptoms s ON s.user_id = u.user_id AND s.date BETWEEN $1 AND $2
+                        JOIN symptom_catalog c ON c.id = s.catalog_id
+                        WHERE u.digest_enabled
+                    ''', symptoms_start, last_date)
+                    return [row[0] for row in subscribers], day_rows, nap_rows, symptom_rows
+
+        try:
+            return DigestData.collect(last_date, *self._run(_collect()))
+        except Exception as e:
+            logger.error(f"Error collecting digest data for {digest_date}: {e}")
+            return {}
+
+    def save_digests(self, digest_date: date, texts: Dict[int, str]) -> int:
+        """Сохранение готовых текстов сводок; время отправки уже отправленных не сбрасывается"""
+        date_str = digest_date.isoformat()
+
+        async def _save():
+            async with self._acquire() as conn:
+                async with conn.transaction():
+                    await conn.execute('DELETE FROM digests WHERE digest_date < $1', date_str)
+                    await conn.executemany('''
+                        INSERT INTO digests (digest_date, user_id, text) VALUES ($1, $2, $3)
+                        ON CONFLICT (digest_date, user_id) DO UPDATE SET text = excluded.text
+                    ''', [(date_str, user_id, text) for user_id, text in texts.items()])
+
+        try:
+            self._run(_save())
+            return len(texts)
+        except Exception as e:
+            logger.error(f"Error saving {len(texts)} digests for {digest_date}: {e}")
+            return 0
+
+    def get_pending_digests(self, digest_date: date, after_user_id: int = 0, limit: int = 500) -> List[Tuple[int, str]]:
+        """Неотправленные сводки за день по первичному ключу (digest_date, user_id)"""
+        async def _get():
+            async with self._acquire() as conn:
+                return await conn.fetch('''
+                    SELECT user_id, text FROM digests
+                    WHERE digest_date = $1 AND user_id > $2 AND sent_at IS NULL
+                    ORDER BY user_id
+                    LIMIT $3
+                ''', digest_date.isoformat(), after_user_id, limit)
+
+        try:
+            return [(row['user_id'], row['text']) for row in self._run(_get())]
+        except Exception as e:
+            logger.error(f"Error getting pending digests for {digest_date}: {e}")
+            return []
+
+    def mark_digests_sent(self, digest_date: date, user_ids: List[int]) -> bool:
+        """Отметка об отправке сводок одним запросом"""
+        async def _mark():
+            async with self._acquire() as conn:
+                await conn.execute('''
+                    UPDATE digests SET sent_at = CURRENT_TIMESTAMP
+                    WHERE digest_date = $1 AND user_id = ANY($2::BIGINT[])
+                ''', digest_date.isoformat(), user_ids)
+
+        try:
+            self._run(_mark())
+            return True
+        except Exception as e:
+            logger.error(f"Error marking {len(user_ids)} digests as sent: {e}")
+            return False
+
+    def add_user(self, user_id: int, username: str, first_name: str, last_name: str):
+        """Добавление пользователя"""
+        async def _add():
+            async with self._acquire() as conn:
+                await conn.execute('''
+                    INSERT INTO users (user_id, username, first_name, last_name)
+                    VALUES ($1, $2, $3, $4)
+                    ON CONFLICT (user_id) DO UPDATE
+                    SET username = EXCLUDED.username,
+                        first_name = EXCLUDED.first_name,
+                        last_name = EXCLUDED.last_name
+                ''', user_id, username or "", first_name or "", last_name or "")
+
+        try:
+            self._run(_add())
+        except Exception as e:
+            logger.error(f"Error adding user {user_id}: {e}")
+
+    def record_sleep(self, user_id: int, sleep_time: datetime, target_date: date = None) -> bool:
+        """Запись времени засыпания"""
+        if target_date is None:
+            target_date = sleep_time.date()
+
+        date_str = target_date.isoformat()
+
+        async def _record():
+            async with self._acquire() as conn:
+                async with conn.transaction():
+                    existing = await conn.fetchrow('''
+                        SELECT wake_time, total_sleep_minutes FROM days
+                        WHERE user_id = $1 AND date = $2
+                        FOR UPDATE
+                    ''', user_id, date_str)
+
+                    if existing:
+                        total_sleep_minutes = existing['total_sleep_minutes']
+                        if existing['wake_time']:
+                            wake_time_dt = datetime.fromisoformat(existing['wake_time'])
+                            total_sleep_minutes = int((wake_time_dt - sleep_time).total_seconds() / 60)
+
+                        await conn.execute('''
+                            UPDATE days
+                            SET sleep_time = $1, total_sleep_minutes = $2, updated_at = now(), no_sleep = FALSE
+                            WHERE user_id = $3 AND date = $4
+                        ''', sleep_time.isoformat(), total_sleep_minutes, user_id, date_str)
+                    else:
+                        await conn.execute('''
+                            INSERT INTO days (user_id, date, sleep_time, updated_at, no_sleep)
+                            VALUES ($1, $2, $3, now(), FALSE)
+                        ''', user_id, date_str, sleep_time.isoformat())
+
+                    await self._record_change(conn, user_id, date_str, 'sleep')
+
+        try:
+            self._run(_record())
+            return True
+        except Exception as e:
+            logger.error(f"Error recording sleep for user {user_id}: {e}")
+            return False
+
+    def record_wake(self, user_id: int, wake_time: datetime, target_date: date = None) -> bool:
+        """Запись времени пробуждения"""
+        if target_date is None:
+            target_date = wake_time.date()
+
+        date_str = target_date.isoformat()
+
+        async def _record():
+            async with self._acquire() as conn:
+                async with conn.transaction():
+                    existing = await conn.fetchrow('''
+                        SELECT sleep_time FROM days
+                        WHERE user_id = $1 AND date = $2
+                        FOR UPDATE
+                    ''', user_id, date_str)
+
+                    if existing:
+                        total_sleep_minutes = 0
+                        if existing['sleep_time']:
+                            sleep_time_dt = datetime.fromisoformat(existing['sleep_time'])
+                            # Сон через полночь: пробуждение относится к следующим суткам
+                            wake_time_corrected = wake_time + timedelta(days=1) if wake_time < sleep_time_dt else wake_time
+                            total_sleep_minutes = int((wake_time_corrected - sleep_time_dt).total_seconds() / 60)
+
+                        await conn.execute('''
+                            UPDATE days
+                            SET wake_time = $1, total_sleep_minutes = $2, updated_at = now(), no_sleep = FALSE
+                            WHERE user_id = $3 AND date = $4
+                        ''', wake_time.isoformat(), total_sleep_minutes, user_id, date_str)
+                    else:
+                        await conn.execute('''
+                            INSERT INTO days (user_id, date, wake_time, updated_at, no_sleep)
+                            VALUES ($1, $2, $3, now(), FALSE)
+                        ''', user_id, date_str, wake_time.isoformat())
+
+                    await self._record_change(conn, user_id, date_str, 'wake')
+
+        try:
+            self._run(_record())
+            return True
+        except Exception as e:
+            logger.error(f"Error recording wake for user {user_id}: {e}")
+            return False
+
+    def log_sleep_event(self, user_id: int, kind: str, at: datetime,
+                        target_date: date = None) -> Optional[Tuple[Optional[DayState], DayState]]:
+        """Засыпание или пробуждение одной записью (быстрый режим).
+
+        Прежнее состояние дня читается под блокировкой строки - оно нужно для
+        отмены, - а сам день записывается одним upsert.
+        """
+        date_str = (target_date or at.date()).isoformat()
+
+        async def _log():
+            async with self._acquire() as conn:
+                async with conn.transaction():
+                    row = await conn.fetchrow('''
+                        SELECT sleep_time, wake_time, total_sleep_minutes, no_sleep FROM days
+                        WHERE user_id = $1 AND date = $2
+                        FOR UPDATE
+                    ''', user_id, date_str)
+                    previous = (row[0], row[1], row[2], bool(row[3])) if row else None
+                    state = apply_sleep_event(previous, kind, at)
+
+                    await conn.execute('''
+                        INSERT INTO days (user_id, date, sleep_time, wake_time, total_sleep_minutes, no_sleep, updated_at)
+                        VALUES ($1, $2, $3, $4, $5, $6, now())
+                        ON CONFLICT (user_id, date) DO UPDATE SET
+                            sleep_time = EXCLUDED.sleep_time,
+                            wake_time = EXCLUDED.wake_time,
+                            total_sleep_minutes = EXCLUDED.total_sleep_minutes,
+                            no_sleep = EXCLUDED.no_sleep,
+                            updated_at = EXCLUDED.updated_at
+                    ''', user_id, date_str, *state)
+                    await self._record_change(conn, user_id, date_str, kind)
+                    return previous, state
+
+        try:
+            return self._run(_log())
+        except Exception as e:
+            logger.error(f"Error logging {kind} for user {user_id}: {e}")
+            return None
+
+    def undo_sleep_event(self, user_id: int, target_date: date, written: DayState,
+                         previous: Optional[DayState]) -> bool:
+        """Возврат дня к previous, если после записи written его никто не менял"""
+        date_str = target_date.isoformat()
+        condition = '''
+            user_id = $1 AND date = $2 AND sleep_time IS NOT DISTINCT FROM $3
+            AND wake_time IS NOT DISTINCT FROM $4 AND total_sleep_minutes IS NOT DISTINCT FROM $5
+            AND no_sleep = $6
+        '''
+
+        async def _undo():
+            async with self._acquire() as conn:
+                async with conn.transaction():
+                    if previous is None:
+                        # Дня до записи не было
+                        status = await conn.execute(f'DELETE FROM days WHERE {condition}', user_id, date_str, *written)
+                    else:
+                        status = await conn.execute(f'''
+                            UPDATE days
+                            SET sleep_time = $7, wake_time = $8, total_sleep_minutes = $9, no_sleep = $10,
+                                updated_at = now()
+                            WHERE {condition}
+                        ''', user_id, date_str, *written, *previous)
+                    if status.split()[-1] != '1':
+                        return False
+                    await self._record_change(conn, user_id, date_str, 'undo')
+                    return True
+
+        try:
+            return self._run(_undo())
+        except Exception as e:
+            logger.error(f"Error undoing sleep event for user {user_id}: {e}")
+            return False
+
+    def record_no_sleep(self, user_id: int, target_date: date = None) -> bool:
+        """Запись отметки 'не спал'"""
+        if target_date is None:
+            target_date = date.today()
+
+        async def _record():
+            async with self._acquire() as conn:
+                async with conn.transaction():
+                    await conn.execute('''
+                        INSERT INTO days (user_id, date, no_sleep, sleep_time, wake_time, total_sleep_minutes, updated_at)
+                        VALUES ($1, $2, TRUE, NULL, NULL, 0, now())
+                        ON CONFLICT (user_id, date) DO UPDATE
+                        SET no_sleep = TRUE, sleep_time = NULL, wake_time = NULL,
+                            total_sleep_minutes = 0, updated_at = now()
+                    ''', user_id, target_date.isoformat())
+                    await self._record_change(conn, user_id, target_date.isoformat(), 'no_sleep')
+
+        try:
+            self._run(_record())
+            return True
+        except Exception as e:
+            logger.error(f"Error recording no_sleep for user {user_id}: {e}")
+            return False
+
+    def add_additional_sleep(self, user_id: int, sleep_time: datetime, wake_time: datetime, target_date: date = None) -> bool:
+        """Добавление дополнительного сна"""
+        if target_date is None:
+            target_date = sleep_time.date()
+
+        sleep_minutes = int((wake_time - sleep_time).total_seconds() / 60)
+        if sleep_minutes <= 0:
+            logger.warning(f"Rejected additional sleep for user {user_id}: {sleep_time} - {wake_time}")
+            return False
+
+        async def _add():
+            async with self._acquire() as conn:
+                async with conn.transaction():
+                    await conn.execute('''
+                        INSERT INTO additional_sleeps (user_id, date, sleep_time, wake_time, sleep_minutes)
+                        VALUES ($1, $2, $3, $4, $5)
+                    ''', user_id, target_date.isoformat(), sleep_time.isoformat(), wake_time.isoformat(), sleep_minutes)
+                    await self._record_change(conn, user_id, target_date.isoformat(), 'additional_sleep')
+
+        try:
+            self._run(_add())
+            return True
+        except Exception as e:
+            logger.error(f"Error adding additional sleep for user {user_id}: {e}")
+            return False
+
+    def add_symptom(self, user_id: int, symptom_text: str, symptom_date: date = None) -> bool:
+        """Добавление симптома"""
+        if symptom_date is None:
+            symptom_date = date.today()
+
+        async def _add():
+            async with self._acquire() as conn:
+                async with conn.transaction():
+                    catalog_id = await self._intern_symptom(conn, symptom_text)
+                    await conn.execute('''
+                        INSERT INTO symptoms (user_id, date, catalog_id)
+                        VALUES ($1, $2, $3)
+                    ''', user_id, symptom_date.isoformat(), catalog_id)
+                    await conn.execute('''
+                        INSERT INTO symptom_usage (user_id, catalog_id, uses, last_used)
+                        VALUES ($1, $2, 1, now())
+                        ON CONFLICT (user_id, catalog_id) DO UPDATE
+                        SET uses = symptom_usage.uses + 1, last_used = now()
+                    ''', user_id, catalog_id)
+                    await self._record_change(conn, user_id, symptom_date.isoformat(), 'symptom')
+
+        try:
+            self._run(_add())
+            return True
+        except Exception as e:
+            logger.error(f"Error adding symptom for user {user_id}: {e}")
+            return False
+
+    def get_day_summary(self, user_id: int, target_date: date) -> DaySummary:
+        """Получение сводки за день"""
+        date_str = target_date.isoformat()
+
+        async def _summary():
+            async with self._acquire() as conn:
+                sleep_data = await conn.fetchrow('''
+                    SELECT sleep_time, wake_time, total_sleep_minutes, no_sleep
+                    FROM days
+                    WHERE user_id = $1 AND date = $2
+                ''', user_id, date_str)
+
+                additional_rows = await conn.fetch('''
+                    SELECT sleep_time, wake_time, sleep_minutes
+                    FROM additional_sleeps
+                    WHERE user_id = $1 AND date = $2
+                    ORDER BY sleep_time
+                ''', user_id, date_str)
+
+                symptom_rows = await conn.fetch('''
+                    SELECT s.id, c.text
+                    FROM symptoms s
+                    JOIN symptom_catalog c ON c.id = s.catalog_id
+                    WHERE s.user_id = $1 AND s.date = $2
+                    ORDER BY s.created_at
+                ''', user_id, date_str)
+
+                return sleep_data, additional_rows, symptom_rows
+
+        try:
+            return DaySummary.from_rows(*self._run(_summary()))
+        except Exception as e:
+            logger.error(f"Error getting day summary for user {user_id}: {e}")
+            return DaySummary()
+
+    def check_existing_sleep_data(self, user_id: int, target_date: date) -> Dict:
+        """Проверка существующих данных о сне за день"""
+        async def _check():
+            async with self._acquire() as conn:
+                return await conn.fetchrow('''
+                    SELECT sleep_time, wake_time, total_sleep_minutes, no_sleep
+                    FROM days
+                    WHERE user_id = $1 AND date = $2
+                ''', user_id, target_date.isoformat())
+
+        try:
+            data = self._run(_check())
+
+            if data:
+                return {
+                    'exists': True,
+                    'sleep_time': data['sleep_time'],
+                    'wake_time': data['wake_time'],
+                    'total_sleep_minutes': data['total_sleep_minutes'],
+                    'no_sleep': bool(data['no_sleep'])
+                }
+            return {'exists': False}
+        except Exception as e:
+            logger.error(f"Error checking existing sleep data for user {user_id}: {e}")
+            return {'exists': False}
+
+    def get_user_days(self, user_id: int, limit: int = 30) -> List[Tuple[date, bool]]:
+        """Получение списка дней пользователя с информацией о наличии данных"""
+        async def _days():
+            async with self._acquire() as conn:
+                # Один запрос вместо проверки каждого дня отдельно
+                return await conn.fetch('''
+                    SELECT all_days.date,
+                           EXISTS (
+                               SELECT 1 FROM days d
+                               WHERE d.user_id = $1 AND d.date = all_days.date
+                               AND (d.sleep_time IS NOT NULL OR d.wake_time IS NOT NULL OR d.no_sleep)
+                           ) AS has_main_data
+                    FROM (
+                        SELECT date FROM days WHERE user_id = $1
+                        UNION
+                        SELECT date FROM additional_sleeps WHERE user_id = $1
+                        UNION
+                        SELECT date FROM symptoms WHERE user_id = $1
+                    ) AS all_days
+                    ORDER BY all_days.date DESC
+                    LIMIT $2
+                ''', user_id, limit)
+
+        try:
+            return [(date.fromisoformat(row['date']), row['has_main_data']) for row in self._run(_days())]
+        except Exception as e:
+            logger.error(f"Error getting user days for user {user_id}: {e}")
+            return []
+
+    def search_symptoms(self, user_id: int, text: str, limit: int = 10, offset: int = 0) -> List[Tuple[date, List[str]]]:
+        """Дни с подходящими симптомами (полнотекстовый поиск по каталогу), лучшие первыми"""
+        async def _search():
+            async with self._acquire() as conn:
+                return await conn.fetch('''
+                    WITH matched AS (
+                        SELECT id, text, ts_rank(to_tsvector('russian', text), plainto_tsquery('russian', $2)) AS rank
+                        FROM symptom_catalog
+                        WHERE to_tsvector('russian', text) @@ plainto_tsquery('russian', $2)
+                    )
+                    SELECT s.date, array_agg(m.text ORDER BY s.created_at) AS symptoms
+                    FROM matched m
+                    JOIN symptoms s ON s.user_id = $1 AND s.catalog_id = m.id
+                    GROUP BY s.date
+                    ORDER BY MAX(m.rank) DESC, s.date DESC
+                    LIMIT $3 OFFSET $4
+                ''', user_id, text, limit, offset)
+
+        try:
+            return [(date.fromisoformat(row['date']), list(row['symptoms'])) for row in self._run(_search())]
+        except Exception as e:
+            logger.error(f"Error searching symptoms for user {user_id}: {e}")
+            return []
+
+    async def _intern_symptom(self, conn, text: str) -> int:
+        """id текста в каталоге симптомов (добавляется при первом использовании)"""
+        normalized = normalize_symptom(text)
+        catalog_id = await conn.fetchval('SELECT id FROM symptom_catalog WHERE normalized = $1', normalized)
+        if catalog_id is None:
+            catalog_id = await conn.fetchval('''
+                INSERT INTO symptom_catalog (text, normalized) VALUES ($1, $2)
+                ON CONFLICT (normalized) DO UPDATE SET normalized = excluded.normalized
+                RETURNING id
+            ''', ' '.join(text.split()), normalized)
+        return catalog_id
+
+    def get_top_symptoms(self, user_id: int, limit: int = 6) -> List[Tuple[int, str]]:
+        """Самые частые симптомы пользователя по счетчикам (без просмотра истории)"""
+        async def _top():
+            async with self._acquire() as conn:
+                return await conn.fetch('''
+                    SELECT u.catalog_id, c.text
+                    FROM symptom_usage u
+                    JOIN symptom_catalog c ON c.id = u.catalog_id
+                    WHERE u.user_id = $1 AND u.uses > 0
+                    ORDER BY u.uses DESC, u.last_used DESC
+                    LIMIT $2
+                ''', user_id, limit)
+
+        try:
+            return [(row['catalog_id'], row['text']) for row in self._run(_top())]
+        except Exception as e:
+            logger.error(f"Error getting top symptoms for user {user_id}: {e}")
+            return []
+
+    def get_catalog_symptom(self, catalog_id: int) -> Optional[str]:
+        """Текст симптома из каталога"""
+        async def _get():
+            async with self._acquire() as conn:
+                return await conn.fetchval('SELECT text FROM symptom_catalog WHERE id = $1', catalog_id)
+
+        try:
+            return self._run(_get())
+        except Exception as e:
+            logger.error(f"Error getting catalog symptom {catalog_id}: {e}")
+            return None
+
+    def delete_day(self, user_id: int, target_date: date) -> bool:
+        """Удаление всех данных за день"""
+        date_str = target_date.isoformat()
+
+        async def _delete():
+            async with self._acquire() as conn:
+                async with conn.transaction():
+                    await conn.execute('DELETE FROM days WHERE user_id = $1 AND date = $2', user_id, date_str)
+                    await conn.execute('DELETE FROM additional_sleeps WHERE user_id = $1 AND date = $2', user_id, date_str)
+                    await conn.execute('''
+                        WITH deleted AS (
+                            DELETE FROM symptoms WHERE user_id = $1 AND date = $2 RETURNING catalog_id
+                        )
+                        UPDATE symptom_usage u SET uses = u.uses - d.count
+                        FROM (SELECT catalog_id, COUNT(*) AS count FROM deleted GROUP BY catalog_id) AS d
+                        WHERE u.user_id = $1 AND u.catalog_id = d.catalog_id
+                    ''', user_id, date_str)
+                    await self._record_change(conn, user_id, date_str, 'delete_day')
+
+        try:
+            self._run(_delete())
+            return True
+        except Exception as e:
+            logger.error(f"Error deleting day for user {user_id}: {e}")
+            return False
+
+    def delete_symptom(self, symptom_id: int) -> bool:
+        """Удаление симптома"""
+        async def _delete():
+            async with self._acquire() as conn:
+                async with conn.transaction():
+                    row = await conn.fetchrow('DELETE FROM symptoms WHERE id = $1 RETURNING user_id, date, catalog_id', symptom_id)
+                    if row is not None:
+                        await conn.execute('''
+                            UPDATE symptom_usage SET uses = uses - 1 WHERE user_id = $1 AND catalog_id = $2
+                        ''', row['user_id'], row['catalog_id'])
+                        await self._record_change(conn, row['user_id'], row['date'], 'delete_symptom')
+
+        try:
+            self._run(_delete())
+            return True
+        except Exception as e:
+            logger.error(f"Error deleting symptom {symptom_id}: {e}")
+            return False
+
+    def delete_additional_sleep(self, sleep_id: int) -> bool:
+        """Удаление дополнительного сна"""
+        async def _delete():
+            async with self._acquire() as conn:
+                async with conn.transaction():
+                    row = await conn.fetchrow('DELETE FROM additional_sleeps WHERE id = $1 RETURNING user_id, date', sleep_id)
+                    if row is not None:
+                        await self._record_change(conn, row['user_id'], row['date'], 'delete_additional_sleep')
+
+        try:
+            self._run(_delete())
+            return True
+        except Exception as e:
+            logger.error(f"Error deleting additional sleep {sleep_id}: {e}")
+            return False
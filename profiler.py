@@ -0,0 +1,266 @@
+import asyncio
+import logging
+import os
+import signal
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+from typing import Dict, Iterator, Optional, Tuple
+
+import config
+
+logger = logging.getLogger(__name__)
+
+# Самый внутренний кадр потока, который ничего не делает, а ждет работу: (модуль, функция)
+IDLE_THREAD_FRAMES = {
+    ('selectors', 'select'),
+    ('threading', 'wait'),
+    ('threading', '_wait_for_tstate_lock'),
+    ('concurrent.futures.thread', '_worker'),
+    ('queue', 'get'),
+    ('multiprocessing.connection', '_recv'),
+}
+
+# То же для задач asyncio: задача ждет новую работу, а не результат
+IDLE_TASK_FRAMES = {
+    ('asyncio.queues', 'get'),
+    ('asyncio.tasks', 'sleep'),
+    ('asyncio.locks', 'wait'),
+}
+
+
+class SamplingProfiler:
+    """Профилирование работающего процесса выборками стеков по времени.
+
+    Каждые interval секунд (таймер SIGALRM в потоке event loop) снимаются
+    стеки всех потоков - обработчики на event loop, методы Database в
+    потоках asyncio.to_thread, код библиотек - и цепочки await
+    приостановленных задач asyncio: где обработчики ждут базу, Bot API
+    или очередь. Потоки и задачи, ждущие работу, не учитываются. Процесс
+    не останавливается и не трассируется, поэтому профиль можно снимать
+    под рабочей нагрузкой.
+
+    Результат - файл свернутых стеков для flamegraph.pl/speedscope (корень
+    стека - "thread:<имя>" или "await") и текстовая сводка top-N функций.
+    """
+
+    def __init__(self, interval: float = None, directory: str = None, top: int = None):
+        self.interval = interval or config.PROFILE_INTERVAL
+        self.directory = directory or config.PROFILE_DIR
+        self.top = top or config.PROFILE_TOP
+        # Подпись кадра по объекту кода: модуль:функция
+        self._labels: Dict = {}
+        self._running = False
+        self._signal_task: Optional[asyncio.Task] = None
+        # Состояние текущего профиля
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._stacks: Counter = Counter()
+        self._busy: Counter = Counter()
+        self._names: Dict[int, str] = {}
+        self._samples = 0
+        self._sampling_time = 0.0
+
+    @property
+    def running(self) -> bool:
+        return self._running
+
+    def _label(self, frame) -> str:
+        code = frame.f_code
+        label = self._labels.get(code)
+        if label is None:
+            module = frame.f_globals.get('__name__', '?')
+            label = self._labels[code] = f"{module}:{getattr(code, 'co_qualname', code.co_name)}"
+        return label
+
+    def _stack(self, frame) -> Tuple[str, ...]:
+        """Стек от корня к листу"""
+        labels = []
+        while frame is not None:
+            labels.append(self._label(frame))
+            frame = frame.f_back
+        return tuple(reversed(labels))
+
+    @staticmethod
+    def _is_idle(frame, idle_frames) -> bool:
+        return (frame.f_globals.get('__name__'), frame.f_code.co_name) in idle_frames
+
+    def _task_stacks(self, loop: asyncio.AbstractEventLoop) -> Iterator[Tuple[str, ...]]:
+        """Цепочки await приостановленных задач; выполняющаяся задача видна в стеке потока loop"""
+        try:
+            tasks = asyncio.all_tasks(loop)
+        except RuntimeError:
+            return
+        for task in tasks:
+            awaitable, labels, leaf = task.get_coro(), [], None
+            while awaitable is not None:
+                if getattr(awaitable, 'cr_running', False):
+                    labels = None
+                    break
+                frame = (getattr(awaitable, 'cr_frame', None) or getattr(awaitable, 'gi_frame', None)
+                         or getattr(awaitable, 'ag_frame', None))
+                if frame is None:
+                    break
+                labels.append(self._label(frame))
+                leaf = frame
+                awaitable = (getattr(awaitable, 'cr_await', None) or getattr(awaitable, 'gi_yieldfrom', None)
+                             or getattr(awaitable, 'ag_await', None))
+            if labels and not self._is_idle(leaf, IDLE_TASK_FRAMES):
+                yield tuple(labels)
+
+    def _take_sample(self, own: int, own_frame=None):
+        """Одна выборка: стеки потоков и цепочки await; для потока own берется own_frame"""
+        for ident, frame in sys._current_frames().items():
+            if ident == own:
+                frame = own_frame
+            if frame is None or self._is_idle(frame, IDLE_THREAD_FRAMES):
+                continue
+            if ident not in self._names:
+                self._names = {thread.ident: thread.name for thread in threading.enumerate()}
+            name = self._names.get(ident, str(ident))
+            self._busy[name] += 1
+            self._stacks[(f"thread:{name}",) + self._stack(frame)] += 1
+        # Кадры не должны жить до следующей выборки
+        frame = own_frame = None
+        for stack in self._task_stacks(self._loop):
+            self._stacks[('await',) + stack] += 1
+        self._samples += 1
+
+    async def _sample_with_timer(self, seconds: float):
+        """Выборки по SIGALRM в потоке event loop.
+
+        Обработчик сигнала получает кадр, прерванный таймером, - без смещения
+        к моментам, когда поток сам отпускает GIL.
+        """
+        def on_timer(signum, frame):
+            started = time.perf_counter()
+            self._take_sample(threading.get_ident(), frame)
+            self._sampling_time += time.perf_counter() - started
+
+        previous = signal.signal(signal.SIGALRM, on_timer)
+        signal.setitimer(signal.ITIMER_REAL, self.interval, self.interval)
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+            signal.signal(signal.SIGALRM, previous)
+
+    def _sample_in_thread(self, seconds: float):
+        """Выборки из отдельного потока (Windows или event loop не в главном потоке).
+
+        Поток получает GIL в основном тогда, когда другие потоки его отпускают,
+        поэтому код на чистом Python здесь недооценивается.
+        """
+        own = threading.get_ident()
+        next_tick = time.perf_counter()
+        deadline = next_tick + seconds
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            self._take_sample(own)
+            self._sampling_time += time.perf_counter() - started
+            next_tick += self.interval
+            time.sleep(max(next_tick - time.perf_counter(), 0))
+
+    def summarize(self, result: Dict) -> str:
+        """Top-N: собственное время, время с вызванными функциями и ожидания задач"""
+        samples = max(result['samples'], 1)
+        own, inclusive, waits = Counter(), Counter(), Counter()
+        for stack, count in result['stacks'].items():
+            if stack[0] == 'await':
+                for label in set(stack[1:]):
+                    waits[label] += count
+                continue
+            own[stack[-1]] += count
+            for label in set(stack[1:]):
+                inclusive[label] += count
+
+        def section(title: str, counter: Counter):
+            lines.append(f"\n{title}:")
+            for label, count in counter.most_common(self.top):
+                lines.append(f"{count / samples:7.1%}  {label}")
+
+        lines = [
+            f"Профиль: {result['seconds']:.1f} с, выборок: {result['samples']} "
+            f"(каждые {self.interval * 1000:.0f} мс), сбор выборок: "
+            f"{result['sampling_time'] / max(result['seconds'], 1e-9):.1%} времени",
+            "Занятость потоков: " + (", ".join(
+                f"{name} {count / samples:.0%}" for name, count in result['busy'].most_common(self.top)
+            ) or "все ждали работу"),
+        ]
+        section("Собственное время", own)
+        section("С вызванными функциями", inclusive)
+        section("Ожидание в задачах asyncio", waits)
+        return "\n".join(lines)
+
+    def write(self, result: Dict, summary: str) -> Tuple[str, str]:
+        """Файлы свернутых стеков (.collapsed) и сводки (.txt)"""
+        os.makedirs(self.directory, exist_ok=True)
+        base = os.path.join(self.directory, f"profile-{datetime.now():%Y%m%d-%H%M%S}-{os.getpid()}")
+        with open(f"{base}.collapsed", 'w', encoding='utf-8') as file:
+            for stack, count in result['stacks'].items():
+                file.write(f"{';'.join(stack)} {count}\n")
+        with open(f"{base}.txt", 'w', encoding='utf-8') as file:
+            file.write(summary + "\n")
+        return f"{base}.collapsed", f"{base}.txt"
+
+    async def profile(self, seconds: float) -> Optional[Dict]:
+        """Профиль процесса за seconds секунд: пути файлов и сводка; None - профиль уже снимается"""
+        if self._running:
+            return None
+        self._running = True
+        try:
+            self._loop = asyncio.get_running_loop()
+            self._stacks, self._busy, self._names = Counter(), Counter(), {}
+            self._samples, self._sampling_time = 0, 0.0
+            started = time.perf_counter()
+            if hasattr(signal, 'setitimer') and threading.current_thread() is threading.main_thread():
+                await self._sample_with_timer(seconds)
+            else:
+                done = self._loop.create_future()
+
+                def run():
+                    try:
+                        self._sample_in_thread(seconds)
+                        self._loop.call_soon_threadsafe(done.set_result, None)
+                    except Exception as e:
+                        self._loop.call_soon_threadsafe(done.set_exception, e)
+
+                # Свой поток, а не пул to_thread: выборки не должны занимать потоки базы
+                threading.Thread(target=run, name='profiler', daemon=True).start()
+                await done
+            result = {
+                'stacks': self._stacks, 'busy': self._busy, 'samples': self._samples,
+                'seconds': time.perf_counter() - started, 'sampling_time': self._sampling_time,
+            }
+            summary = self.summarize(result)
+            collapsed, summary_path = await asyncio.to_thread(self.write, result, summary)
+            return {'collapsed': collapsed, 'summary_path': summary_path, 'summary': summary}
+        finally:
+            self._running = False
+
+    async def _profile_to_log(self, seconds: float):
+        try:
+            result = await self.profile(seconds)
+            if result is None:
+                logger.warning("Profiling is already running")
+                return
+            logger.warning(f"Profile written to {result['collapsed']}\n{result['summary']}")
+        except Exception as e:
+            logger.error(f"Error while profiling: {e}")
+
+    def install_signal_handler(self, seconds: float = None):
+        """SIGUSR1 запускает профилирование; результат - в файлах PROFILE_DIR и в логе"""
+        if not hasattr(signal, 'SIGUSR1'):
+            return
+        seconds = seconds or config.PROFILE_SECONDS
+        loop = asyncio.get_running_loop()
+
+        def start():
+            self._signal_task = loop.create_task(self._profile_to_log(seconds))
+
+        try:
+            loop.add_signal_handler(signal.SIGUSR1, start)
+        except (NotImplementedError, RuntimeError):
+            # Не главный поток или Windows: остается /profile
+            pass
@@ -0,0 +1,275 @@
+import os
+import random
+import re
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+from typing import Dict, List, Tuple
+
+from database import Database
+
+# Запросы, которым полный просмотр или временное B-дерево разрешены: (метод, начало SQL, причина)
+ALLOWED = [
+    ('archive_days_before', "SELECT user_id, date FROM days WHERE date <",
+     "ночной перенос: дни старше границы ищутся по всем пользователям"),
+    ('search_symptoms', "WITH matched AS MATERIALIZED",
+     "результаты сортируются по релевантности bm25, которой нет в индексе"),
+]
+
+# Выполнение каждого запроса для замера (лучшее время из REPEATS)
+REPEATS = 3
+
+SYMPTOM_TEXTS = [
+    "Головная боль", "Сонливость", "Изжога", "Тревога", "Кашель", "Насморк",
+    "Боль в спине", "Бессонница", "Усталость", "Тошнота", "Головокружение", "Жажда",
+]
+
+
+def populate(db: Database, users: int = 200, days: int = 365, seed: int = 1):
+    """Синтетические данные: у каждого пользователя days дней сна, доп. сны и симптомы"""
+    rng = random.Random(seed)
+    today = date.today()
+    user_rows, day_rows, nap_rows, symptom_rows, change_rows = [], [], [], [], []
+
+    for user_id in range(1, users + 1):
+        last_seen = datetime.now() - timedelta(days=rng.randint(0, 60))
+        user_rows.append((user_id, f"user{user_id}", "Имя", None, days, last_seen.isoformat(sep=' '), user_id % 3 == 0))
+        for offset in range(days):
+            day = today - timedelta(days=offset)
+            date_str = day.isoformat()
+            sleep_time = datetime.combine(day - timedelta(days=1), datetime.min.time()) + timedelta(
+                hours=22, minutes=rng.randint(0, 150))
+            minutes = rng.randint(300, 560)
+            day_rows.append((user_id, date_str, sleep_time.isoformat(),
+                             (sleep_time + timedelta(minutes=minutes)).isoformat(), minutes, False))
+            if rng.random() < 0.3:
+                nap = datetime.combine(day, datetime.min.time()) + timedelta(hours=14)
+                nap_rows.append((user_id, date_str, nap.isoformat(), (nap + timedelta(minutes=40)).isoformat(), 40))
+            for _ in range(rng.choice((0, 0, 1, 1, 2))):
+                symptom_rows.append((user_id, date_str, rng.randint(1, len(SYMPTOM_TEXTS))))
+            change_rows.append((user_id, date_str, 'sleep'))
+
+    with db.get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.executemany('INSERT INTO symptom_catalog (text, normalized) VALUES (?, ?)',
+                           [(text, text.lower()) for text in SYMPTOM_TEXTS])
+        cursor.executemany('''
+            INSERT INTO users (user_id, username, first_name, last_name, revision, last_seen, digest_enabled)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', user_rows)
+        cursor.executemany('''
+            INSERT INTO days (user_id, date, sleep_time, wake_time, total_sleep_minutes, no_sleep)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', day_rows)
+        cursor.executemany('''
+            INSERT INTO additional_sleeps (user_id, date, sleep_time, wake_time, sleep_minutes)
+            VALUES (?, ?, ?, ?, ?)
+        ''', nap_rows)
+        cursor.executemany('INSERT INTO symptoms (user_id, date, catalog_id) VALUES (?, ?, ?)', symptom_rows)
+        cursor.executemany('INSERT INTO change_log (user_id, date, operation) VALUES (?, ?, ?)', change_rows)
+        conn.commit()
+
+    # Статистика планировщика такая же, как после ночного обслуживания
+    db.compact()
+
+
+def workload(db: Database) -> List[Tuple[str, tuple]]:
+    """Вызовы всех методов Database, которые выполняет бот (метод, аргументы)"""
+    today = date.today()
+    now = datetime.now()
+    return [
+        ('add_user', (1, "user1", "Имя", None)),
+        ('record_sleep', (1, now - timedelta(hours=8), today)),
+        ('record_wake', (1, now, today)),
+        ('record_no_sleep', (2, today)),
+        ('add_additional_sleep', (1, now - timedelta(hours=3), now - timedelta(hours=2), today)),
+        ('log_sleep_event', (4, 'sleep', now, today)),
+        ('undo_sleep_event', (4, today, (now.isoformat(), None, None, False), None)),
+        ('undo_sleep_event', (5, today, (now.isoformat(), None, None, False), (None, None, 0, True))),
+        ('add_symptom', (1, "головная  боль", today)),
+        ('get_day_summary', (1, today - timedelta(days=3))),
+        ('check_existing_sleep_data', (1, today - timedelta(days=3))),
+        ('get_user_days', (1, 10)),
+        ('get_recent_days', (1, 3)),
+        ('get_sleep_series', (1, today - timedelta(days=30), today)),
+        ('get_sleep_sessions', (1, now - timedelta(days=7), now)),
+        ('count_user_days', (1,)),
+        ('iter_day_summaries', (1, 100)),
+        ('search_symptoms', (1, "боль", 10, 0)),
+        ('get_top_symptoms', (1, 6)),
+        ('get_catalog_symptom', (3,)),
+        ('get_revision', (1,)),
+        ('get_changes', (100, 1000)),
+        ('touch_users', ({1: now, 2: now},)),
+        ('get_activity_counts', ()),
+        ('set_digest_subscription', (1, True)),
+        ('is_digest_subscribed', (1,)),
+        ('get_digest_data', (today, 7, 3)),
+        ('save_digests', (today, {1: "Сводка", 3: "Сводка"})),
+        ('get_pending_digests', (today, 0, 500)),
+        ('mark_digests_sent', (today, [1, 3])),
+        ('delete_symptom', (5,)),
+        ('delete_additional_sleep', (5,)),
+        ('delete_day', (1, today - timedelta(days=10))),
+        ('archive_days_before', (today - timedelta(days=300), 50)),
+        ('get_archived_days', (1, 30, 0)),
+        ('get_archived_day_summary', (1, today - timedelta(days=340))),
+        ('prune_changes', (30,)),
+    ]
+
+
+def template(sql: str) -> str:
+    """Текст запроса без значений параметров: одинаковые запросы с разными значениями совпадают"""
+    sql = re.sub(r"x'[0-9a-f]*'|'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b", "?", sql)
+    return ' '.join(sql.split())
+
+
+def capture_statements(db: Database) -> Dict[str, Dict]:
+    """SQL, который выполняют методы Database: шаблон -> методы, первый текст и число выполнений"""
+    statements: Dict[str, Dict] = {}
+    current = [None]
+
+    def trace(sql: str):
+        # Операторы триггеров приходят как комментарии "-- ..."
+        if current[0] is None or sql.lstrip().startswith('--'):
+            return
+        key = template(sql)
+        if key not in statements:
+            statements[key] = {'methods': [], 'sql': ' '.join(sql.split()), 'calls': 0}
+        if current[0] not in statements[key]['methods']:
+            statements[key]['methods'].append(current[0])
+        statements[key]['calls'] += 1
+
+    get_connection = db.get_connection
+
+    def traced_connection():
+        conn = get_connection()
+        conn.set_trace_callback(trace)
+        return conn
+
+    db.get_connection = traced_connection
+    try:
+        for name, args in workload(db):
+            current[0] = name
+            result = getattr(db, name)(*args)
+            if hasattr(result, '__next__'):
+                list(result)
+    finally:
+        del db.get_connection
+    return statements
+
+
+def is_query(sql: str) -> bool:
+    """Только запросы к данным: PRAGMA, DDL и управление транзакциями не проверяются"""
+    return re.match(r'(WITH|SELECT|INSERT|UPDATE|DELETE)\b', sql, re.IGNORECASE) is not None
+
+
+def explain(conn: sqlite3.Connection, sql: str) -> List[Tuple[int, int, str]]:
+    """План запроса: (id, parent, описание шага)"""
+    return [(row[0], row[1], row[3]) for row in conn.execute(f'EXPLAIN QUERY PLAN {sql}')]
+
+
+def measure(conn: sqlite3.Connection, sql: str) -> Tuple[float, int]:
+    """Лучшее время выполнения (мс) и число строк; изменения откатываются"""
+    best, rows = None, 0
+    for _ in range(REPEATS):
+        conn.execute('BEGIN')
+        try:
+            started = time.perf_counter()
+            rows = len(conn.execute(sql).fetchall())
+            elapsed = (time.perf_counter() - started) * 1000
+        finally:
+            conn.execute('ROLLBACK')
+        best = elapsed if best is None else min(best, elapsed)
+    return best, rows
+
+
+def plan_problems(plan: List[Tuple[int, int, str]], tables: set) -> List[str]:
+    """Полные просмотры таблиц и временные B-деревья в плане"""
+    problems = []
+    for _, _, detail in plan:
+        match = re.match(r'SCAN (\w+)', detail)
+        if match and match.group(1) in tables:
+            problems.append(detail)
+        elif 'TEMP B-TREE' in detail:
+            problems.append(detail)
+    return problems
+
+
+def format_plan(plan: List[Tuple[int, int, str]]) -> List[str]:
+    """План в виде дерева с отступами"""
+    depth = {0: 0}
+    lines = []
+    for node_id, parent, detail in plan:
+        depth[node_id] = depth.get(parent, 0) + 1
+        lines.append("    " + "  " * depth[node_id] + detail)
+    return lines
+
+
+def check(db: Database, verbose: bool = True) -> List[Tuple[str, str, List[str]]]:
+    """Проверка планов всех запросов; возвращает неразрешенные проблемы (метод, SQL, шаги)"""
+    statements = capture_statements(db)
+
+    conn = sqlite3.connect(db.db_name, isolation_level=None)
+    try:
+        if db.archive_name:
+            conn.execute('ATTACH DATABASE ? AS archive', (db.archive_name,))
+        # Виртуальные (FTS5) и их служебные таблицы просматриваются по-своему
+        tables = {row[0] for row in conn.execute('''
+            SELECT name FROM sqlite_master WHERE type = 'table' AND sql NOT LIKE 'CREATE VIRTUAL%'
+            AND name NOT LIKE '%fts%' AND name NOT LIKE 'sqlite_%'
+            UNION SELECT name FROM archive.sqlite_master WHERE type = 'table'
+        ''' if db.archive_name else '''
+            SELECT name FROM sqlite_master WHERE type = 'table' AND sql NOT LIKE 'CREATE VIRTUAL%'
+            AND name NOT LIKE '%fts%' AND name NOT LIKE 'sqlite_%'
+        ''')}
+
+        failures = []
+        for statement in statements.values():
+            methods, sql = statement['methods'], statement['sql']
+            method = ', '.join(methods)
+            if not is_query(sql):
+                continue
+            plan = explain(conn, sql)
+            milliseconds, rows = measure(conn, sql)
+            problems = plan_problems(plan, tables)
+            reason = next((reason for allowed_method, prefix, reason in ALLOWED
+                           if allowed_method in methods and sql.startswith(prefix)), None)
+
+            if verbose:
+                status = "OK" if not problems else ("РАЗРЕШЕНО" if reason else "ОШИБКА")
+                print(f"[{status}] {method}: {milliseconds:.2f} мс, строк: {rows}, выполнений: {statement['calls']}")
+                print(f"    {sql[:200]}")
+                print("\n".join(format_plan(plan)))
+                if problems and reason:
+                    print(f"    ({reason})")
+                print()
+
+            if problems and not reason:
+                failures.append((method, sql, problems))
+        return failures
+    finally:
+        conn.close()
+
+
+def main():
+    users = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    with tempfile.TemporaryDirectory() as directory:
+        db = Database(os.path.join(directory, "plans.db"), archive_name=os.path.join(directory, "plans_archive.db"))
+        started = time.perf_counter()
+        populate(db, users=users)
+        print(f"Синтетическая база: {users} пользователей за {time.perf_counter() - started:.1f} с\n")
+
+        failures = check(db)
+        if failures:
+            print(f"Запросов без индекса или с временным B-деревом: {len(failures)}")
+            for method, sql, problems in failures:
+                print(f"  {method}: {'; '.join(problems)}")
+            sys.exit(1)
+        print("Все запросы используют индексы")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+import logging
+import time
+from collections import OrderedDict
+from typing import Dict
+
+from telegram import Update
+from telegram.ext import Application, ApplicationHandlerStop, ContextTypes, TypeHandler
+
+import config
+
+logger = logging.getLogger(__name__)
+
+
+class RateLimiter:
+    """Ограничение частоты обновлений от одного пользователя (token bucket).
+
+    Каждое обновление тратит жетон, жетоны восстанавливаются со скоростью rate
+    в секунду до burst. Корзина, простоявшая burst / rate секунд, снова полна,
+    поэтому ее можно удалить без потери состояния.
+    """
+
+    def __init__(self, rate: float = None, burst: int = None):
+        self.rate = rate or config.RATE_LIMIT_PER_SECOND
+        self.burst = burst or config.RATE_LIMIT_BURST
+        self.refill_seconds = self.burst / self.rate
+        # user_id -> [жетоны, время обновления, предупрежден ли]; порядок - по последнему обновлению
+        self._buckets: OrderedDict = OrderedDict()
+        self.metrics = {'allowed': 0, 'limited': 0, 'warned': 0, 'evicted': 0}
+
+    def _evict(self, now: float):
+        """Удаление корзин, которые уже восстановились полностью"""
+        while self._buckets:
+            _, updated, _ = next(iter(self._buckets.values()))
+            if now - updated < self.refill_seconds:
+                break
+            self._buckets.popitem(last=False)
+            self.metrics['evicted'] += 1
+
+    def take(self, user_id: int, now: float = None):
+        """Попытка потратить жетон: (разрешено, нужно ли предупредить пользователя)"""
+        now = time.monotonic() if now is None else now
+        self._evict(now)
+
+        bucket = self._buckets.get(user_id)
+        if bucket is None:
+            bucket = self._buckets[user_id] = [float(self.burst), now, False]
+        else:
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+            self._buckets.move_to_end(user_id)
+
+        if bucket[0] >= 1:
+            bucket[0] -= 1
+            bucket[2] = False
+            self.metrics['allowed'] += 1
+            return True, False
+
+        self.metrics['limited'] += 1
+        # Предупреждаем один раз за серию, иначе ответы сами станут спамом
+        warn = not bucket[2]
+        bucket[2] = True
+        return False, warn
+
+    async def check(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Группа -2: лишние обновления не доходят до обработчиков и базы"""
+        user = update.effective_user
+        if user is None:
+            return
+
+        allowed, warn = self.take(user.id)
+        if allowed:
+            return
+
+        try:
+            if update.callback_query:
+                await update.callback_query.answer("⏳ Слишком часто, подождите немного")
+            elif warn and update.effective_message:
+                self.metrics['warned'] += 1
+                await update.effective_message.reply_text("⏳ Слишком много сообщений, подождите немного")
+        except Exception as e:
+            logger.debug(f"Could not send rate limit notice: {e}")
+        raise ApplicationHandlerStop
+
+    def register(self, application: Application):
+        """Подключение раньше всех остальных обработчиков"""
+        application.add_handler(TypeHandler(Update, self.check), group=-2)
+
+    def stats(self) -> Dict:
+        """Сколько обновлений пропущено и ограничено"""
+        return {**self.metrics, 'tracked': len(self._buckets)}
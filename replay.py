@@ -0,0 +1,323 @@
+import asyncio
+import gzip
+import hashlib
+import json
+import logging
+import os
+import re
+import sqlite3
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from contextlib import closing
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from telegram import Update
+from telegram.ext import Application, ContextTypes, TypeHandler
+
+import config
+
+logger = logging.getLogger(__name__)
+
+# Текст из одних цифр и разделителей (время, дата) не обезличивается: от него зависит ветка обработки
+KEEP_PATTERN = re.compile(r'[\d\s:./,-]*')
+
+# Пауза между обновлениями при воспроизведении не длиннее (секунд): ночные простои не ждем
+MAX_GAP = 30
+
+# Дней истории у синтетических пользователей, если исходная база не указана
+SYNTHETIC_DAYS = 60
+
+
+class UpdateRecorder:
+    """Запись входящих обновлений в обезличенный журнал для replay.py.
+
+    Журнал - gzip со строками JSON: t - секунды от начала сеанса записи,
+    u - псевдоним пользователя, k - вид ('text' или 'callback'), v - текст
+    или callback_data, m - номер сообщения. Псевдонимы выдаются по порядку
+    и живут только в памяти, поэтому по журналу нельзя восстановить
+    user_id. Свободный текст заменяется токеном: одинаковый текст в одном
+    сеансе дает одинаковый токен. Каждый запуск бота начинает новый сеанс.
+    """
+
+    def __init__(self, path: str, keep_texts=(), flush_every: int = None):
+        self.path = path
+        self.keep_texts = set(keep_texts)
+        self.flush_every = flush_every or config.UPDATE_RECORD_FLUSH_EVERY
+        self._salt = os.urandom(16)
+        self._pseudonyms: Dict[int, int] = {}
+        self._file = None
+        self._started = None
+        self._pending = 0
+        self.metrics = {'recorded': 0, 'skipped': 0}
+
+    def _token(self, text: str) -> str:
+        digest = hashlib.blake2s(text.encode(), key=self._salt, digest_size=4).hexdigest()
+        return f"текст-{digest}"
+
+    def anonymize_text(self, text: str) -> str:
+        """Команды, время и кнопки быстрого режима остаются, остальной текст - токен"""
+        if text in self.keep_texts or KEEP_PATTERN.fullmatch(text):
+            return text
+        if text.startswith('/'):
+            command, _, argument = text.partition(' ')
+            return f"{command} {self._token(argument)}" if argument else command
+        return self._token(text)
+
+    def _write(self, record: Dict):
+        if self._file is None:
+            self._file = gzip.open(self.path, 'at', encoding='utf-8')
+            self._started = time.monotonic()
+            header = {'k': 'session', 'v': datetime.now().isoformat(timespec='seconds')}
+            self._file.write(json.dumps(header, separators=(',', ':')) + '\n')
+        record = {'t': round(time.monotonic() - self._started, 3), **record}
+        self._file.write(json.dumps(record, ensure_ascii=False, separators=(',', ':')) + '\n')
+        self._pending += 1
+        if self._pending >= self.flush_every:
+            # Сброс с синхронизацией gzip: записанное читается, даже если процесс упадет
+            self._file.flush()
+            self._pending = 0
+
+    async def record(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Группа -5: обновление записывается раньше любых других обработчиков"""
+        user = update.effective_user
+        query = update.callback_query
+        if user is None:
+            self.metrics['skipped'] += 1
+            return
+        if update.message and update.message.text:
+            record = {'k': 'text', 'v': self.anonymize_text(update.message.text), 'm': update.message.message_id}
+        elif query and query.data:
+            record = {'k': 'callback', 'v': query.data, 'm': query.message.message_id if query.message else None}
+        else:
+            self.metrics['skipped'] += 1
+            return
+
+        record['u'] = self._pseudonyms.setdefault(user.id, len(self._pseudonyms) + 1)
+        try:
+            self._write(record)
+            self.metrics['recorded'] += 1
+        except Exception as e:
+            logger.error(f"Error recording update: {e}")
+
+    def register(self, application: Application):
+        """Подключение раньше всех остальных обработчиков"""
+        application.add_handler(TypeHandler(Update, self.record), group=-5)
+
+    def close(self):
+        if self._file is not None:
+            try:
+                self._file.close()
+            except Exception as e:
+                logger.error(f"Error closing update log: {e}")
+            self._file = None
+
+
+def read_log(path: str) -> Iterator[Dict]:
+    """Записи журнала; оборванный конец (процесс упал до сброса) пропускается"""
+    try:
+        with gzip.open(path, 'rt', encoding='utf-8') as file:
+            for line in file:
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    logger.warning("Skipping truncated update log line")
+    except (EOFError, gzip.BadGzipFile) as e:
+        logger.warning(f"Update log ends unexpectedly: {e}")
+
+
+def schedule(records: List[Dict], speed: Optional[float]) -> List[Tuple[float, Tuple[int, int], Dict]]:
+    """Момент отправки каждого обновления от начала воспроизведения: (секунды, (сеанс, псевдоним), запись).
+
+    Паузы длиннее MAX_GAP сокращаются, между сеансами паузы нет; speed=None - без пауз.
+    """
+    planned = []
+    session, offset, previous = 0, 0.0, None
+    for record in records:
+        if record['k'] == 'session':
+            session += 1
+            previous = None
+            continue
+        if previous is not None:
+            offset += min(max(record['t'] - previous, 0), MAX_GAP)
+        previous = record['t']
+        planned.append((offset / speed if speed else 0.0, (session, record['u']), record))
+    return planned
+
+
+def copy_database(source: str, target: str):
+    """Копия базы через backup API: исходная база может быть открыта ботом"""
+    with closing(sqlite3.connect(source)) as src, closing(sqlite3.connect(target)) as dst:
+        src.backup(dst)
+
+
+def active_users(db_name: str, limit: int) -> List[int]:
+    """Пользователи с наибольшей историей - на них ложатся псевдонимы журнала"""
+    with closing(sqlite3.connect(db_name)) as conn:
+        return [row[0] for row in conn.execute(
+            'SELECT user_id FROM days GROUP BY user_id ORDER BY COUNT(*) DESC LIMIT ?', (limit,)
+        )]
+
+
+def handler_label(name: str, group: int, update: Update) -> str:
+    """Основной обработчик кнопок делится по callback_data без номеров и дат"""
+    query = update.callback_query
+    if group == 0 and query and query.data:
+        return f"{name}[{re.sub(r'[0-9][0-9-]*$', '', query.data)}]"
+    return name
+
+
+def instrument(application: Application, stats: Dict[str, List], queries: List[int], stub):
+    """Замер каждого обработчика: (мс, запросы к БД, вызовы Bot API) по меткам"""
+    def measured(callback, group: int):
+        name = getattr(callback, '__qualname__', repr(callback))
+
+        async def wrapper(update, context):
+            calls, executed, started = len(stub.calls), queries[0], time.perf_counter()
+            try:
+                return await callback(update, context)
+            finally:
+                stats[handler_label(name, group, update)].append(
+                    ((time.perf_counter() - started) * 1000, queries[0] - executed, len(stub.calls) - calls)
+                )
+        return wrapper
+
+    for group, handlers in application.handlers.items():
+        for handler in handlers:
+            handler.callback = measured(handler.callback, group)
+
+
+async def replay(records: List[Dict], speed: Optional[float], source: str = None) -> Dict:
+    """Воспроизведение журнала на копии базы с Bot API без сети"""
+    import bot
+    from action_costs import StubRequest, callback_update, count_queries, message_update
+    from query_plans import populate
+    from startup import startup_report
+
+    # Отчет о запуске здесь не нужен
+    startup_report.first_update_handled = True
+
+    stub = StubRequest()
+    bot.outbound.set_transport(stub)
+    planned = schedule(records, speed)
+    pseudonyms = sorted({key for _, key, _ in planned})
+
+    if source:
+        copy_database(source, config.DATABASE_NAME)
+        real = active_users(config.DATABASE_NAME, len(pseudonyms))
+        storage = bot.default_instance.storage.get()
+        # Псевдонимов больше, чем пользователей в базе: остальные - новые пользователи
+        fresh = iter(range(max(real, default=0) + 1, sys.maxsize))
+        real += [next(fresh) for _ in range(len(pseudonyms) - len(real))]
+    else:
+        storage = bot.default_instance.storage.get()
+        populate(storage, users=len(pseudonyms), days=SYNTHETIC_DAYS)
+        real = list(range(1, len(pseudonyms) + 1))
+    user_ids = dict(zip(pseudonyms, real))
+    queries = count_queries(storage)
+
+    # Ограничения рассчитаны на живой темп: при ускорении они сжимаются вместе со временем
+    if speed is None:
+        bot.rate_limiter.burst = float('inf')
+        bot.coalescer.window = 0
+    elif speed != 1:
+        bot.rate_limiter.rate *= speed
+        bot.coalescer.window /= speed
+    bot.rate_limiter.refill_seconds = bot.rate_limiter.burst / bot.rate_limiter.rate
+
+    application = bot.build_application(schedule_jobs=False)
+    stats: Dict[str, List] = defaultdict(list)
+    instrument(application, stats, queries, stub)
+    await application.initialize()
+
+    lags = []
+    tasks = set()
+    started = time.perf_counter()
+
+    async def handle(at: float, update: Update):
+        # Отставание - от плана до начала обработки, включая ожидание в update_processor
+        lags.append(max(time.perf_counter() - started - at, 0) * 1000)
+        await application.process_update(update)
+
+    try:
+        for update_id, (at, key, record) in enumerate(planned, start=1):
+            delay = at - (time.perf_counter() - started)
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+            user_id = user_ids[key]
+            if record['k'] == 'text':
+                data = message_update(update_id, user_id, record['v'])
+            else:
+                data = callback_update(update_id, user_id, record['v'], message_id=record.get('m') or 500)
+            # Как в run_polling: отправка по расписанию не ждет обработки, одновременно
+            # обрабатывается не больше concurrent_updates обновлений
+            update = Update.de_json(data, application.bot)
+            task = asyncio.create_task(application.update_processor.process_update(update, handle(at, update)))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+    finally:
+        await asyncio.gather(*tasks, return_exceptions=True)
+        elapsed = time.perf_counter() - started
+        await application.shutdown()
+        await application.post_shutdown(application)
+
+    return {
+        'handlers': stats, 'updates': len(planned), 'users': len(pseudonyms), 'elapsed': elapsed,
+        'lags': lags if speed else None, 'queries': queries[0], 'calls': len(stub.calls),
+    }
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)] if ordered else 0.0
+
+
+def print_report(result: Dict):
+    handlers = result['handlers']
+    print(f"{'Обработчик':<44} {'вызовов':>8} {'p50, мс':>8} {'p95, мс':>8} {'макс, мс':>9} {'запросов':>9} {'Bot API':>8}")
+    for label, samples in sorted(handlers.items(), key=lambda item: -sum(sample[0] for sample in item[1])):
+        times = [sample[0] for sample in samples]
+        print(
+            f"{label[:44]:<44} {len(samples):>8} {percentile(times, 0.5):>8.2f} {percentile(times, 0.95):>8.2f} "
+            f"{max(times):>9.2f} {sum(s[1] for s in samples) / len(samples):>9.1f} "
+            f"{sum(s[2] for s in samples) / len(samples):>8.1f}"
+        )
+
+    updates, elapsed = result['updates'], result['elapsed']
+    print()
+    print(f"Обновлений: {updates} от {result['users']} пользователей за {elapsed:.1f} с "
+          f"({updates / elapsed if elapsed else 0:.0f} в секунду)")
+    print(f"Запросов к БД: {result['queries']}, вызовов Bot API: {result['calls']}")
+    if result['lags'] is not None:
+        print(f"Отставание от журнала: p50 {percentile(result['lags'], 0.5):.1f} мс, "
+              f"p95 {percentile(result['lags'], 0.95):.1f} мс, макс {max(result['lags'], default=0):.1f} мс")
+
+
+def main():
+    """Воспроизведение журнала: python replay.py журнал.gz [1|N|max] [исходная.db]"""
+    if len(sys.argv) < 2:
+        print("Использование: python replay.py журнал.gz [1|N|max] [исходная.db]")
+        sys.exit(2)
+    path = sys.argv[1]
+    speed = sys.argv[2] if len(sys.argv) > 2 else '1'
+    speed = None if speed == 'max' else float(speed)
+    source = sys.argv[3] if len(sys.argv) > 3 else None
+
+    records = list(read_log(path))
+    with tempfile.TemporaryDirectory() as directory:
+        config.DATABASE_BACKEND = "sqlite"
+        config.DATABASE_NAME = os.path.join(directory, "replay.db")
+        config.ARCHIVE_DATABASE_NAME = os.path.join(directory, "replay_archive.db")
+        config.PERSISTENCE_FILE = None
+        config.HANDOFF_FILE = os.path.join(directory, "handoff.json")
+        config.UPDATE_RECORD_FILE = None
+
+        result = asyncio.run(replay(records, speed, source))
+    print_report(result)
+
+
+if __name__ == '__main__':
+    main()
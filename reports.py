@@ -0,0 +1,308 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date
+from typing import Dict, Optional, Tuple
+
+import config
+from models import DaySummary
+from outbound import bulk_lane
+
+logger = logging.getLogger(__name__)
+
+DAYS_PER_PAGE = 12
+LINES_PER_PAGE = 46
+
+# Очередь прогресса рабочего процесса (задается инициализатором пула)
+_progress_queue = None
+
+
+def _init_worker(progress_queue):
+    """Инициализация процесса пула отчетов"""
+    global _progress_queue
+    _progress_queue = progress_queue
+
+
+def _format_minutes(minutes: int) -> str:
+    return f"{minutes // 60}ч {minutes % 60}м"
+
+
+def _format_day(day_date: date, summary: DaySummary):
+    """Строки отчета за один день"""
+    lines = [day_date.strftime('%d.%m.%Y')]
+    if summary.no_sleep:
+        lines.append("    Не спал")
+    else:
+        sleep_time = summary.sleep_time.strftime('%H:%M') if summary.sleep_time else "—"
+        wake_time = summary.wake_time.strftime('%H:%M') if summary.wake_time else "—"
+        lines.append(f"    Сон: {sleep_time} - {wake_time}, всего {_format_minutes(summary.total_sleep_all_minutes)}")
+    for sleep in summary.additional_sleeps:
+        sleep_time = sleep.sleep_time.strftime('%H:%M')
+        wake_time = sleep.wake_time.strftime('%H:%M')
+        lines.append(f"    Доп. сон: {sleep_time} - {wake_time} ({_format_minutes(sleep.sleep_minutes)})")
+    for symptom in summary.symptoms:
+        lines.append(f"    Симптом: {symptom.text[:80]}")
+    return lines
+
+
+def build_report(job_id: int, user_id: int, path: str, namespace: str = None) -> Dict:
+    """Сборка PDF-отчета в процессе пула: данные читаются порциями, страницы пишутся сразу"""
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    from matplotlib.backends.backend_pdf import PdfPages
+    from storage import create_database
+
+    storage = create_database(namespace=namespace)
+    try:
+        total_days = storage.count_user_days(user_id)
+        processed = 0
+        pages = 0
+        sleep_minutes = []
+        no_sleep_days = 0
+        symptom_counter = Counter()
+        first_date = last_date = None
+
+        def write_page(pdf, lines, title=None):
+            nonlocal pages
+            figure = plt.figure(figsize=(8.27, 11.69))  # A4
+            if title:
+                figure.text(0.08, 0.95, title, fontsize=14, weight="bold")
+            figure.text(0.08, 0.92, "\n".join(lines), fontsize=9, family="DejaVu Sans Mono", va="top")
+            pdf.savefig(figure)
+            plt.close(figure)
+            pages += 1
+
+        with PdfPages(path) as pdf:
+            lines = []
+            for day_date, summary in storage.iter_day_summaries(user_id, batch_size=config.REPORT_BATCH_DAYS):
+                first_date = first_date or day_date
+                last_date = day_date
+
+                if summary.no_sleep:
+                    no_sleep_days += 1
+                elif summary.total_sleep_all_minutes > 0:
+                    sleep_minutes.append(summary.total_sleep_all_minutes)
+                symptom_counter.update(symptom.text.strip().lower() for symptom in summary.symptoms)
+
+                day_lines = _format_day(day_date, summary)
+                if len(lines) + len(day_lines) > LINES_PER_PAGE:
+                    write_page(pdf, lines, "Дневник сна" if pages == 0 else None)
+                    lines = []
+                lines.extend(day_lines + [""])
+
+                processed += 1
+                if _progress_queue is not None and processed % DAYS_PER_PAGE == 0:
+                    _progress_queue.put((job_id, processed, total_days))
+
+            if lines:
+                write_page(pdf, lines, "Дневник сна" if pages == 0 else None)
+
+            summary_lines = [
+                f"Период: {first_date.strftime('%d.%m.%Y') if first_date else '—'} - "
+                f"{last_date.strftime('%d.%m.%Y') if last_date else '—'}",
+                f"Дней с записями: {processed}",
+                f"Дней без сна: {no_sleep_days}",
+            ]
+            if sleep_minutes:
+                summary_lines += [
+                    f"Средний сон: {_format_minutes(sum(sleep_minutes) // len(sleep_minutes))}",
+                    f"Минимум: {_format_minutes(min(sleep_minutes))}",
+                    f"Максимум: {_format_minutes(max(sleep_minutes))}",
+                ]
+            if symptom_counter:
+                summary_lines += ["", "Частые симптомы:"]
+                summary_lines += [f"    {text[:60]}: {count}" for text, count in symptom_counter.most_common(15)]
+            write_page(pdf, summary_lines, "Итоги")
+
+        return {'days': processed, 'pages': pages, 'bytes': os.path.getsize(path)}
+    finally:
+        storage.close()
+
+
+class ReportJob:
+    """Задача на построение отчета"""
+
+    def __init__(self, job_id: int, user_id: int, chat_id: int, status_message=None, bot=None, namespace: str = None):
+        self.job_id = job_id
+        self.user_id = user_id
+        self.chat_id = chat_id
+        self.status_message = status_message
+        # Бот и пространство имен хранилища, если очередь общая для нескольких ботов
+        self.bot = bot
+        self.namespace = namespace
+        self.queued_at = time.perf_counter()
+        self.progress = 0
+        self.last_progress_edit = 0.0
+
+
+class ReportQueue:
+    """Ограниченная очередь PDF-отчетов с пулом процессов и дедупликацией по пользователю"""
+
+    def __init__(self, max_size: int = None, workers: int = None):
+        self.max_size = max_size or config.REPORT_QUEUE_SIZE
+        self.workers = workers or config.REPORT_WORKERS
+        self._queue: Optional[asyncio.Queue] = None
+        self._in_flight: Dict[Tuple[Optional[str], int], ReportJob] = {}
+        self._jobs: Dict[int, ReportJob] = {}
+        self._next_job_id = 1
+        self._executor = None
+        self._consumers = []
+        self._progress_queue = None
+        self._progress_thread = None
+        self._loop = None
+        self.metrics = {
+            'submitted': 0, 'completed': 0, 'failed': 0,
+            'rejected_full': 0, 'deduplicated': 0,
+            'wait_seconds': 0.0, 'build_seconds': 0.0, 'send_seconds': 0.0
+        }
+
+    async def start(self, bot):
+        """Запуск обработчиков очереди; bot отправляет отчеты задач без своего бота"""
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue(maxsize=self.max_size)
+        context = multiprocessing.get_context("spawn")
+        self._progress_queue = context.Queue()
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=context,
+            initializer=_init_worker,
+            initargs=(self._progress_queue,)
+        )
+        self._progress_thread = threading.Thread(target=self._read_progress, name="report-progress", daemon=True)
+        self._progress_thread.start()
+        self._consumers = [asyncio.create_task(self._consume(bot)) for _ in range(self.workers)]
+
+    async def stop(self):
+        """Остановка обработчиков и пула процессов"""
+        for consumer in self._consumers:
+            consumer.cancel()
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+        if self._progress_queue is not None:
+            self._progress_queue.put(None)
+
+    def submit(self, user_id: int, chat_id: int, status_message=None, bot=None, namespace: str = None) -> str:
+        """Постановка отчета в очередь: 'queued', 'duplicate' или 'full'"""
+        if (namespace, user_id) in self._in_flight:
+            self.metrics['deduplicated'] += 1
+            return 'duplicate'
+
+        job = ReportJob(self._next_job_id, user_id, chat_id, status_message, bot, namespace)
+        try:
+            self._queue.put_nowait(job)
+        except asyncio.QueueFull:
+            self.metrics['rejected_full'] += 1
+            return 'full'
+
+        self._next_job_id += 1
+        self._in_flight[namespace, user_id] = job
+        self._jobs[job.job_id] = job
+        self.metrics['submitted'] += 1
+        return 'queued'
+
+    def queue_position(self) -> int:
+        """Число задач в очереди"""
+        return self._queue.qsize() if self._queue else 0
+
+    def _read_progress(self):
+        """Чтение прогресса из процессов пула (в отдельном потоке)"""
+        while True:
+            try:
+                item = self._progress_queue.get()
+            except (EOFError, OSError):
+                return
+            if item is None:
+                return
+            job_id, done, total = item
+            asyncio.run_coroutine_threadsafe(self._report_progress(job_id, done, total), self._loop)
+
+    async def _report_progress(self, job_id: int, done: int, total: int):
+        """Обновление сообщения о прогрессе (не чаще раза в несколько секунд)"""
+        job = self._jobs.get(job_id)
+        if job is None or job.status_message is None or total == 0:
+            return
+
+        percent = min(done * 100 // total, 99)
+        now = time.perf_counter()
+        if percent <= job.progress or now - job.last_progress_edit < config.REPORT_PROGRESS_INTERVAL:
+            return
+
+        job.progress = percent
+        job.last_progress_edit = now
+        try:
+            with bulk_lane():
+                await job.status_message.edit_text(f"📄 Готовлю отчет: {percent}%")
+        except Exception as e:
+            logger.debug(f"Could not update report progress: {e}")
+
+    async def _consume(self, bot):
+        """Обработка задач из очереди (запросы Bot API - в фоновой полосе)"""
+        with bulk_lane():
+            while True:
+                job = await self._queue.get()
+                try:
+                    await self._run_job(bot, job)
+                finally:
+                    self._in_flight.pop((job.namespace, job.user_id), None)
+                    self._jobs.pop(job.job_id, None)
+                    self._queue.task_done()
+
+    async def _run_job(self, bot, job: ReportJob):
+        """Сборка отчета в пуле процессов и отправка документа"""
+        bot = job.bot or bot
+        started = time.perf_counter()
+        self.metrics['wait_seconds'] += started - job.queued_at
+
+        fd, path = tempfile.mkstemp(suffix=".pdf", prefix="sleep_report_")
+        os.close(fd)
+        try:
+            result = await self._loop.run_in_executor(
+                self._executor, build_report, job.job_id, job.user_id, path, job.namespace
+            )
+            built = time.perf_counter()
+            self.metrics['build_seconds'] += built - started
+
+            with open(path, 'rb') as f:
+                await bot.send_document(
+                    chat_id=job.chat_id,
+                    document=f,
+                    filename=f"sleep_report_{date.today().isoformat()}.pdf",
+                    caption=f"📄 Отчет: {result['days']} дн., {result['pages']} стр."
+                )
+            self.metrics['send_seconds'] += time.perf_counter() - built
+            self.metrics['completed'] += 1
+
+            if job.status_message is not None:
+                await job.status_message.edit_text("✅ Отчет готов")
+            logger.info(
+                f"Report {job.job_id} for user {job.user_id}: {result['days']} days, {result['pages']} pages, "
+                f"build {built - started:.2f}s"
+            )
+        except Exception as e:
+            self.metrics['failed'] += 1
+            logger.error(f"Error building report for user {job.user_id}: {e}")
+            try:
+                await bot.send_message(chat_id=job.chat_id, text="❌ Ошибка при подготовке отчета")
+            except Exception:
+                pass
+        finally:
+            os.remove(path)
+
+    def stats(self) -> Dict:
+        """Метрики очереди отчетов"""
+        finished = self.metrics['completed'] + self.metrics['failed']
+        return {
+            **self.metrics,
+            'queued': self.queue_position(),
+            'in_flight': len(self._in_flight),
+            'avg_wait_seconds': self.metrics['wait_seconds'] / finished if finished else 0.0,
+            'avg_build_seconds': self.metrics['build_seconds'] / finished if finished else 0.0,
+            'avg_send_seconds': self.metrics['send_seconds'] / self.metrics['completed'] if self.metrics['completed'] else 0.0
+        }
@@ -0,0 +1,47 @@
+import time
+from contextlib import contextmanager
+from typing import List, Tuple
+
+
+class StartupReport:
+    """Замеры холодного старта: импорты, инициализация БД, первое обновление"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.phases: List[Tuple[str, float]] = []
+        self.milestones: List[Tuple[str, float]] = []
+        self.first_update_handled = False
+
+    @contextmanager
+    def measure(self, name: str):
+        """Замер длительности фазы запуска"""
+        phase_started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases.append((name, time.perf_counter() - phase_started))
+
+    def mark(self, name: str):
+        """Отметка момента от начала запуска"""
+        self.milestones.append((name, time.perf_counter() - self.started))
+
+    def mark_first_update(self):
+        """Отметка о первом обработанном обновлении и вывод отчета"""
+        if self.first_update_handled:
+            return
+        self.first_update_handled = True
+        self.mark("первое обновление обработано")
+        print(self.format())
+
+    def format(self) -> str:
+        """Текстовый отчет о запуске"""
+        lines = ["Время запуска:"]
+        for name, seconds in self.phases:
+            lines.append(f"  {name}: {seconds * 1000:.1f} мс")
+        for name, seconds in self.milestones:
+            lines.append(f"  {name}: через {seconds * 1000:.1f} мс")
+        return "\n".join(lines)
+
+
+# Создается при первом импорте, поэтому startup нужно импортировать раньше остальных модулей
+startup_report = StartupReport()
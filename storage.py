@@ -0,0 +1,333 @@
+import os
+import threading
+from abc import ABC, abstractmethod
+from datetime import datetime, date, timedelta
+from typing import List, Dict, Iterator, Optional, Tuple
+
+import config
+from intervals import main_sleep_interval
+from models import DaySummary, DigestData, SleepSession
+from startup import startup_report
+
+
+# Состояние дня в days: (sleep_time, wake_time, total_sleep_minutes, no_sleep)
+DayState = Tuple[Optional[str], Optional[str], Optional[int], bool]
+
+
+class Storage(ABC):
+    """Общий интерфейс хранилища данных бота"""
+
+    # Пространство имен (бот в общем процессе); None - хранилище единственного бота
+    namespace: Optional[str] = None
+
+    @abstractmethod
+    def add_user(self, user_id: int, username: str, first_name: str, last_name: str):
+        """Добавление пользователя"""
+
+    @abstractmethod
+    def record_sleep(self, user_id: int, sleep_time: datetime, target_date: date = None) -> bool:
+        """Запись времени засыпания"""
+
+    @abstractmethod
+    def record_wake(self, user_id: int, wake_time: datetime, target_date: date = None) -> bool:
+        """Запись времени пробуждения"""
+
+    @abstractmethod
+    def record_no_sleep(self, user_id: int, target_date: date = None) -> bool:
+        """Запись отметки 'не спал'"""
+
+    @abstractmethod
+    def add_additional_sleep(self, user_id: int, sleep_time: datetime, wake_time: datetime, target_date: date = None) -> bool:
+        """Добавление дополнительного сна"""
+
+    @abstractmethod
+    def add_symptom(self, user_id: int, symptom_text: str, symptom_date: date = None) -> bool:
+        """Добавление симптома"""
+
+    @abstractmethod
+    def log_sleep_event(self, user_id: int, kind: str, at: datetime,
+                        target_date: date = None) -> Optional[Tuple[Optional[DayState], DayState]]:
+        """Засыпание ('sleep') или пробуждение ('wake') одной записью дня.
+
+        Возвращает состояние дня до и после записи (до - None, если дня не было)
+        или None при ошибке.
+        """
+
+    @abstractmethod
+    def undo_sleep_event(self, user_id: int, target_date: date, written: DayState,
+                         previous: Optional[DayState]) -> bool:
+        """Возврат дня к previous, если после записи written его никто не менял"""
+
+    @abstractmethod
+    def get_day_summary(self, user_id: int, target_date: date) -> DaySummary:
+        """Получение сводки за день"""
+
+    @abstractmethod
+    def check_existing_sleep_data(self, user_id: int, target_date: date) -> Dict:
+        """Проверка существующих данных о сне за день"""
+
+    @abstractmethod
+    def get_user_days(self, user_id: int, limit: int = 30) -> List[Tuple[date, bool]]:
+        """Получение списка дней пользователя с информацией о наличии данных"""
+
+    @abstractmethod
+    def delete_day(self, user_id: int, target_date: date) -> bool:
+        """Удаление всех данных за день"""
+
+    @abstractmethod
+    def delete_symptom(self, symptom_id: int) -> bool:
+        """Удаление симптома"""
+
+    @abstractmethod
+    def delete_additional_sleep(self, sleep_id: int) -> bool:
+        """Удаление дополнительного сна"""
+
+    @abstractmethod
+    def search_symptoms(self, user_id: int, text: str, limit: int = 10, offset: int = 0) -> List[Tuple[date, List[str]]]:
+        """Полнотекстовый поиск по симптомам: (дата, найденные симптомы) по релевантности"""
+
+    @abstractmethod
+    def get_top_symptoms(self, user_id: int, limit: int = 6) -> List[Tuple[int, str]]:
+        """Частые симптомы пользователя из каталога: (id в каталоге, текст)"""
+
+    @abstractmethod
+    def get_catalog_symptom(self, catalog_id: int) -> Optional[str]:
+        """Текст симптома по id в каталоге"""
+
+    @abstractmethod
+    def get_revision(self, user_id: int) -> int:
+        """Ревизия данных пользователя: растет при каждой записи"""
+
+    @abstractmethod
+    def get_changes(self, after_seq: int = 0, limit: int = 1000) -> List[Dict]:
+        """Записи журнала изменений после записи after_seq: seq, user_id, date, operation, created_at"""
+
+    @abstractmethod
+    def prune_changes(self, keep_days: int) -> int:
+        """Удаление записей журнала изменений старше keep_days дней"""
+
+    @abstractmethod
+    def touch_users(self, seen: Dict[int, datetime]) -> bool:
+        """Пакетное обновление времени последней активности пользователей"""
+
+    @abstractmethod
+    def get_activity_counts(self, now: datetime = None) -> Dict[str, int]:
+        """Число активных пользователей за сутки, неделю и 30 дней: dau, wau, mau"""
+
+    @abstractmethod
+    def set_digest_subscription(self, user_id: int, enabled: bool) -> bool:
+        """Подписка на утреннюю сводку (или отписка)"""
+
+    @abstractmethod
+    def is_digest_subscribed(self, user_id: int) -> bool:
+        """Подписан ли пользователь на утреннюю сводку"""
+
+    @abstractmethod
+    def get_digest_data(self, digest_date: date, week_days: int = 7, symptom_days: int = 3) -> Dict[int, DigestData]:
+        """Данные сводок всех подписчиков пакетными запросами: user_id -> DigestData"""
+
+    @abstractmethod
+    def save_digests(self, digest_date: date, texts: Dict[int, str]) -> int:
+        """Сохранение готовых текстов сводок за день; сводки прошлых дней удаляются"""
+
+    @abstractmethod
+    def get_pending_digests(self, digest_date: date, after_user_id: int = 0, limit: int = 500) -> List[Tuple[int, str]]:
+        """Неотправленные сводки за день по возрастанию user_id: (user_id, текст)"""
+
+    @abstractmethod
+    def mark_digests_sent(self, digest_date: date, user_ids: List[int]) -> bool:
+        """Отметка об отправке сводок"""
+
+    def tail_changes(self, after_seq: int = 0, batch_size: int = 1000) -> Iterator[Dict]:
+        """Все изменения после after_seq порциями; seq последней записи - смещение для следующего вызова"""
+        while True:
+            changes = self.get_changes(after_seq, batch_size)
+            yield from changes
+            if len(changes) < batch_size:
+                return
+            after_seq = changes[-1]['seq']
+
+    def get_recent_days(self, user_id: int, days_count: int = 3) -> List[Dict]:
+        """Получение данных за последние N дней"""
+        recent_days = []
+
+        for i in range(days_count):
+            target_date = date.today() - timedelta(days=i)
+            recent_days.append({
+                'date': target_date,
+                'summary': self.get_day_summary(user_id, target_date)
+            })
+
+        return recent_days
+
+    def count_user_days(self, user_id: int) -> int:
+        """Количество дней пользователя с любыми данными"""
+        return len(self.get_user_days(user_id, limit=1000000))
+
+    def iter_day_summaries(self, user_id: int, batch_size: int = 100) -> Iterator[Tuple[date, DaySummary]]:
+        """Сводки всех дней пользователя по возрастанию даты"""
+        for day_date, _ in reversed(self.get_user_days(user_id, limit=1000000)):
+            yield day_date, self.get_day_summary(user_id, day_date)
+
+    def get_sleep_series(self, user_id: int, start_date: date, end_date: date) -> List[Tuple[date, Optional[str], int]]:
+        """Данные для графиков: (дата, время засыпания, общее время сна в минутах) по дням"""
+        series = []
+        current = start_date
+        while current <= end_date:
+            summary = self.get_day_summary(user_id, current)
+            if summary.sleep_time or summary.total_sleep_all_minutes:
+                sleep_time = summary.sleep_time.isoformat() if summary.sleep_time else None
+                series.append((current, sleep_time, summary.total_sleep_all_minutes))
+            current += timedelta(days=1)
+        return series
+
+    def get_sleep_sessions(self, user_id: int, start: datetime, end: datetime) -> List[SleepSession]:
+        """Интервалы сна, пересекающие [start, end), по возрастанию начала"""
+        sessions = []
+        earliest = start - timedelta(hours=config.SLEEP_SESSION_MAX_HOURS)
+        current = earliest.date()
+        while current <= end.date():
+            summary = self.get_day_summary(user_id, current)
+            main = main_sleep_interval(summary.sleep_time, summary.wake_time)
+            if main:
+                sessions.append(SleepSession('main', current.isoformat(), main[0], main[1], summary.total_sleep_minutes))
+            elif summary.sleep_time:
+                sessions.append(SleepSession('main', current.isoformat(), summary.sleep_time, None, None))
+            for nap in summary.additional_sleeps:
+                sessions.append(SleepSession('nap', current.isoformat(), nap.sleep_time, nap.wake_time, nap.sleep_minutes))
+            current += timedelta(days=1)
+        sessions = [
+            session for session in sessions
+            if earliest <= session.start < end and (session.end is None or session.end > start)
+        ]
+        return sorted(sessions, key=lambda session: session.start)
+
+    def archive_days_before(self, cutoff: date, batch_size: int = 500) -> int:
+        """Перенос дней старше cutoff в архив; без поддержки архива ничего не делает"""
+        return 0
+
+    def get_archived_days(self, user_id: int, limit: int = 30, offset: int = 0) -> List[Tuple[date, bool]]:
+        """Получение списка архивных дней пользователя"""
+        return []
+
+    def get_archived_day_summary(self, user_id: int, target_date: date) -> Optional[DaySummary]:
+        """Получение сводки архивного дня"""
+        return None
+
+    def compact(self, max_pages: int = 1000):
+        """Освобождение места и обновление статистики после архивации"""
+
+    def backup(self, target_path: str, pages: int = 256, sleep: float = 0.005) -> Dict:
+        """Онлайн-копия базы в файл"""
+        raise NotImplementedError(f"{type(self).__name__} does not support online backup")
+
+    def close(self):
+        """Освобождение ресурсов хранилища"""
+
+
+def apply_sleep_event(previous: Optional[DayState], kind: str, at: datetime) -> DayState:
+    """Состояние дня после засыпания или пробуждения в at.
+
+    Как в record_sleep и record_wake: вторая граница сна сохраняется, отметка
+    'не спал' снимается; сон через полночь считается по main_sleep_interval.
+    """
+    sleep_time, wake_time, total_sleep_minutes, _ = previous or (None, None, None, False)
+    if kind == 'sleep':
+        sleep_time = at.isoformat()
+    else:
+        wake_time = at.isoformat()
+        total_sleep_minutes = 0
+    interval = main_sleep_interval(sleep_time, wake_time)
+    if interval:
+        total_sleep_minutes = int((interval[1] - interval[0]).total_seconds() / 60)
+    return sleep_time, wake_time, total_sleep_minutes, False
+
+
+def normalize_symptom(text: str) -> str:
+    """Ключ каталога симптомов: без учета регистра и лишних пробелов"""
+    return ' '.join(text.lower().split())
+
+
+def namespace_path(path: str, namespace: str = None) -> str:
+    """Файл пространства имен: sleep_tracker.db -> sleep_tracker.<namespace>.db"""
+    if not namespace or not path:
+        return path
+    base, ext = os.path.splitext(path)
+    return f"{base}.{namespace}{ext}"
+
+
+# Пул PostgreSQL, общий для всех пространств имен процесса
+_shared_postgres = None
+_shared_postgres_lock = threading.Lock()
+
+
+def create_database(backend: str = None, namespace: str = None) -> Storage:
+    """Создание хранилища по настройкам из config.py.
+
+    namespace отделяет данные одного бота от других в том же процессе:
+    в SQLite это отдельные файлы базы и архива, в PostgreSQL - отдельная
+    схема поверх общего пула соединений.
+    """
+    global _shared_postgres
+    backend = backend or config.DATABASE_BACKEND
+
+    if backend == "sqlite":
+        from database import Database
+        storage = Database(
+            namespace_path(config.DATABASE_NAME, namespace),
+            archive_name=namespace_path(config.ARCHIVE_DATABASE_NAME, namespace)
+        )
+    elif backend == "postgres":
+        # asyncpg импортируется только при выборе PostgreSQL
+        from postgres_database import PostgresDatabase
+        if namespace is None:
+            storage = PostgresDatabase(
+                config.POSTGRES_DSN,
+                min_size=config.POSTGRES_POOL_MIN_SIZE,
+                max_size=config.POSTGRES_POOL_MAX_SIZE
+            )
+        else:
+            with _shared_postgres_lock:
+                storage = PostgresDatabase(
+                    config.POSTGRES_DSN,
+                    min_size=config.POSTGRES_POOL_MIN_SIZE,
+                    max_size=config.POSTGRES_POOL_MAX_SIZE,
+                    schema=namespace,
+                    pool_of=_shared_postgres
+                )
+                _shared_postgres = storage
+    else:
+        raise ValueError(f"Unknown database backend: {backend}")
+
+    storage.namespace = namespace
+    return storage
+
+
+class LazyStorage:
+    """Хранилище, которое создается при первом обращении.
+
+    Импорт bot.py не открывает базу; инициализация выполняется один раз,
+    в том потоке, который первым обратился к хранилищу.
+    """
+
+    def __init__(self, factory=create_database):
+        self._factory = factory
+        self._storage = None
+        self._lock = threading.Lock()
+
+    def get(self) -> Storage:
+        """Получение (и при необходимости создание) хранилища"""
+        if self._storage is None:
+            with self._lock:
+                if self._storage is None:
+                    with startup_report.measure("инициализация БД"):
+                        self._storage = self._factory()
+        return self._storage
+
+    def close(self):
+        """Закрытие хранилища, если оно уже было создано"""
+        if self._storage is not None:
+            self._storage.close()
+
+    def __getattr__(self, name):
+        return getattr(self.get(), name)
@@ -0,0 +1,292 @@
+import asyncio
+import logging
+import multiprocessing
+import queue
+import signal
+import threading
+import time
+from collections import deque
+from typing import Deque, Dict, List
+
+from telegram import Bot, Update
+from telegram.ext import Updater
+
+import config
+
+logger = logging.getLogger(__name__)
+
+
+def shard_for_update(update: Update, workers: int) -> int:
+    """Номер воркера для обновления: все обновления пользователя идут в один процесс"""
+    user = update.effective_user
+    return user.id % workers if user else 0
+
+
+def worker_main(index: int, updates, heartbeats, update_started, processed, busy_seconds):
+    """Точка входа рабочего процесса"""
+    # Останавливает воркер супервизор (через None в очереди), а не сигнал терминала
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    asyncio.run(_worker_loop(index, updates, heartbeats, update_started, processed, busy_seconds))
+
+
+def _heartbeat_loop(index: int, heartbeats):
+    """Heartbeat из отдельного потока: долгий обработчик не выглядит зависшим процессом"""
+    while True:
+        heartbeats[index] = time.time()
+        time.sleep(config.WORKER_HEARTBEAT_INTERVAL)
+
+
+async def _worker_loop(index: int, updates, heartbeats, update_started, processed, busy_seconds):
+    """Обработка обновлений, полученных от супервизора"""
+    # Импорт здесь, чтобы каждый воркер сам создавал соединение с хранилищем
+    from bot import build_application
+
+    # У каждого воркера свои пользователи (user_id % N), поэтому и свой файл состояния
+    persistence_file = f"{config.PERSISTENCE_FILE}.{index}" if config.PERSISTENCE_FILE else None
+    application = build_application(with_updater=False, schedule_jobs=index == 0, persistence_file=persistence_file)
+    loop = asyncio.get_running_loop()
+
+    async with application:
+        await application.start()
+        # run_polling здесь не вызывается, поэтому post_init запускаем сами
+        if application.post_init:
+            await application.post_init(application)
+        logger.info(f"Worker {index} started")
+        threading.Thread(target=_heartbeat_loop, args=(index, heartbeats), daemon=True).start()
+
+        while True:
+            try:
+                data = await loop.run_in_executor(None, updates.get, True, 1.0)
+            except queue.Empty:
+                continue
+
+            if data is None:
+                break
+
+            # По времени начала супервизор видит обновление, которое обрабатывается слишком долго
+            update_started[index] = time.time()
+            started = time.perf_counter()
+            try:
+                await application.process_update(Update.de_json(data, application.bot))
+            except Exception as e:
+                logger.error(f"Worker {index} failed to process update: {e}")
+
+            update_started[index] = 0
+            with processed.get_lock():
+                processed[index] += 1
+            with busy_seconds.get_lock():
+                busy_seconds[index] += time.perf_counter() - started
+
+        await application.stop()
+        # Как и post_init: отложенные записи (активность, отчеты) завершаем сами
+        if application.post_shutdown:
+            await application.post_shutdown(application)
+        logger.info(f"Worker {index} stopped")
+
+
+class Supervisor:
+    """Прием обновлений в одном процессе и раздача их пулу воркеров по user_id % N"""
+
+    def __init__(self, workers: int):
+        self.workers = workers
+        self._ctx = multiprocessing.get_context("spawn")
+        self._queues = [self._ctx.Queue() for _ in range(workers)]
+        # Розданные, но еще не обработанные обновления: при перезапуске воркера
+        # они передаются ему заново через новую очередь
+        self._pending: List[Deque[Dict]] = [deque() for _ in range(workers)]
+        self._stuck_update = [None] * workers
+        self._dropped = [0] * workers
+        self._heartbeats = self._ctx.Array('d', workers)
+        # Время начала текущего обновления воркера, 0 - воркер ждет обновлений
+        self._update_started = self._ctx.Array('d', workers)
+        self._processed = self._ctx.Array('q', workers)
+        self._busy_seconds = self._ctx.Array('d', workers)
+        self._processes: List[multiprocessing.Process] = [None] * workers
+        self._restarts = [0] * workers
+        self._dispatched = [0] * workers
+        self._last_processed = [0] * workers
+        self._last_check = time.monotonic()
+
+    def _start_worker(self, index: int):
+        """Запуск воркера"""
+        self._heartbeats[index] = time.time()
+        self._update_started[index] = 0
+        process = self._ctx.Process(
+            target=worker_main,
+            args=(index, self._queues[index], self._heartbeats, self._update_started, self._processed, self._busy_seconds),
+            name=f"sleepy-worker-{index}",
+            daemon=True
+        )
+        process.start()
+        self._processes[index] = process
+
+    def dispatch(self, update: Update):
+        """Передача обновления воркеру пользователя"""
+        index = shard_for_update(update, self.workers)
+        data = update.to_dict()
+        self._queues[index].put(data)
+        self._pending[index].append(data)
+        self._dispatched[index] += 1
+
+    def _trim_pending(self, index: int):
+        """Удаление обработанных обновлений: очередь FIFO, поэтому это первые в списке"""
+        pending = self._pending[index]
+        unprocessed = self._dispatched[index] - self._dropped[index] - self._processed[index]
+        for _ in range(len(pending) - unprocessed):
+            pending.popleft()
+
+    def _restart_worker(self, index: int):
+        """Перезапуск воркера с новой очередью.
+
+        Убитый или упавший внутри Queue.get процесс может оставить захваченной
+        блокировку чтения очереди, и новый воркер ждал бы ее вечно. Поэтому
+        старая очередь бросается, а необработанные обновления раздаются заново.
+        Обновление, на котором воркер падал или зависал два раза подряд, пропускается.
+        """
+        # Обновление виновато, только если воркер был занят им в момент падения
+        busy = self._update_started[index] > 0
+        self._trim_pending(index)
+        pending = self._pending[index]
+        if busy and pending and pending[0].get('update_id') == self._stuck_update[index]:
+            logger.error(f"Worker {index} failed twice on update {self._stuck_update[index]}, dropping it")
+            pending.popleft()
+            self._dropped[index] += 1
+            busy = False
+        self._stuck_update[index] = pending[0].get('update_id') if busy and pending else None
+
+        old_queue = self._queues[index]
+        # Фоновый поток старой очереди не должен ждать при выходе, пока ее кто-то прочитает
+        old_queue.cancel_join_thread()
+        old_queue.close()
+        self._queues[index] = self._ctx.Queue()
+        for data in pending:
+            self._queues[index].put(data)
+        if pending:
+            logger.warning(f"Worker {index}: re-dispatching {len(pending)} pending updates")
+
+        self._restarts[index] += 1
+        self._start_worker(index)
+
+    def check_health(self):
+        """Перезапуск упавших или зависших воркеров"""
+        now = time.time()
+        for index, process in enumerate(self._processes):
+            started = self._update_started[index]
+            if not process.is_alive():
+                logger.warning(f"Worker {index} exited with code {process.exitcode}, restarting")
+            elif started and now - started > config.WORKER_UPDATE_TIMEOUT:
+                logger.warning(f"Worker {index} stuck on one update for {now - started:.0f}s, restarting")
+                process.kill()
+                process.join()
+            elif now - self._heartbeats[index] > config.WORKER_HEARTBEAT_TIMEOUT:
+                logger.warning(f"Worker {index} missed heartbeat, restarting")
+                process.kill()
+                process.join()
+            else:
+                self._trim_pending(index)
+                continue
+
+            self._restart_worker(index)
+
+    def get_stats(self) -> List[Dict]:
+        """Статистика по воркерам: пропускная способность с прошлой проверки"""
+        elapsed = max(time.monotonic() - self._last_check, 1e-9)
+        stats = []
+        for index in range(self.workers):
+            processed = self._processed[index]
+            stats.append({
+                'worker': index,
+                'alive': self._processes[index].is_alive(),
+                'dispatched': self._dispatched[index],
+                'processed': processed,
+                'queued': self._dispatched[index] - self._dropped[index] - processed,
+                'dropped': self._dropped[index],
+                'updates_per_sec': (processed - self._last_processed[index]) / elapsed,
+                'avg_handle_ms': self._busy_seconds[index] / processed * 1000 if processed else 0.0,
+                'restarts': self._restarts[index]
+            })
+            self._last_processed[index] = processed
+        self._last_check = time.monotonic()
+        return stats
+
+    async def _monitor(self):
+        """Периодическая проверка здоровья и вывод статистики"""
+        while True:
+            await asyncio.sleep(config.WORKER_HEALTH_INTERVAL)
+            self.check_health()
+            for stat in self.get_stats():
+                logger.info(
+                    "Worker %(worker)s: alive=%(alive)s processed=%(processed)s queued=%(queued)s "
+                    "dropped=%(dropped)s rate=%(updates_per_sec).1f/s avg=%(avg_handle_ms).1fms restarts=%(restarts)s" % stat
+                )
+
+    async def run(self):
+        """Прием обновлений (polling или webhook) и раздача воркерам"""
+        for index in range(self.workers):
+            self._start_worker(index)
+
+        update_queue = asyncio.Queue()
+        updater = Updater(Bot(config.BOT_TOKEN, base_url=config.BOT_API_BASE_URL), update_queue)
+        monitor = asyncio.create_task(self._monitor())
+
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, stop.set)
+            except NotImplementedError:
+                pass
+
+        try:
+            async with updater:
+                if config.WEBHOOK_URL:
+                    await updater.start_webhook(
+                        listen=config.WEBHOOK_LISTEN,
+                        port=config.WEBHOOK_PORT,
+                        url_path=config.WEBHOOK_PATH,
+                        webhook_url=config.WEBHOOK_URL,
+                        allowed_updates=Update.ALL_TYPES
+                    )
+                else:
+                    await updater.start_polling(allowed_updates=Update.ALL_TYPES)
+
+                stopping = asyncio.create_task(stop.wait())
+                try:
+                    while True:
+                        getting = asyncio.create_task(update_queue.get())
+                        await asyncio.wait({getting, stopping}, return_when=asyncio.FIRST_COMPLETED)
+                        if not getting.done():
+                            getting.cancel()
+                            break
+                        self.dispatch(getting.result())
+                finally:
+                    stopping.cancel()
+                    # Polling подтверждает offset всех полученных обновлений,
+                    # поэтому уже полученные раздаем воркерам, а не теряем
+                    await updater.stop()
+                    while not update_queue.empty():
+                        self.dispatch(update_queue.get_nowait())
+        finally:
+            monitor.cancel()
+            started = time.perf_counter()
+            self.shutdown()
+            logger.warning(f"Workers stopped in {time.perf_counter() - started:.2f}s")
+
+    def shutdown(self):
+        """Остановка воркеров после обработки уже розданных обновлений"""
+        for update_queue in self._queues:
+            update_queue.put(None)
+        for process in self._processes:
+            if process is not None:
+                process.join(timeout=config.SHUTDOWN_DRAIN_TIMEOUT)
+                if process.is_alive():
+                    process.kill()
+
+
+def run_supervisor(workers: int):
+    """Запуск бота в режиме супервизора"""
+    try:
+        asyncio.run(Supervisor(workers).run())
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,49 @@
+import asyncio
+import os
+import sys
+import uuid
+from urllib.parse import urlsplit, urlunsplit
+
+import pytest
+
+# Модули бота лежат в корне репозитория
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(scope='session')
+def postgres_dsn(tmp_path_factory):
+    pytest.importorskip('asyncpg')
+    dsn = os.environ.get('TEST_POSTGRES_DSN')
+    if dsn:
+        yield dsn
+        return
+    pgserver = pytest.importorskip('pgserver', reason="TEST_POSTGRES_DSN не задан и pgserver не установлен")
+    server = pgserver.get_server(str(tmp_path_factory.mktemp('postgres')), cleanup_mode='stop')
+    yield server.get_uri()
+    server.cleanup()
+
+
+def admin_execute(dsn: str, statement: str):
+    import asyncpg
+
+    async def _execute():
+        conn = await asyncpg.connect(dsn)
+        try:
+            await conn.execute(statement)
+        finally:
+            await conn.close()
+
+    asyncio.run(_execute())
+
+
+def drop_schema(dsn: str, schema: str):
+    admin_execute(dsn, f'DROP SCHEMA IF EXISTS "{schema}" CASCADE')
+
+
+@pytest.fixture
+def postgres_database(postgres_dsn):
+    """DSN пустой базы, удаляемой после теста"""
+    name = f"test_{uuid.uuid4().hex[:12]}"
+    admin_execute(postgres_dsn, f'CREATE DATABASE "{name}"')
+    yield urlunsplit(urlsplit(postgres_dsn)._replace(path=f"/{name}"))
+    admin_execute(postgres_dsn, f'DROP DATABASE IF EXISTS "{name}"')
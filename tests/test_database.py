@@ -0,0 +1,46 @@
+"""Поведение, которое есть только у хранилища SQLite: архив и счетчики симптомов"""
+import sqlite3
+from datetime import date, timedelta
+
+import pytest
+
+from database import Database
+
+OLD_DAY = date.today() - timedelta(days=400)
+
+
+@pytest.fixture
+def db(tmp_path):
+    db = Database(str(tmp_path / 'test.db'), archive_name=str(tmp_path / 'archive.db'))
+    yield db
+    db.close()
+
+
+def uses(db, user_id):
+    with sqlite3.connect(db.db_name) as conn:
+        return dict(conn.execute(
+            'SELECT c.text, u.uses FROM symptom_usage u JOIN symptom_catalog c ON c.id = u.catalog_id WHERE u.user_id = ?',
+            (user_id,)
+        ))
+
+
+def test_archive_keeps_symptom_usage(db):
+    db.add_symptom(1, "головная боль", OLD_DAY)
+    db.add_symptom(1, "головная боль", OLD_DAY + timedelta(days=1))
+    db.add_symptom(1, "головная боль")
+
+    assert db.archive_days_before(date.today() - timedelta(days=30)) == 2
+
+    assert uses(db, 1) == {"головная боль": 3}
+    assert [text for _, text in db.get_top_symptoms(1)] == ["головная боль"]
+
+
+def test_delete_symptom_decrements_usage(db):
+    db.add_symptom(1, "тошнота")
+    db.add_symptom(1, "тошнота")
+    with sqlite3.connect(db.db_name) as conn:
+        symptom_id = conn.execute('SELECT MAX(id) FROM symptoms').fetchone()[0]
+
+    assert db.delete_symptom(symptom_id)
+
+    assert uses(db, 1) == {"тошнота": 1}
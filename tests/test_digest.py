@@ -0,0 +1,93 @@
+"""Сборка и рассылка утренних сводок с поддельным ботом и остановленными часами"""
+import asyncio
+from collections import Counter
+from datetime import date, datetime, timedelta
+
+import pytest
+from telegram.error import Forbidden, RetryAfter
+
+from database import Database
+from digest import DigestService
+from models import DigestData
+
+DIGEST_DATE = date(2026, 3, 10)
+LAST_DATE = DIGEST_DATE - timedelta(days=1)
+
+
+class FrozenClock:
+    """Часы стоят, пока их не сдвинет ожидание"""
+
+    def __init__(self, now: datetime):
+        self.now = now
+        self.sleeps = []
+
+    def __call__(self) -> datetime:
+        return self.now
+
+    async def sleep(self, seconds: float):
+        self.sleeps.append(seconds)
+        self.now += timedelta(seconds=seconds)
+
+
+class FakeBot:
+    """Запоминает отправленные сообщения и время отправки по часам сервиса"""
+
+    def __init__(self, clock: FrozenClock, blocked=(), retry_once=()):
+        self.clock = clock
+        self.blocked = set(blocked)
+        self.retry_once = set(retry_once)
+        self.sent = []
+
+    async def send_message(self, chat_id, text):
+        if chat_id in self.blocked:
+            raise Forbidden("Forbidden: bot was blocked by the user")
+        if chat_id in self.retry_once:
+            self.retry_once.discard(chat_id)
+            raise RetryAfter(3)
+        self.sent.append((self.clock(), chat_id, text))
+
+
+@pytest.fixture
+def db(tmp_path):
+    db = Database(str(tmp_path / 'test.db'))
+    for user_id in range(1, 6):
+        db.add_user(user_id, f"user{user_id}", "Имя", None)
+        db.set_digest_subscription(user_id, True)
+    db.add_user(6, "user6", "Имя", None)
+    yield db
+    db.close()
+
+
+def test_send_builds_and_rate_limits_digests(db):
+    db.record_sleep(1, datetime(2026, 3, 8, 23, 0), LAST_DATE)
+    db.record_wake(1, datetime(2026, 3, 9, 7, 30), LAST_DATE)
+    db.add_symptom(1, "головная боль", LAST_DATE)
+    clock = FrozenClock(datetime(2026, 3, 10, 8, 0))
+    bot = FakeBot(clock, blocked={4}, retry_once={2})
+    service = DigestService(db, clock=clock, sleep=clock.sleep, rate=2)
+
+    result = asyncio.run(service.send(bot))
+
+    assert result == {'sent': 4, 'failed': 1}
+    assert sorted(chat_id for _, chat_id, _ in bot.sent) == [1, 2, 3, 5]
+    text = next(text for _, chat_id, text in bot.sent if chat_id == 1)
+    assert "💤 Сон: 23:00 - 07:30, всего 8ч 30м" in text
+    assert "головная боль" in text
+    # Не больше rate сообщений за секунду часов сервиса
+    assert max(Counter(sent_at for sent_at, _, _ in bot.sent).values()) <= 2
+    assert 3 in clock.sleeps  # RetryAfter
+    # Заблокировавший бота отписан, повторная рассылка в тот же день ничего не шлет
+    assert not db.is_digest_subscribed(4)
+    assert asyncio.run(service.send(bot)) == {'sent': 0, 'failed': 0}
+    assert db.get_pending_digests(DIGEST_DATE) == []
+
+
+def test_collect_skips_users_subscribed_after_listing():
+    day_rows = [(1, LAST_DATE.isoformat(), None, None, 0, True), (7, LAST_DATE.isoformat(), None, None, 480, False)]
+    nap_rows = [(7, LAST_DATE.isoformat(), '2026-03-09T14:00:00', '2026-03-09T14:40:00')]
+    symptom_rows = [(7, LAST_DATE.isoformat(), '2026-03-09 10:00:00', "кашель")]
+
+    digests = DigestData.collect(LAST_DATE.isoformat(), [1], day_rows, nap_rows, symptom_rows)
+
+    assert list(digests) == [1]
+    assert digests[1].no_sleep
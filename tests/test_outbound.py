@@ -0,0 +1,104 @@
+"""Приоритет полос PriorityRequest на локальном поддельном сервере Bot API"""
+import asyncio
+import json
+from urllib.parse import parse_qs
+
+from telegram import Bot
+
+from outbound import PriorityRequest, bulk_lane
+
+# Время ответа на отправку сообщения: запросы успевают выстроиться в очередь
+RESPONSE_DELAY = 0.05
+
+
+class FakeBotApi:
+    """HTTP/1.1 сервер с keep-alive: отвечает на любой метод и запоминает порядок отправок"""
+
+    def __init__(self):
+        self.received = []
+        self._server = None
+
+    async def start(self) -> str:
+        self._server = await asyncio.start_server(self._serve, '127.0.0.1', 0)
+        port = self._server.sockets[0].getsockname()[1]
+        return f"http://127.0.0.1:{port}/bot"
+
+    async def stop(self):
+        self._server.close()
+        await self._server.wait_closed()
+
+    async def _serve(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                headers = {}
+                while (line := await reader.readline()) not in (b'\r\n', b''):
+                    name, _, value = line.decode().partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get('content-length', 0)))
+                method = request_line.split()[1].decode().rsplit('/', 1)[-1]
+                payload = await self._respond(method, self._parse(body, headers.get('content-type', '')))
+                writer.write(
+                    b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n"
+                    + f"Content-Length: {len(payload)}\r\n\r\n".encode() + payload
+                )
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    @staticmethod
+    def _parse(body: bytes, content_type: str) -> dict:
+        if content_type.startswith('application/json'):
+            return json.loads(body or b'{}')
+        return {key: values[0] for key, values in parse_qs(body.decode()).items()}
+
+    async def _respond(self, method: str, params: dict) -> bytes:
+        if method == 'getMe':
+            result = {'id': 1, 'is_bot': True, 'first_name': 'Test', 'username': 'test_bot'}
+        else:
+            # Порядок фиксируется при получении запроса, ответ - после паузы
+            self.received.append(params.get('text'))
+            await asyncio.sleep(RESPONSE_DELAY)
+            result = {'message_id': len(self.received), 'date': 0, 'text': params.get('text'),
+                      'chat': {'id': int(params.get('chat_id', 1)), 'type': 'private'}}
+        return json.dumps({'ok': True, 'result': result}).encode()
+
+
+def test_interactive_requests_overtake_full_bulk_lane():
+    async def scenario():
+        api = FakeBotApi()
+        base_url = await api.start()
+        request = PriorityRequest(max_connections=2, bulk_connections=2)
+        bot = Bot("123:TEST", base_url=base_url, request=request)
+
+        async def send_bulk(index):
+            with bulk_lane():
+                await bot.send_message(1, f"bulk-{index}")
+
+        try:
+            await bot.initialize()
+            bulk = [asyncio.create_task(send_bulk(index)) for index in range(6)]
+            await asyncio.sleep(RESPONSE_DELAY / 2)
+            queued = request.stats()['bulk']['queued']
+
+            interactive = [asyncio.create_task(bot.send_message(1, f"user-{index}")) for index in range(2)]
+            await asyncio.gather(*bulk, *interactive)
+        finally:
+            await bot.shutdown()
+            await api.stop()
+        return api.received, queued, request.stats()
+
+    received, queued, stats = asyncio.run(scenario())
+
+    # Оба соединения заняты фоновыми отправками, остальные ждут в очереди полосы
+    assert queued == 4
+    assert received[:2] == ['bulk-0', 'bulk-1']
+    # Освободившиеся соединения достаются ответам пользователю раньше ожидающих рассылок
+    assert sorted(received[2:4]) == ['user-0', 'user-1']
+    assert received[4:] == ['bulk-2', 'bulk-3', 'bulk-4', 'bulk-5']
+    assert stats['interactive']['sent'] == 3  # getMe и два сообщения
+    assert stats['bulk']['sent'] == 6
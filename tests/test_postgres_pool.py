@@ -0,0 +1,68 @@
+"""Общий пул PostgreSQL для нескольких пространств имен процесса"""
+import uuid
+from datetime import date
+
+import pytest
+
+import config
+import storage as storage_module
+from conftest import drop_schema
+from storage import create_database
+
+
+@pytest.fixture
+def postgres_config(postgres_dsn, monkeypatch):
+    monkeypatch.setattr(config, 'POSTGRES_DSN', postgres_dsn)
+    monkeypatch.setattr(storage_module, '_shared_postgres', None)
+    schemas = []
+    yield schemas
+    for schema in schemas:
+        drop_schema(postgres_dsn, schema)
+
+
+def open_namespace(schemas):
+    namespace = f"test_{uuid.uuid4().hex[:12]}"
+    schemas.append(namespace)
+    return create_database('postgres', namespace)
+
+
+def test_namespaces_share_one_pool(postgres_config):
+    first, second = open_namespace(postgres_config), open_namespace(postgres_config)
+    try:
+        assert first._pool is second._pool
+        first.add_user(1, "first", "Имя", None)
+        assert second.get_user_days(1) == []
+    finally:
+        first.close()
+        second.close()
+
+
+def test_pool_reopens_after_last_close(postgres_config):
+    # Так живет воркер отчетов: хранилище открывается и закрывается на каждое задание
+    first = open_namespace(postgres_config)
+    first.close()
+    first.close()
+
+    second = open_namespace(postgres_config)
+    try:
+        assert second._pool is not first._pool
+        assert second.record_no_sleep(1)
+        assert second.check_existing_sleep_data(1, date.today())['no_sleep']
+    finally:
+        second.close()
+
+
+def test_slow_call_times_out(postgres_config, monkeypatch):
+    monkeypatch.setattr(config, 'POSTGRES_TIMEOUT', 0.2)
+    db = open_namespace(postgres_config)
+    try:
+        async def _slow():
+            async with db._acquire() as conn:
+                await conn.execute('SELECT pg_sleep(5)')
+
+        with pytest.raises(TimeoutError):
+            db._run(_slow())
+        # Соединение вернулось в пул, хранилище работает дальше
+        assert db.record_no_sleep(2)
+    finally:
+        db.close()
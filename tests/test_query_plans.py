@@ -0,0 +1,12 @@
+"""Регрессия плана запроса (полный просмотр или временное B-дерево) валит сборку"""
+from database import Database
+from query_plans import check, populate
+
+
+def test_queries_use_indexes(tmp_path):
+    db = Database(str(tmp_path / 'plans.db'), archive_name=str(tmp_path / 'plans_archive.db'))
+    populate(db, users=100, days=120)
+
+    failures = check(db, verbose=False)
+
+    assert not failures, "\n".join(f"{method}: {'; '.join(problems)}\n    {sql[:200]}" for method, sql, problems in failures)
@@ -0,0 +1,244 @@
+"""Общий контракт Storage для SQLite и PostgreSQL.
+
+PostgreSQL берется из TEST_POSTGRES_DSN; без него тесты поднимают временный
+сервер через pgserver (pip install pgserver), а если его нет - пропускаются.
+Каждый тест PostgreSQL работает в своей временной базе.
+"""
+import logging
+from datetime import date, datetime, timedelta
+
+import pytest
+
+from database import Database
+
+TODAY = date.today()
+YESTERDAY = TODAY - timedelta(days=1)
+
+
+@pytest.fixture(params=['sqlite', 'postgres'])
+def storage(request, tmp_path, caplog):
+    if request.param == 'sqlite':
+        storage = Database(str(tmp_path / 'test.db'))
+    else:
+        from postgres_database import PostgresDatabase
+        storage = PostgresDatabase(request.getfixturevalue('postgres_database'))
+    yield storage
+    storage.close()
+
+    # Методы хранилища не бросают исключения, а пишут ошибку в лог
+    errors = [record.getMessage() for record in caplog.records if record.levelno >= logging.ERROR]
+    assert not errors
+
+
+def test_sleep_and_wake(storage):
+    sleep_time = datetime.combine(YESTERDAY, datetime.min.time()) + timedelta(hours=23)
+    assert storage.record_sleep(1, sleep_time, TODAY)
+    assert storage.record_wake(1, sleep_time + timedelta(hours=7, minutes=30), TODAY)
+
+    summary = storage.get_day_summary(1, TODAY)
+    assert summary.sleep_time == sleep_time
+    assert summary.wake_time == sleep_time + timedelta(hours=7, minutes=30)
+    assert summary.total_sleep_minutes == 450
+    assert summary.total_sleep_all_minutes == 450
+
+    existing = storage.check_existing_sleep_data(1, TODAY)
+    assert existing['exists'] and existing['total_sleep_minutes'] == 450 and not existing['no_sleep']
+    assert storage.check_existing_sleep_data(1, YESTERDAY) == {'exists': False}
+
+
+def test_no_sleep_and_user_days(storage):
+    storage.add_user(1, "user", "Имя", None)
+    assert storage.record_no_sleep(1, YESTERDAY)
+    assert storage.add_symptom(1, "Кашель", TODAY)
+
+    assert storage.get_day_summary(1, YESTERDAY).no_sleep
+    assert storage.get_user_days(1) == [(TODAY, False), (YESTERDAY, True)]
+    assert [day['date'] for day in storage.get_recent_days(1, 2)] == [TODAY, YESTERDAY]
+    assert storage.count_user_days(1) == 2
+    assert [day for day, _ in storage.iter_day_summaries(1, batch_size=1)] == [YESTERDAY, TODAY]
+
+
+def test_additional_sleeps_and_symptoms(storage):
+    start = datetime.combine(TODAY, datetime.min.time()) + timedelta(hours=14)
+    assert storage.add_additional_sleep(1, start, start + timedelta(minutes=40), TODAY)
+    assert storage.add_symptom(1, "Головная боль", TODAY)
+    assert storage.add_symptom(1, "Изжога", TODAY)
+
+    summary = storage.get_day_summary(1, TODAY)
+    assert [nap.sleep_minutes for nap in summary.additional_sleeps] == [40]
+    assert summary.total_sleep_all_minutes == 40
+    assert [symptom.text for symptom in summary.symptoms] == ["Головная боль", "Изжога"]
+
+    assert storage.delete_symptom(summary.symptoms[0].id)
+    assert [symptom.text for symptom in storage.get_day_summary(1, TODAY).symptoms] == ["Изжога"]
+
+
+def test_additional_sleep_overlap_counted_once(storage):
+    start = datetime.combine(TODAY, datetime.min.time()) + timedelta(hours=14)
+    assert storage.add_additional_sleep(1, start, start + timedelta(minutes=60), TODAY)
+    assert storage.add_additional_sleep(1, start + timedelta(minutes=30), start + timedelta(minutes=90), TODAY)
+
+    summary = storage.get_day_summary(1, TODAY)
+    assert [nap.sleep_minutes for nap in summary.additional_sleeps] == [60, 60]
+    assert summary.total_sleep_all_minutes == 90
+
+    sessions = storage.get_sleep_sessions(1, start - timedelta(hours=1), start + timedelta(hours=3))
+    assert [(session.kind, session.start) for session in sessions] == [
+        ('nap', start), ('nap', start + timedelta(minutes=30))
+    ]
+    assert storage.get_sleep_series(1, TODAY, TODAY) == [(TODAY, None, 90)]
+
+def test_symptom_catalog(storage):
+    assert storage.add_symptom(1, "Головная  боль", TODAY)
+    assert storage.add_symptom(1, "головная боль", YESTERDAY)
+    assert storage.add_symptom(1, "Изжога", TODAY)
+    assert storage.add_symptom(2, "Изжога", TODAY)
+
+    top = storage.get_top_symptoms(1)
+    # Текст каталога - первое написание без лишних пробелов
+    assert [text for _, text in top] == ["Головная боль", "Изжога"]
+    assert storage.get_catalog_symptom(top[0][0]) == "Головная боль"
+    assert storage.get_catalog_symptom(10 ** 6) is None
+
+    found = storage.search_symptoms(1, "головная")
+    assert sorted(day for day, _ in found) == [YESTERDAY, TODAY]
+    assert storage.search_symptoms(2, "головная") == []
+
+
+def test_delete_day(storage):
+    start = datetime.combine(YESTERDAY, datetime.min.time()) + timedelta(hours=14)
+    storage.record_no_sleep(1, YESTERDAY)
+    storage.add_additional_sleep(1, start, start + timedelta(minutes=40), YESTERDAY)
+    storage.add_symptom(1, "Кашель", YESTERDAY)
+    storage.add_symptom(1, "Изжога", TODAY)
+
+    assert storage.delete_day(1, YESTERDAY)
+    assert not storage.get_day_summary(1, YESTERDAY).has_data()
+    assert storage.get_user_days(1) == [(TODAY, False)]
+
+
+def test_fast_log_and_undo(storage):
+    at = datetime.combine(TODAY, datetime.min.time()) + timedelta(hours=7)
+    storage.record_sleep(1, at - timedelta(hours=8), TODAY)
+
+    previous, written = storage.log_sleep_event(1, 'wake', at, TODAY)
+    assert previous[0] == (at - timedelta(hours=8)).isoformat() and previous[1] is None
+    assert written == ((at - timedelta(hours=8)).isoformat(), at.isoformat(), 480, False)
+    assert storage.get_day_summary(1, TODAY).total_sleep_minutes == 480
+
+    assert storage.undo_sleep_event(1, TODAY, written, previous)
+    assert storage.get_day_summary(1, TODAY).wake_time is None
+    # Повторная отмена не находит записанного состояния
+    assert not storage.undo_sleep_event(1, TODAY, written, previous)
+
+    previous, written = storage.log_sleep_event(1, 'sleep', at, YESTERDAY)
+    assert previous is None
+    assert storage.undo_sleep_event(1, YESTERDAY, written, None)
+    assert storage.check_existing_sleep_data(1, YESTERDAY) == {'exists': False}
+
+
+def test_revision_and_change_log(storage):
+    assert storage.get_revision(1) == 0
+    storage.record_no_sleep(1, TODAY)
+    storage.add_symptom(1, "Кашель", TODAY)
+    storage.record_no_sleep(2, TODAY)
+    assert storage.get_revision(1) == 2
+    assert storage.get_revision(2) == 1
+
+    changes = storage.get_changes()
+    assert [(change['user_id'], change['date'], change['operation']) for change in changes][:1] == [(1, TODAY, 'no_sleep')]
+    assert [change['seq'] for change in changes] == sorted(change['seq'] for change in changes)
+    assert len(changes) == 3
+    assert storage.get_changes(changes[0]['seq'], 1) == changes[1:2]
+    assert list(storage.tail_changes(batch_size=2)) == changes
+    assert storage.prune_changes(30) == 0
+    # add_user не сбрасывает ревизию
+    storage.add_user(1, "user", "Имя", None)
+    assert storage.get_revision(1) == 2
+
+
+def test_postgres_change_log_concurrent_writers(postgres_database, caplog):
+    """Потребитель журнала не пропускает записи параллельных транзакций"""
+    from postgres_database import PostgresDatabase
+    storage = PostgresDatabase(postgres_database)
+    held = []
+
+    async def begin(user_id):
+        conn = await storage._pool.acquire()
+        held.append(conn)
+        transaction = conn.transaction()
+        await transaction.start()
+        # Первая запись назначает транзакции xact_id
+        await storage._bump_revision(conn, user_id)
+        return conn, transaction
+
+    async def commit(conn, transaction):
+        await transaction.commit()
+        held.remove(conn)
+        await storage._pool.release(conn)
+
+    def record(writer, user_id):
+        storage._run(storage._record_change(writer[0], user_id, TODAY.isoformat(), 'no_sleep'))
+
+    try:
+        # Первый писатель раньше получает xact_id, второй - меньший seq
+        first, second = storage._run(begin(1)), storage._run(begin(2))
+        record(second, 2)
+        record(first, 1)
+        storage._run(commit(*first))
+        consumed = storage.get_changes()
+        assert [change['user_id'] for change in consumed] == [1]
+
+        # Третий писатель держит транзакцию, четвертый фиксирует свою запись раньше
+        third = storage._run(begin(3))
+        record(third, 3)
+        storage.record_no_sleep(4, TODAY)
+        # Пока открыт второй или третий, более поздние записи не отдаются
+        assert storage.get_changes(consumed[-1]['seq']) == []
+        storage._run(commit(*second))
+        consumed += storage.get_changes(consumed[-1]['seq'])
+        assert storage.get_changes(consumed[-1]['seq']) == []
+        storage._run(commit(*third))
+        consumed += storage.get_changes(consumed[-1]['seq'])
+
+        assert [change['user_id'] for change in consumed] == [1, 2, 3, 4]
+        assert sorted(change['seq'] for change in consumed) == sorted(change['seq'] for change in storage.get_changes())
+    finally:
+        for conn in held:
+            storage._run(storage._pool.release(conn))
+        storage.close()
+
+    assert not [entry for entry in caplog.records if entry.levelno >= logging.ERROR]
+
+
+def test_activity(storage):
+    now = datetime.now()
+    assert storage.touch_users({1: now, 2: now - timedelta(days=3), 3: now - timedelta(days=20)})
+    # Более старая отметка не перезаписывает новую
+    assert storage.touch_users({1: now - timedelta(days=40)})
+    assert storage.get_activity_counts(now + timedelta(minutes=1)) == {'dau': 1, 'wau': 2, 'mau': 3}
+
+
+def test_digests(storage):
+    sleep_time = datetime.combine(YESTERDAY - timedelta(days=1), datetime.min.time()) + timedelta(hours=23)
+    storage.record_sleep(1, sleep_time, YESTERDAY)
+    storage.record_wake(1, sleep_time + timedelta(hours=8), YESTERDAY)
+    storage.add_symptom(1, "Кашель", YESTERDAY)
+    storage.record_no_sleep(2, YESTERDAY)
+
+    assert storage.set_digest_subscription(1, True)
+    assert storage.is_digest_subscribed(1)
+    assert not storage.is_digest_subscribed(2)
+
+    data = storage.get_digest_data(TODAY)
+    assert list(data) == [1]
+    assert data[1].last_minutes == 480 and data[1].symptoms == ["Кашель"]
+
+    assert storage.save_digests(TODAY, {1: "Сводка", 3: "Другая"}) == 2
+    assert storage.get_pending_digests(TODAY) == [(1, "Сводка"), (3, "Другая")]
+    assert storage.get_pending_digests(TODAY, after_user_id=1) == [(3, "Другая")]
+    assert storage.mark_digests_sent(TODAY, [1])
+    assert storage.get_pending_digests(TODAY) == [(3, "Другая")]
+
+    assert storage.set_digest_subscription(1, False)
+    assert storage.get_digest_data(TODAY) == {}
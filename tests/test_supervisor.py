@@ -0,0 +1,110 @@
+import queue
+import time
+
+from telegram import Update
+
+import config
+from supervisor import Supervisor
+
+
+class FakeProcess:
+    def __init__(self, alive=True):
+        self.alive = alive
+        self.exitcode = None if alive else -9
+
+    def is_alive(self):
+        return self.alive
+
+    def kill(self):
+        self.alive = False
+        self.exitcode = -9
+
+    def join(self, timeout=None):
+        pass
+
+
+def make_supervisor(monkeypatch, workers=1):
+    supervisor = Supervisor(workers)
+    monkeypatch.setattr(supervisor, '_start_worker', lambda index: supervisor._processes.__setitem__(index, FakeProcess()))
+    for index in range(workers):
+        supervisor._start_worker(index)
+    return supervisor
+
+
+def drain(update_queue):
+    items = []
+    while True:
+        try:
+            items.append(update_queue.get(timeout=1))
+        except queue.Empty:
+            return items
+
+
+def dispatch(supervisor, update_id, user_id=1):
+    message = {
+        'message_id': update_id, 'date': 0, 'text': "/start",
+        'chat': {'id': user_id, 'type': 'private'},
+        'from': {'id': user_id, 'is_bot': False, 'first_name': 'User'},
+    }
+    supervisor.dispatch(Update.de_json({'update_id': update_id, 'message': message}, None))
+
+
+def test_restart_uses_fresh_queue_with_pending_updates(monkeypatch):
+    supervisor = make_supervisor(monkeypatch)
+    for update_id in (1, 2, 3):
+        dispatch(supervisor, update_id)
+    old_queue = supervisor._queues[0]
+    # Воркер обработал первое обновление и упал
+    supervisor._processed[0] = 1
+    supervisor._processes[0] = FakeProcess(alive=False)
+
+    supervisor.check_health()
+
+    assert supervisor._queues[0] is not old_queue
+    assert [data['update_id'] for data in drain(supervisor._queues[0])] == [2, 3]
+    assert supervisor.get_stats()[0]['restarts'] == 1
+
+
+def test_update_failing_twice_is_dropped(monkeypatch):
+    supervisor = make_supervisor(monkeypatch)
+    for update_id in (1, 2):
+        dispatch(supervisor, update_id)
+
+    for _ in range(2):
+        # Воркер падает посреди обработки первого обновления
+        supervisor._update_started[0] = time.time()
+        supervisor._processes[0] = FakeProcess(alive=False)
+        supervisor.check_health()
+
+    assert [data['update_id'] for data in drain(supervisor._queues[0])] == [2]
+    stats = supervisor.get_stats()[0]
+    assert stats['dropped'] == 1
+    assert stats['queued'] == 1
+
+
+def test_idle_worker_crash_does_not_blame_update(monkeypatch):
+    supervisor = make_supervisor(monkeypatch)
+    dispatch(supervisor, 1)
+
+    for _ in range(2):
+        supervisor._processes[0] = FakeProcess(alive=False)
+        supervisor.check_health()
+
+    assert [data['update_id'] for data in drain(supervisor._queues[0])] == [1]
+    assert supervisor.get_stats()[0]['dropped'] == 0
+
+
+def test_slow_update_is_not_a_missed_heartbeat(monkeypatch):
+    supervisor = make_supervisor(monkeypatch)
+    dispatch(supervisor, 1)
+    # Обработчик ждет хранилище дольше таймаута heartbeat, поток heartbeat жив
+    supervisor._update_started[0] = time.time() - config.WORKER_HEARTBEAT_TIMEOUT - 1
+    supervisor._heartbeats[0] = time.time()
+
+    supervisor.check_health()
+    assert supervisor.get_stats()[0]['restarts'] == 0
+
+    supervisor._update_started[0] = time.time() - config.WORKER_UPDATE_TIMEOUT - 1
+    supervisor.check_health()
+    assert supervisor.get_stats()[0]['restarts'] == 1
+    assert supervisor._stuck_update[0] == 1